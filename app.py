@@ -3,21 +3,60 @@ Invoice Generator Web Application
 A simple Flask app for generating professional invoices
 """
 
-from flask import Flask, Response, redirect, url_for, render_template, jsonify, request, send_file
+from flask import Flask, Response, redirect, url_for, render_template, jsonify, request, send_file, g, session
+
+from app_logging import configure_from_env, request_id_var
+
+# JSON log lines via a background thread (LOG_LEVEL, LOG_SAMPLE_RATES)
+configure_from_env()
 
 app = Flask(__name__)
 
 from pathlib import Path
+import os
 import json
-from datetime import datetime, timedelta
+import math
+import re
+import hashlib
+import hmac
+import smtplib
+import tempfile
+import atexit
+import logging
+import time
 import uuid
+from functools import wraps
+from urllib.parse import quote as url_quote
+from datetime import datetime, timedelta
+import click
+from typing import Optional
+from werkzeug.utils import secure_filename
 from invoice_generator_web import (
     InvoiceData, 
-    OrderItem, 
     PDFInvoiceGenerator,
     COMPANY_INFO
 )
 from invoice_generator_web_en import PDFInvoiceGenerator as PDFInvoiceGeneratorEN
+from rate_limit import TokenBucketLimiter, ConcurrencySlots
+from vat_rates import VatRateTable, UnknownCountryError
+from invoice_numbers import InvoiceNumberAllocator, NumberBlocks, format_invoice_number, parse_invoice_number
+from invoice_registry import InvoiceRegistry, InvoiceRecord
+from vat_reports import VatReports, quarter_of
+from customers import CustomerStore
+from products import ProductCatalog
+from company_profiles import CompanyProfiles, GeneratorCache, DEFAULT_PROFILE
+from invoice_schema import decode_invoice_payload, decode_quote_payload, ValidationError
+from thumbnails import get_thumbnail, thumbnail_path, ThumbnailUnavailable
+from print_runs import MissingInvoiceFile, write_print_run
+from storage import LocalStorage, S3Storage
+from idempotency import IdempotencyStore, STARTED, REPLAY, MISMATCH
+from invoice_mail import InvoiceMailer, SmtpSettings
+from bulk_import import BulkImporter, IMPORT_CHANNEL
+from marketplaces import MarketplaceSync, MarketplaceError, AmazonConnector, EbayConnector, EtsyConnector
+from shared_cache import SharedCache
+from signing import SigningConfig, signer_for
+
+logger = logging.getLogger(__name__)
 
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
@@ -25,86 +64,296 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 INVOICE_DIR = Path("generated_invoices")
 INVOICE_DIR.mkdir(exist_ok=True)
 
+# Where invoice PDFs are kept: 'local' (INVOICE_DIR) or 's3' (shared bucket,
+# INVOICE_DIR then only caches files and buffers uploads)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local').lower()
+if STORAGE_BACKEND == 's3':
+    storage = S3Storage(
+        bucket=os.environ['S3_BUCKET'],
+        cache_dir=INVOICE_DIR,
+        prefix=os.environ.get('S3_PREFIX', 'invoices/'),
+        endpoint_url=os.environ.get('S3_ENDPOINT_URL'),
+        region=os.environ.get('S3_REGION'),
+        cache_bytes=int(os.environ.get('STORAGE_CACHE_MB', 512)) * 1024 * 1024
+    )
+else:
+    storage = LocalStorage(INVOICE_DIR)
+atexit.register(storage.close)
+
+# Let a front proxy send invoice files after Flask authorized the request:
+# 'nginx' (X-Accel-Redirect to an internal location) or 'sendfile' (X-Sendfile,
+# Apache mod_xsendfile / lighttpd). Unset: Flask streams the files itself.
+FILE_OFFLOAD = os.environ.get('FILE_OFFLOAD', '').lower()
+FILE_OFFLOAD_PREFIX = os.environ.get('FILE_OFFLOAD_PREFIX', '/protected-invoices/')
+app.config['USE_X_SENDFILE'] = FILE_OFFLOAD == 'sendfile'
+
 # Company settings file
 SETTINGS_FILE = Path("company_config.json")
 
+# Additional named company profiles for multi-tenant deployments
+PROFILES_FILE = Path("company_profiles.json")
+
+# Persistent application data (invoice numbers, registry) - lives on the invoice disk
+DATA_DIR = Path(os.environ.get('INVOICE_DATA_DIR', INVOICE_DIR / '.data'))
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+# Host-local state shared by all gunicorn workers (rate limits, render slots)
+RUNTIME_DIR = Path(os.environ.get('INVOICE_RUNTIME_DIR', Path(tempfile.gettempdir()) / 'invoice-generator'))
+
+# Admission control for /api/generate-invoice
+RATE_LIMIT_PER_MINUTE = float(os.environ.get('RATE_LIMIT_PER_MINUTE', 30))
+RATE_LIMIT_BURST = float(os.environ.get('RATE_LIMIT_BURST', 10))
+RATE_LIMIT_COST_BYTES = 64 * 1024  # Every 64KB of payload costs one extra token
+RENDER_CONCURRENCY = int(os.environ.get('RENDER_CONCURRENCY', os.cpu_count() or 2))
+
+rate_limiter = TokenBucketLimiter(
+    RUNTIME_DIR / 'rate_limit.db',
+    rate=RATE_LIMIT_PER_MINUTE / 60.0,
+    burst=RATE_LIMIT_BURST
+)
+render_slots = ConcurrencySlots(RUNTIME_DIR / 'render_slots', RENDER_CONCURRENCY)
+
+# Invoice PDFs and thumbnails in memory shared by all workers (0 disables; unused
+# with FILE_OFFLOAD=nginx, where nginx reads the files itself)
+SHARED_CACHE_MB = int(os.environ.get('SHARED_CACHE_MB', 64))
+SHARED_CACHE_SLOT_KB = int(os.environ.get('SHARED_CACHE_SLOT_KB', 256))
+shared_cache = None
+if SHARED_CACHE_MB > 0 and FILE_OFFLOAD != 'nginx':
+    shared_cache = SharedCache(
+        RUNTIME_DIR / 'shared_cache.bin',
+        size=SHARED_CACHE_MB * 1024 * 1024,
+        slot_size=SHARED_CACHE_SLOT_KB * 1024
+    )
+
+# PAdES signatures on every generated invoice with a local PKCS#12 key (off when unset)
+SIGNING_PKCS12 = os.environ.get('SIGNING_PKCS12')
+invoice_signing = None
+if SIGNING_PKCS12:
+    invoice_signing = SigningConfig(
+        pkcs12_path=SIGNING_PKCS12,
+        passphrase=os.environ.get('SIGNING_PASSPHRASE'),
+        reason=os.environ.get('SIGNING_REASON', 'Invoice'),
+        location=os.environ.get('SIGNING_LOCATION')
+    )
+    signer_for(invoice_signing)  # Fail at startup, not on the first invoice
+
+# Gap-free invoice numbers, one series per year (INV-2026-000001, ...)
+invoice_numbers = InvoiceNumberAllocator(DATA_DIR / 'invoice_numbers.db')
+
+# Searchable record of every generated invoice
+registry = InvoiceRegistry(DATA_DIR / 'invoices.db')
+
+# Responses by Idempotency-Key, so retried requests never create a second invoice
+idempotency = IdempotencyStore(
+    DATA_DIR / 'idempotency.db',
+    ttl=float(os.environ.get('IDEMPOTENCY_TTL_HOURS', 24)) * 3600,
+    wait_timeout=float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 20))
+)
+
+# VAT / OSS rollups, updated in the same transaction as the registry
+vat_reports = VatReports(registry)
+
+# Customer master data for autocomplete, also kept up to date by the registry
+customer_store = CustomerStore(registry)
+
+# Products by SKU: `flask import-products`, completes SKU-only line items
+product_catalog = ProductCatalog(DATA_DIR / 'products.db')
+
+# Invoice emails: queued when an invoice has a buyer email, sent by `flask send-invoices`
+SMTP_HOST = os.environ.get('SMTP_HOST')
+mailer = InvoiceMailer(
+    registry,
+    storage,
+    SmtpSettings(
+        host=SMTP_HOST,
+        port=int(os.environ.get('SMTP_PORT', 587)),
+        username=os.environ.get('SMTP_USERNAME'),
+        password=os.environ.get('SMTP_PASSWORD'),
+        starttls=os.environ.get('SMTP_STARTTLS', '1') != '0',
+        sender=os.environ.get('MAIL_FROM', 'invoices@localhost')
+    ) if SMTP_HOST else None,
+    pool_size=int(os.environ.get('SMTP_POOL_SIZE', 4))
+)
+
+# Marketplace order sync (`flask sync-marketplaces`, e.g. nightly from cron).
+# A marketplace is enabled once its credentials are set; the *_API_URL
+# variables point a connector at a sandbox or a local mock API.
+MARKETPLACE_PROFILE = os.environ.get('MARKETPLACE_COMPANY_PROFILE', DEFAULT_PROFILE)
+MARKETPLACE_SYNC_INITIAL_DAYS = int(os.environ.get('MARKETPLACE_SYNC_INITIAL_DAYS', 30))
+MARKETPLACE_FETCH_CONCURRENCY = int(os.environ.get('MARKETPLACE_FETCH_CONCURRENCY', 4))
+marketplace_sync = MarketplaceSync(registry)
+
+
+def marketplace_connectors():
+    """Connectors of the marketplaces that have credentials configured"""
+    env = os.environ
+    options = {'concurrency': MARKETPLACE_FETCH_CONCURRENCY}
+    connectors = []
+    if env.get('AMAZON_SP_ACCESS_TOKEN'):
+        connectors.append(AmazonConnector(
+            env['AMAZON_SP_ACCESS_TOKEN'],
+            [m.strip() for m in env.get('AMAZON_MARKETPLACE_IDS', 'A1PA6795UKMFR9').split(',') if m.strip()],
+            base_url=env.get('AMAZON_SP_API_URL', 'https://sellingpartnerapi-eu.amazon.com'),
+            **options
+        ))
+    if env.get('EBAY_ACCESS_TOKEN'):
+        connectors.append(EbayConnector(
+            env['EBAY_ACCESS_TOKEN'],
+            base_url=env.get('EBAY_API_URL', 'https://api.ebay.com'),
+            **options
+        ))
+    if env.get('ETSY_API_KEY') and env.get('ETSY_SHOP_ID'):
+        connectors.append(EtsyConnector(
+            env['ETSY_API_KEY'],
+            env.get('ETSY_ACCESS_TOKEN', ''),
+            env['ETSY_SHOP_ID'],
+            base_url=env.get('ETSY_API_URL', 'https://openapi.etsy.com'),
+            **options
+        ))
+    return connectors
+
+# Offline invoice generation from order exports (`flask import-invoices`)
+bulk_importer = BulkImporter(registry)
+
+# Largest print run served over HTTP (bigger runs: `flask print-run`)
+PRINT_RUN_MAX_INVOICES = int(os.environ.get('PRINT_RUN_MAX_INVOICES', 500))
+
+# API keys for endpoints that expose invoice data (comma-separated).
+# Without keys these endpoints are closed, unless API_ALLOW_LOCAL lets
+# requests from localhost through (the default for `python app.py` only;
+# behind a reverse proxy every request comes from localhost).
+API_KEYS = {key.strip() for key in os.environ.get('API_KEYS', '').split(',') if key.strip()}
+API_ALLOW_LOCAL = os.environ.get('API_ALLOW_LOCAL', '1' if __name__ == '__main__' else '0').lower() in ('1', 'true', 'yes')
+
+# Browsers sign in once at /sign-in; the key is then kept in the signed
+# session cookie. Without SECRET_KEY the cookie is signed with a key derived
+# from API_KEYS, which all workers share.
+app.secret_key = os.environ.get('SECRET_KEY') or hashlib.sha256(
+    ('session\n' + '\n'.join(sorted(API_KEYS))).encode('utf-8')).hexdigest()
+app.config.update(SESSION_COOKIE_SAMESITE='Lax', SESSION_COOKIE_HTTPONLY=True)
+
 # EU VAT Rates Database
-# Contains standard and reduced VAT rates for all EU countries
-VAT_RATES = {
-    'AT': {'name': 'Austria', 'standard': 0.20, 'reduced': 0.10},
-    'BE': {'name': 'Belgium', 'standard': 0.21, 'reduced': 0.06},
-    'BG': {'name': 'Bulgaria', 'standard': 0.20, 'reduced': 0.09},
-    'HR': {'name': 'Croatia', 'standard': 0.25, 'reduced': 0.05},
-    'CY': {'name': 'Cyprus', 'standard': 0.19, 'reduced': 0.05},
-    'CZ': {'name': 'Czech Republic', 'standard': 0.21, 'reduced': 0.12},
-    'DK': {'name': 'Denmark', 'standard': 0.25, 'reduced': 0.25},  # No reduced rate
-    'EE': {'name': 'Estonia', 'standard': 0.24, 'reduced': 0.09},
-    'FI': {'name': 'Finland', 'standard': 0.255, 'reduced': 0.10},
-    'FR': {'name': 'France', 'standard': 0.20, 'reduced': 0.055},
-    'DE': {'name': 'Germany', 'standard': 0.19, 'reduced': 0.07},
-    'GR': {'name': 'Greece', 'standard': 0.24, 'reduced': 0.06},
-    'HU': {'name': 'Hungary', 'standard': 0.27, 'reduced': 0.05},
-    'IE': {'name': 'Ireland', 'standard': 0.23, 'reduced': 0.048},
-    'IT': {'name': 'Italy', 'standard': 0.22, 'reduced': 0.10},
-    'LV': {'name': 'Latvia', 'standard': 0.21, 'reduced': 0.05},
-    'LT': {'name': 'Lithuania', 'standard': 0.21, 'reduced': 0.05},
-    'LU': {'name': 'Luxembourg', 'standard': 0.17, 'reduced': 0.03},
-    'MT': {'name': 'Malta', 'standard': 0.18, 'reduced': 0.05},
-    'NL': {'name': 'Netherlands', 'standard': 0.21, 'reduced': 0.09},
-    'PL': {'name': 'Poland', 'standard': 0.23, 'reduced': 0.05},
-    'PT': {'name': 'Portugal', 'standard': 0.23, 'reduced': 0.06},
-    'RO': {'name': 'Romania', 'standard': 0.21, 'reduced': 0.11},
-    'SK': {'name': 'Slovakia', 'standard': 0.23, 'reduced': 0.05},
-    'SI': {'name': 'Slovenia', 'standard': 0.22, 'reduced': 0.05},
-    'ES': {'name': 'Spain', 'standard': 0.21, 'reduced': 0.10},
-    'SE': {'name': 'Sweden', 'standard': 0.25, 'reduced': 0.06},
-    # Non-EU European countries
-    'CH': {'name': 'Switzerland', 'standard': 0.077, 'reduced': 0.025},
-    'GB': {'name': 'United Kingdom', 'standard': 0.20, 'reduced': 0.05},
-    'NO': {'name': 'Norway', 'standard': 0.25, 'reduced': 0.12}
-}
-
-
-def get_vat_rate(country_code: str, rate_type: str = 'standard') -> float:
+# Effective-dated standard and reduced rates, shared with static/js/vat-rates.js
+VAT_RATES_FILE = Path("vat_rates.json")
+vat_rates = VatRateTable(VAT_RATES_FILE)
+
+
+def get_vat_rate(country_code: str, rate_type: str = 'standard', on_date=None) -> float:
     """
     Get VAT rate for a country
     
     Args:
         country_code: Two-letter country code (e.g., 'AT', 'DE')
         rate_type: 'standard' or 'reduced'
+        on_date: Date the rate must be valid on (defaults to today)
         
     Returns:
         VAT rate as decimal (e.g., 0.19 for 19%)
+
+    Raises:
+        UnknownCountryError: If no rates are known for the country
     """
-    country_code = country_code.upper()
-    country = VAT_RATES.get(country_code)
-    
-    if not country:
-        print(f"Warning: VAT rate not found for country: {country_code}, using default 19%")
-        return 0.19  # Default fallback
-    
-    return country.get('reduced' if rate_type == 'reduced' else 'standard', 0.19)
+    return vat_rates.rate(country_code, rate_type, on_date)
 
 
-def load_company_settings():
-    """Load company settings from JSON file or use defaults"""
-    if SETTINGS_FILE.exists():
-        try:
-            with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Error loading settings: {e}")
-    # Return default COMPANY_INFO if file doesn't exist
-    return COMPANY_INFO
-
-
-def save_company_settings(settings):
-    """Save company settings to JSON file"""
-    with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(settings, f, indent=4, ensure_ascii=False)
+company_profiles = CompanyProfiles(PROFILES_FILE, SETTINGS_FILE, COMPANY_INFO)
+
+
+def load_company_settings(profile: str = DEFAULT_PROFILE):
+    """Load company settings of a profile (default profile falls back to COMPANY_INFO)"""
+    return company_profiles.get(profile)
+
+
+def save_company_settings(settings, profile: str = DEFAULT_PROFILE):
+    """Save company settings of a profile"""
+    company_profiles.save(profile, settings)
     return True
 
 
+def _build_generator(profile: str, language: str):
+    """Create a generator with the profile's rendering state prepared"""
+    company_settings = load_company_settings(profile)
+    if language == 'en':
+        return PDFInvoiceGeneratorEN(company_info=company_settings)
+    return PDFInvoiceGenerator(company_info=company_settings)
+
+
+generator_cache = GeneratorCache(_build_generator, maxsize=int(os.environ.get('GENERATOR_CACHE_SIZE', 16)))
+
+
+def generator_for(profile: str, language: str):
+    """Prepared generator for a company profile and language (cached)"""
+    logo = Path(load_company_settings(profile).get('logo') or "company_logo.png")
+    try:
+        logo_version = logo.stat().st_mtime_ns
+    except OSError:
+        logo_version = 0
+    version = (company_profiles.version(profile), logo_version)
+    return generator_cache.get(profile, 'en' if language == 'en' else 'de', version)
+
+
+def invoice_prefix(profile: str) -> str:
+    """Invoice number prefix of a company ('invoice_prefix' setting, else INV / profile name)"""
+    prefix = load_company_settings(profile).get('invoice_prefix')
+    if not prefix:
+        prefix = 'INV' if profile == DEFAULT_PROFILE else profile.upper()
+    return secure_filename(prefix) or 'INV'
+
+
+def api_access(api_key: Optional[str], address: Optional[str]) -> bool:
+    """Whether a caller may use the protected API: one of API_KEYS, or local with API_ALLOW_LOCAL and no keys set"""
+    if API_KEYS:
+        return api_key in API_KEYS
+    return API_ALLOW_LOCAL and address in ('127.0.0.1', '::1')
+
+
+def pick_profile(api_key: str = None, requested: str = None, address: str = None) -> str:
+    """
+    Company profile for a caller: an API key bound to a profile wins over
+    the requested profile, which defaults to DEFAULT_PROFILE
+
+    Only operators (see api_access) may request another profile, since an
+    invoice uses up that company's numbers and lands in its VAT reports.
+
+    Raises:
+        KeyError: If the profile does not exist
+        PermissionError: If the caller may not issue for the requested profile
+    """
+    profile = company_profiles.profile_for_api_key(api_key)
+    if profile is None:
+        profile = requested or DEFAULT_PROFILE
+        if profile != DEFAULT_PROFILE and not api_access(api_key, address):
+            raise PermissionError(profile)
+    if not company_profiles.exists(profile):
+        raise KeyError(profile)
+    return profile
+
+
+def resolve_profile(data=None) -> str:
+    """
+    Company profile for the current request: an API key bound to a profile
+    wins, then the X-Company-Profile header or 'company_profile' field
+
+    Raises:
+        KeyError: If the requested profile does not exist
+        PermissionError: If the caller may not choose it
+    """
+    return pick_profile(
+        request_api_key(),
+        request.headers.get('X-Company-Profile')
+        or (data or {}).get('company_profile')
+        or request.args.get('profile'),
+        request.remote_addr
+    )
+
+
+def profile_forbidden(api_key: Optional[str]):
+    """Response for a caller that requested a company profile it may not use"""
+    if api_key:
+        return jsonify({'error': 'This API key may not use the requested company profile'}), 403
+    return jsonify({'error': 'An API key is required to use another company profile'}), 401
+
+
 def calculate_due_date(invoice_date: datetime, payment_terms: str) -> str:
     """Calculate due date based on payment terms"""
     # Extract number of days from payment terms
@@ -127,6 +376,380 @@ def calculate_due_date(invoice_date: datetime, payment_terms: str) -> str:
     return due_date.strftime("%d.%m.%Y")
 
 
+def compute_totals(data, invoice_date: datetime):
+    """
+    Totals, VAT and due date of a decoded invoice or quote payload
+
+    Raises:
+        UnknownCountryError: If no VAT rates are known for the buyer country
+    """
+    item_subtotal = data['items'].total()
+    shipping_total = data['shipping_total']
+    vat_rate = get_vat_rate(data['buyer_country'], data['vat_rate_type'], invoice_date)
+    net_total = item_subtotal + shipping_total
+    gross_total = net_total * (1 + vat_rate)
+    return {
+        'item_subtotal': item_subtotal,
+        'shipping_total': shipping_total,
+        'net_total': net_total,
+        'vat_rate': vat_rate,
+        'vat_amount': gross_total - net_total,
+        'grand_total': gross_total,
+        'due_date': calculate_due_date(invoice_date, data['payment_terms'])
+    }
+
+
+class RenderFailed(Exception):
+    """The PDF generator could not render an invoice"""
+
+
+def prepare_invoice(data, profile: str, invoice_date: datetime, sales_channel: str = 'Web',
+                    fulfillment: str = 'Manual', seller_order_id: str = None,
+                    purchased_at: datetime = None, batch_id: str = None,
+                    numbers: NumberBlocks = None) -> InvoiceRecord:
+    """
+    Number the invoice of a decoded payload and build its record (not rendered yet)
+
+    Args:
+        data: Decoded invoice payload (see decode_invoice_payload)
+        profile: Company profile
+        invoice_date: Issue date (also picks the VAT rate)
+        sales_channel: Where the order came from ('Web', 'Amazon', ...)
+        fulfillment: Fulfillment shown on the invoice
+        seller_order_id: Order id of the sales channel (defaults to the invoice id)
+        purchased_at: Order time (defaults to the issue date)
+        batch_id: Registry batch the invoice belongs to
+        numbers: The batch's reserved numbers (default: allocate one from the shared counter)
+
+    Raises:
+        UnknownCountryError: If no VAT rates are known for the buyer country
+    """
+    # Calculate totals, VAT (rate valid on the invoice date) and due date
+    totals = compute_totals(data, invoice_date)
+    purchased_at = purchased_at or invoice_date
+    
+    # Allocate the next sequential invoice number (separate series per company)
+    series = f"{invoice_prefix(profile)}-{invoice_date.year}"
+    number = (numbers or invoice_numbers).allocate(series)
+    order_id = format_invoice_number(series, number)
+    try:
+        invoice_data = InvoiceData(
+            order_id=order_id,
+            seller_order_id=seller_order_id or order_id,
+            purchase_date=purchased_at.strftime("%d.%m.%Y"),
+            purchase_time=purchased_at.strftime("%H:%M"),
+            buyer_name=data['buyer_name'],
+            buyer_contact_name=data['buyer_name'].split()[0],
+            buyer_street=data['buyer_street'],
+            buyer_city=data['buyer_city'],
+            buyer_postal=data['buyer_postal'],
+            buyer_country=data['buyer_country'],
+            items=data['items'],
+            item_subtotal=totals['net_total'],
+            shipping_total=totals['shipping_total'],
+            vat_amount=totals['vat_amount'],
+            grand_total=totals['grand_total'],
+            fulfillment=fulfillment,
+            sales_channel=sales_channel,
+            shipping_service=data['shipping_service'],
+            status='Generated',
+            vat_rate=totals['vat_rate'],
+            currency=data['currency'],
+            vat_id=data['vat_id'],
+            promotion_discount=0.0,
+            # EN 16931 Fields
+            buyer_vat_id=data['buyer_vat_id'],
+            buyer_email=data['buyer_email'],
+            due_date=totals['due_date'],
+            invoice_type_code="380",  # Commercial invoice
+            payment_means=data['payment_means'],
+            payment_terms=data['payment_terms'],
+            payment_reference=data['payment_reference'] or order_id,
+            invoice_date=invoice_date.strftime("%d.%m.%Y")
+        )
+        
+        # Create filename (the invoice number keeps it unique)
+        day = invoice_date.strftime("%d")
+        buyer_first_name = secure_filename(invoice_data.buyer_contact_name) or 'Customer'
+        pdf_filename = secure_filename(f"{day}_{data['buyer_country']}_{buyer_first_name}_{order_id}.pdf")
+    except BaseException as e:
+        invoice_numbers.void(series, number, f'Server error: {e}')
+        raise
+    
+    return InvoiceRecord(
+        invoice=invoice_data,
+        invoice_date=invoice_date.date(),
+        filename=pdf_filename,
+        language=data['language'],
+        batch_id=batch_id,
+        company_profile=profile
+    )
+
+
+def discard_invoice(record: InvoiceRecord, reason: str):
+    """Void the number of a prepared invoice that will not be registered and remove its file"""
+    invoice_numbers.void(*parse_invoice_number(record.invoice.order_id), reason)
+    storage.path_for(record.filename).unlink(missing_ok=True)
+
+
+def render_invoice(data, profile: str, invoice_date: datetime, **options) -> InvoiceRecord:
+    """
+    Number and render the invoice of a decoded payload
+
+    The returned record still has to be persisted with register_invoices().
+    If rendering fails, the allocated number is voided before raising.
+    Takes the same arguments as prepare_invoice().
+
+    Raises:
+        UnknownCountryError: If no VAT rates are known for the buyer country
+        RenderFailed: If the PDF could not be generated
+    """
+    record = prepare_invoice(data, profile, invoice_date, **options)
+    try:
+        # Generate PDF with the company profile's prepared generator and selected language
+        generator = generator_for(profile, record.language)
+        render_started = time.perf_counter()
+        success = generator.generate(record.invoice, storage.path_for(record.filename))
+        timings = {'render_ms': round((time.perf_counter() - render_started) * 1000, 1)}
+        if not success:
+            raise RenderFailed(f"PDF generation failed for {record.invoice.order_id}")
+        if invoice_signing is not None:
+            timings['sign_ms'] = round(signer_for(invoice_signing).sign(storage.path_for(record.filename)), 1)
+        storage.commit(record.filename)
+    except BaseException as e:
+        discard_invoice(record, 'PDF generation failed' if isinstance(e, RenderFailed) else f'Server error: {e}')
+        raise
+    
+    logger.info("Invoice generated", extra={
+        'event': 'invoice_generated',
+        'invoice_id': record.invoice.order_id,
+        'company_profile': profile,
+        'language': record.language,
+        'items': len(record.invoice.items),
+        **timings
+    })
+    return record
+
+
+def register_invoices(records):
+    """
+    Persist rendered invoices in one registry transaction
+
+    If that fails, their numbers are voided and their files removed.
+    """
+    try:
+        registry.add_many(records)
+    except Exception as e:
+        for record in records:
+            discard_invoice(record, f'Server error: {e}')
+        raise
+
+
+def send_invoice_file(path: Path, mimetype: str, as_attachment: bool = False):
+    """
+    Respond with a file from INVOICE_DIR
+
+    With FILE_OFFLOAD=nginx only the internal location is returned and nginx
+    sends the bytes, so no worker is held for the transfer.
+    """
+    if FILE_OFFLOAD != 'nginx':
+        return send_file(path, mimetype=mimetype, as_attachment=as_attachment, download_name=path.name)
+
+    response = Response(mimetype=mimetype)
+    response.headers['X-Accel-Redirect'] = (
+        FILE_OFFLOAD_PREFIX.rstrip('/') + '/' + url_quote(path.relative_to(INVOICE_DIR).as_posix())
+    )
+    response.headers.set('Content-Disposition', 'attachment' if as_attachment else 'inline', filename=path.name)
+    return response
+
+
+def cached_file_response(key: str, mimetype: str, download_name: str, as_attachment: bool = False):
+    """Response from the shared cache, or None on a miss"""
+    data = shared_cache.get(key) if shared_cache else None
+    if data is None:
+        return None
+    response = Response(data, mimetype=mimetype)
+    response.headers.set('Content-Disposition', 'attachment' if as_attachment else 'inline',
+                         filename=download_name)
+    return response
+
+
+def remember_file(key: str, path: Path):
+    """Put an immutable file into the shared cache (files larger than a slot are skipped)"""
+    if shared_cache is None:
+        return
+    try:
+        if path.stat().st_size <= shared_cache.slot_size:
+            shared_cache.put(key, path.read_bytes())
+    except OSError:
+        logger.warning("Could not cache %s", path, exc_info=True, extra={'event': 'shared_cache_failed'})
+
+
+def invoice_file(filename: str):
+    """Local path of a generated invoice PDF (fetched from storage if needed), or None"""
+    if secure_filename(filename) != filename or not filename.endswith('.pdf'):
+        return None
+    return storage.fetch(filename)
+
+
+def caller_key(api_key: str = None, address: str = None) -> str:
+    """Identify a caller for rate limiting: API key if given, else client IP"""
+    if api_key:
+        return 'key:' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:32]
+    return 'ip:' + (address or 'unknown')
+
+
+def client_key() -> str:
+    """Rate limiting key of the current request"""
+    # The last X-Forwarded-For hop is the address our own proxy saw
+    return caller_key(request.headers.get('X-API-Key'),
+                      request.access_route[-1] if request.access_route else None)
+
+
+def too_many_requests(retry_after: float):
+    """Fast 429 response with a Retry-After hint"""
+    response = jsonify({'error': 'Too many requests, please retry later'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def rate_limited(view):
+    """Apply per-client rate limiting"""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        cost = 1 + (request.content_length or 0) // RATE_LIMIT_COST_BYTES
+        allowed, retry_after = rate_limiter.acquire(client_key(), cost)
+        if not allowed:
+            return too_many_requests(retry_after)
+        return view(*args, **kwargs)
+    return wrapped
+
+
+def render_capacity(view):
+    """Apply the global render concurrency cap"""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        with render_slots.slot() as acquired:
+            if not acquired:
+                return too_many_requests(1)
+            return view(*args, **kwargs)
+    return wrapped
+
+
+def admission_control(view):
+    """Apply per-client rate limiting and the global render concurrency cap"""
+    return rate_limited(render_capacity(view))
+
+
+def idempotent(view):
+    """
+    Honour an Idempotency-Key header: the first request runs the view, replays
+    within the TTL get its stored response, concurrent duplicates wait for it
+    (409 if it is still running after IDEMPOTENCY_WAIT_SECONDS)
+
+    Apply it inside rate_limited, so throttled requests never claim a key, and
+    outside render_capacity, so a waiting duplicate holds no render slot.
+    """
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        header = request.headers.get('Idempotency-Key')
+        if not header:
+            return view(*args, **kwargs)
+        if len(header) > 255:
+            return jsonify({'error': 'Idempotency-Key must be at most 255 characters'}), 400
+
+        # Keys are scoped per client, and bound to the exact request body
+        key = f"{client_key()}:{request.path}:{header}"
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        outcome, stored = idempotency.begin(key, fingerprint)
+        if outcome == REPLAY:
+            status_code, body = stored
+            response = Response(body, status=status_code, mimetype='application/json')
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        if outcome == MISMATCH:
+            return jsonify({'error': 'Idempotency-Key was already used for a different request'}), 422
+        if outcome != STARTED:
+            response = jsonify({'error': 'A request with this Idempotency-Key is still in progress'})
+            response.status_code = 409
+            response.headers['Retry-After'] = '5'
+            return response
+
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except BaseException:
+            idempotency.release(key)
+            raise
+        # Server errors and throttling are not final - let the client retry them
+        if response.status_code >= 500 or response.status_code == 429:
+            idempotency.release(key)
+        else:
+            idempotency.complete(key, response.status_code, response.get_data(as_text=True))
+        return response
+    return wrapped
+
+
+def same_origin() -> bool:
+    """Whether a browser request comes from a page of this site (requests without the headers do not)"""
+    fetch_site = request.headers.get('Sec-Fetch-Site')
+    if fetch_site is not None:
+        return fetch_site == 'same-origin'
+    origin = request.headers.get('Origin')
+    return origin is not None and origin.rstrip('/') == request.host_url.rstrip('/')
+
+
+def request_api_key() -> Optional[str]:
+    """
+    API key of the current request: the X-API-Key header, or the key a
+    browser signed in with (for changes only from pages of this site)
+    """
+    api_key = request.headers.get('X-API-Key')
+    if api_key:
+        return api_key
+    api_key = session.get('api_key')
+    if api_key and request.method not in ('GET', 'HEAD') and not same_origin():
+        return None
+    return api_key
+
+
+def require_api_key(view):
+    """Restrict a view to callers presenting one of the configured API keys"""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not api_access(request_api_key(), request.remote_addr):
+            if API_KEYS:
+                return jsonify({'error': 'Invalid or missing API key'}), 401
+            return jsonify({'error': 'API keys are not configured on this server'}), 403
+        return view(*args, **kwargs)
+    return wrapped
+
+
+@app.route('/sign-in', methods=['GET', 'POST'])
+def sign_in():
+    """Remember an API key in this browser's session, for the settings page and form suggestions"""
+    next_url = request.args.get('next') or '/manual'
+    # Only local paths, never another site
+    if not next_url.startswith('/') or next_url.startswith('//'):
+        next_url = '/manual'
+    if request.method == 'POST':
+        api_key = (request.form.get('api_key') or '').strip()
+        if any(hmac.compare_digest(api_key, key) for key in API_KEYS):
+            session.clear()
+            session['api_key'] = api_key
+            session.permanent = True
+            return redirect(next_url)
+        return render_template('sign_in.html', next_url=next_url, error='Unknown API key'), 401
+    return render_template('sign_in.html', next_url=next_url, error=None)
+
+
+@app.route('/sign-out', methods=['POST'])
+def sign_out():
+    """Forget the signed-in API key"""
+    session.pop('api_key', None)
+    return redirect('/')
+
+
 @app.route('/')
 def index():
     """Homepage - method selection"""
@@ -166,20 +789,28 @@ def sitemap():
 
 
 @app.route('/api/company-settings', methods=['GET'])
+@require_api_key
 def get_company_settings():
     """Get current company settings"""
     try:
-        settings = load_company_settings()
+        try:
+            profile = resolve_profile()
+        except KeyError:
+            return jsonify({'error': 'Unknown company profile'}), 404
+        settings = load_company_settings(profile)
         return jsonify(settings), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/company-settings', methods=['POST'])
+@require_api_key
 def update_company_settings():
-    """Update company settings"""
+    """Update company settings (an API key bound to a profile may only change that profile)"""
     try:
-        settings = request.get_json()
+        settings = request.get_json(silent=True)
+        if not isinstance(settings, dict):
+            return jsonify({'error': 'Request body must be a JSON object'}), 400
         
         # Validate required fields
         required_fields = ['name', 'address_line', 'uid', 'court', 'bank', 'iban']
@@ -187,8 +818,13 @@ def update_company_settings():
             if field not in settings or not settings[field]:
                 return jsonify({'error': f'Missing required field: {field}'}), 400
         
-        # Save settings
-        save_company_settings(settings)
+        # Save settings (a profile named in the request is created if missing)
+        bound_profile = company_profiles.profile_for_api_key(request_api_key())
+        requested = request.headers.get('X-Company-Profile') or request.args.get('profile')
+        if bound_profile and requested and requested != bound_profile:
+            return jsonify({'error': 'This API key may only change its own company profile'}), 403
+        profile = bound_profile or requested or DEFAULT_PROFILE
+        save_company_settings(settings, profile)
         
         return jsonify({
             'success': True,
@@ -198,158 +834,475 @@ def update_company_settings():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/vat-rates', methods=['GET'])
+def get_vat_rates():
+    """VAT rates valid on a date (default today), used by the invoice form"""
+    try:
+        on_date = datetime.strptime(request.args['date'], '%Y-%m-%d').date() if request.args.get('date') else None
+    except ValueError:
+        return jsonify({'error': 'date must be in YYYY-MM-DD format'}), 400
+
+    response = jsonify({
+        'version': vat_rates.version,
+        'rates': vat_rates.snapshot(on_date)
+    })
+    response.headers['Cache-Control'] = 'public, max-age=300'
+    return response
+
+
+@app.route('/api/quote', methods=['POST'])
+def quote():
+    """
+    Totals, VAT and due date for the form as typed, without rendering a PDF
+    Needs only buyer_country and items; other invoice fields are ignored
+    """
+    try:
+        data = decode_quote_payload(request.get_json(silent=True), product_catalog.lookup())
+    except ValidationError as e:
+        return jsonify({'error': str(e), 'errors': e.errors}), 400
+
+    invoice_date = datetime.now()
+    try:
+        totals = compute_totals(data, invoice_date)
+    except UnknownCountryError as e:
+        return jsonify({'error': str(e)}), 400
+
+    for key in ('item_subtotal', 'shipping_total', 'net_total', 'vat_amount', 'grand_total'):
+        totals[key] = round(totals[key], 2)
+    totals['currency'] = data['currency']
+    totals['invoice_date'] = invoice_date.strftime("%d.%m.%Y")
+    return jsonify(totals)
+
+
 @app.route('/api/generate-invoice', methods=['POST'])
+@rate_limited
+@idempotent
+@render_capacity
 def generate_invoice():
     """
     API endpoint to generate invoice PDF
     Accepts JSON data from form submission
     """
+    record = None
     try:
-        data = request.get_json()
-        
-        # Validate required fields
-        required_fields = ['buyer_name', 'buyer_country', 'items']
-        for field in required_fields:
-            if field not in data or not data[field]:
-                return jsonify({'error': f'Missing required field: {field}'}), 400
-        
-        # Validate items
-        if not isinstance(data['items'], list) or len(data['items']) == 0:
-            return jsonify({'error': 'At least one item is required'}), 400
-        
-        # Parse items
-        items = []
-        for idx, item_data in enumerate(data['items']):
-            try:
-                quantity = int(item_data.get('quantity', 1))
-                unit_price = float(item_data.get('unit_price', 0))
-                unit_code = item_data.get('unit_code', 'C62')
-                
-                # Calculate item total
-                item_total = quantity * unit_price
-                
-                items.append(OrderItem(
-                    product_name=item_data.get('product_name', f'Item {idx + 1}'),
-                    asin='N/A',
-                    sku=item_data.get('sku', f'SKU-{idx + 1}'),
-                    quantity=quantity,
-                    unit_price_excl=unit_price,
-                    unit_price_incl=unit_price,
-                    item_subtotal_excl=item_total,
-                    item_subtotal_incl=item_total,
-                    item_total=item_total,
-                    unit_code=unit_code
-                ))
-            except (ValueError, KeyError) as e:
-                return jsonify({'error': f'Invalid item data at position {idx + 1}: {str(e)}'}), 400
-        
-        # Calculate totals
-        item_subtotal = sum(item.item_total for item in items)
-        shipping_total = float(data.get('shipping_total', 0))
-        
-        # Get VAT rate based on country and rate type
-        country_code = data.get('buyer_country', 'DE')
-        vat_rate_type = data.get('vat_rate_type', 'standard')
-        vat_rate = get_vat_rate(country_code, vat_rate_type)
-        
-        # Calculate VAT
-        net_total = item_subtotal + shipping_total
-        gross_total = net_total * (1 + vat_rate)
-        vat_amount = gross_total - net_total
-        
-        # Generate order ID
-        order_id = f"INV-{datetime.now().strftime('%Y%m%d')}-{uuid.uuid4().hex[:8].upper()}"
-        
-        # Get payment terms and calculate due date
-        payment_terms = data.get('payment_terms', 'Net 30')
-        invoice_date = datetime.now()
-        due_date = calculate_due_date(invoice_date, payment_terms)
-        
-        # Create invoice data
-        invoice_data = InvoiceData(
-            order_id=order_id,
-            seller_order_id=order_id,
-            purchase_date=invoice_date.strftime("%d.%m.%Y"),
-            purchase_time=invoice_date.strftime("%H:%M"),
-            buyer_name=data.get('buyer_name'),
-            buyer_contact_name=data.get('buyer_name').split()[0] if data.get('buyer_name') else 'Customer',
-            buyer_street=data.get('buyer_street', ''),
-            buyer_city=data.get('buyer_city', ''),
-            buyer_postal=data.get('buyer_postal', ''),
-            buyer_country=data.get('buyer_country'),
-            items=items,
-            item_subtotal=net_total,
-            shipping_total=shipping_total,
-            vat_amount=vat_amount,
-            grand_total=gross_total,
-            fulfillment='Manual',
-            sales_channel='Web',
-            shipping_service=data.get('shipping_service', 'Standard'),
-            status='Generated',
-            vat_rate=vat_rate,
-            currency=data.get('currency', '€'),
-            vat_id=data.get('vat_id', None),
-            promotion_discount=0.0,
-            # EN 16931 Fields
-            buyer_vat_id=data.get('buyer_vat_id', None),
-            due_date=due_date,
-            invoice_type_code="380",  # Commercial invoice
-            payment_means=data.get('payment_means', 'Credit transfer'),
-            payment_terms=payment_terms,
-            payment_reference=data.get('payment_reference', order_id)
-        )
-        
-        # Generate PDF with current company settings and selected language
-        company_settings = load_company_settings()
-        language = data.get('language', 'en')  # Default to English
-        
-        if language == 'en':
-            generator = PDFInvoiceGeneratorEN(company_info=company_settings)
-        else:
-            generator = PDFInvoiceGenerator(company_info=company_settings)
-        
-        # Create filename
-        day = datetime.now().strftime("%d")
-        country_code = data.get('buyer_country', 'XX')[:2].upper()
-        buyer_first_name = invoice_data.buyer_contact_name
-        pdf_filename = f"{day}_{country_code}_{buyer_first_name}.pdf"
-        
-        output_path = INVOICE_DIR / pdf_filename
+        # Validate and convert the whole payload in one pass (items become an ItemBatch)
+        try:
+            data = decode_invoice_payload(request.get_json(silent=True), product_catalog.lookup())
+        except ValidationError as e:
+            return jsonify({'error': str(e), 'errors': e.errors}), 400
         
-        success = generator.generate(invoice_data, output_path)
+        try:
+            profile = resolve_profile(data)
+        except KeyError:
+            return jsonify({'error': 'Unknown company profile'}), 400
+        except PermissionError:
+            return profile_forbidden(request_api_key())
         
-        if not success:
+        try:
+            record = render_invoice(data, profile, datetime.now())
+        except UnknownCountryError as e:
+            return jsonify({'error': str(e)}), 400
+        except RenderFailed:
             return jsonify({'error': 'Failed to generate PDF'}), 500
         
+        register_invoices([record])
+        # The next request for it (download, preview) may land on another worker
+        remember_file('pdf:' + record.filename, storage.path_for(record.filename))
+        
         return jsonify({
             'success': True,
-            'invoice_id': order_id,
-            'filename': pdf_filename,
-            'download_url': f'/download/{pdf_filename}'
+            'invoice_id': record.invoice.order_id,
+            'filename': record.filename,
+            'download_url': f'/download/{record.filename}'
         })
         
     except Exception as e:
-        print(f"Error generating invoice: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Invoice generation failed", extra={
+            'event': 'invoice_failed',
+            'invoice_id': record.invoice.order_id if record else None
+        })
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
 
+@app.route('/api/invoices', methods=['GET'])
+@require_api_key
+def list_invoices():
+    """
+    Search generated invoices (newest first, keyset paginated)
+    Filters: order_id, buyer (name prefix), country, date_from, date_to,
+    min_total, max_total, batch_id; pass next_cursor back as cursor
+    """
+    args = request.args
+    try:
+        date_from = datetime.strptime(args['date_from'], '%Y-%m-%d').date() if args.get('date_from') else None
+        date_to = datetime.strptime(args['date_to'], '%Y-%m-%d').date() if args.get('date_to') else None
+        min_total = float(args['min_total']) if args.get('min_total') else None
+        max_total = float(args['max_total']) if args.get('max_total') else None
+        limit = min(max(int(args.get('limit', 50)), 1), 500)
+
+        invoices, next_cursor = registry.query(
+            order_id=args.get('order_id'),
+            buyer=args.get('buyer'),
+            country=args.get('country'),
+            date_from=date_from,
+            date_to=date_to,
+            min_total=min_total,
+            max_total=max_total,
+            batch_id=args.get('batch_id'),
+            limit=limit,
+            cursor=args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query: {e}'}), 400
+
+    return jsonify({'invoices': invoices, 'next_cursor': next_cursor})
+
+
+@app.route('/api/invoices/<order_id>', methods=['GET'])
+@require_api_key
+def get_invoice(order_id):
+    """Full stored record of one invoice"""
+    record = registry.get(order_id)
+    if record is None:
+        return jsonify({'error': 'Invoice not found'}), 404
+    return jsonify(record)
+
+
+@app.route('/api/invoices/<order_id>/email', methods=['GET'])
+@require_api_key
+def invoice_email_status(order_id):
+    """Email delivery status of one invoice"""
+    status = mailer.status(order_id)
+    if status is None:
+        return jsonify({'error': 'No email queued for this invoice'}), 404
+    return jsonify(status)
+
+
+@app.route('/api/reports/vat', methods=['GET'])
+@require_api_key
+def vat_report():
+    """
+    Per-country, per-rate VAT totals of one company profile for one quarter
+    (?period=2026-Q3, default current; profile as for invoice generation)
+    """
+    period = request.args.get('period') or quarter_of(datetime.now().date())
+    if not re.fullmatch(r'\d{4}-Q[1-4]', period):
+        return jsonify({'error': 'period must look like 2026-Q3'}), 400
+    try:
+        profile = resolve_profile()
+    except KeyError:
+        return jsonify({'error': 'Unknown company profile'}), 404
+    return jsonify({'company_profile': profile, 'period': period, 'rows': vat_reports.report(profile, period)})
+
+
+@app.cli.command('rebuild-vat-reports')
+def rebuild_vat_reports():
+    """Recompute the VAT rollups from all registered invoices"""
+    count = vat_reports.rebuild()
+    print(f"Rebuilt VAT rollups from {count} invoices")
+
+
+@app.route('/api/customers', methods=['GET'])
+@require_api_key
+def search_customers():
+    """Customers whose name (or a word of it) starts with ?q=, for autocomplete"""
+    query = (request.args.get('q') or '').strip()
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 50)
+        profile = resolve_profile()
+    except ValueError:
+        return jsonify({'error': 'limit must be a number'}), 400
+    except KeyError:
+        return jsonify({'error': 'Unknown company profile'}), 404
+    if not query:
+        return jsonify({'customers': []})
+    return jsonify({'customers': customer_store.search(profile, query, limit)})
+
+
+@app.cli.command('rebuild-customers')
+def rebuild_customers():
+    """Recompute the customer master data from all registered invoices"""
+    count = customer_store.rebuild()
+    print(f"Rebuilt {count} customers from the invoice registry")
+
+
+@app.route('/api/products', methods=['GET'])
+def search_products():
+    """
+    Catalog products whose name (or a word of it) or SKU starts with ?q=, for autocomplete
+    Open like /api/quote: the catalog holds prices, not personal data
+    """
+    query = (request.args.get('q') or '').strip()
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 50)
+    except ValueError:
+        return jsonify({'error': 'limit must be a number'}), 400
+    if not query:
+        return jsonify({'products': []})
+    return jsonify({'products': product_catalog.search(query, limit)})
+
+
+@app.cli.command('import-products')
+@click.argument('input_file', type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option('--column', 'columns', multiple=True, help='Rename a CSV column, e.g. "Artikel=product_name" (repeatable)')
+def import_products_command(input_file, columns):
+    """Add or update catalog products from a CSV file (sku, product_name, unit_price, unit_code, asin)"""
+    renames = {}
+    for column in columns:
+        source, sep, target = column.partition('=')
+        if not sep:
+            raise click.BadParameter(f'Expected SOURCE=FIELD, got {column!r}', param_hint='--column')
+        renames[source.strip()] = target.strip()
+    try:
+        count = product_catalog.import_csv(input_file, renames)
+    except ValidationError as e:
+        for error in e.errors[:20]:
+            print(f"{error['path']}: {error['message']}")
+        if len(e.errors) > 20:
+            print(f"... and {len(e.errors) - 20} more")
+        raise click.ClickException('Nothing imported, fix the rows above')
+    print(f"Imported {count} products")
+
+
+@app.route('/api/print-run', methods=['GET'])
+@require_api_key
+@admission_control
+def print_run():
+    """
+    One combined PDF of many invoices for postal dispatch
+    Select with order_id (comma-separated or repeated), date_from/date_to or batch_id
+    """
+    args = request.args
+    order_ids = [oid.strip() for value in args.getlist('order_id') for oid in value.split(',') if oid.strip()]
+    try:
+        date_from = datetime.strptime(args['date_from'], '%Y-%m-%d').date() if args.get('date_from') else None
+        date_to = datetime.strptime(args['date_to'], '%Y-%m-%d').date() if args.get('date_to') else None
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query: {e}'}), 400
+    if not (order_ids or date_from or date_to or args.get('batch_id')):
+        return jsonify({'error': 'Select invoices by order_id, date_from/date_to or batch_id'}), 400
+    if len(order_ids) > PRINT_RUN_MAX_INVOICES:
+        return jsonify({'error': f'At most {PRINT_RUN_MAX_INVOICES} order ids per print run'}), 400
+
+    selection = {
+        'order_ids': order_ids or None,
+        'date_from': date_from,
+        'date_to': date_to,
+        'batch_id': args.get('batch_id')
+    }
+    count = registry.count(**selection)
+    if count == 0:
+        return jsonify({'error': 'No invoices match'}), 404
+    if count > PRINT_RUN_MAX_INVOICES:
+        return jsonify({
+            'error': f'{count} invoices match; at most {PRINT_RUN_MAX_INVOICES} per request '
+                     '(use `flask print-run` for larger runs)'
+        }), 400
+
+    # Spool to a temporary file and stream it from there
+    spool = tempfile.TemporaryFile()
+    try:
+        write_print_run(registry.iter_records(**selection), spool, storage.fetch)
+    except MissingInvoiceFile as e:
+        spool.close()
+        return jsonify({'error': str(e)}), 409
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return send_file(spool, mimetype='application/pdf', as_attachment=True, download_name='print-run.pdf')
+
+
+@app.cli.command('print-run')
+@click.option('--order-id', 'order_ids', multiple=True, help='Invoice number (repeatable)')
+@click.option('--date-from', type=click.DateTime(['%Y-%m-%d']), help='First invoice date')
+@click.option('--date-to', type=click.DateTime(['%Y-%m-%d']), help='Last invoice date')
+@click.option('--batch-id', help='Batch job id')
+@click.option('-o', '--output', type=click.Path(dir_okay=False, path_type=Path),
+              default='print-run.pdf', show_default=True)
+def print_run_command(order_ids, date_from, date_to, batch_id, output):
+    """Combine the stored PDFs of the selected invoices into one PDF for postal dispatch"""
+    selection = {
+        'order_ids': list(order_ids) or None,
+        'date_from': date_from.date() if date_from else None,
+        'date_to': date_to.date() if date_to else None,
+        'batch_id': batch_id
+    }
+    if not registry.count(**selection):
+        raise click.ClickException('No invoices match')
+    try:
+        count = write_print_run(registry.iter_records(**selection), output, storage.fetch)
+    except MissingInvoiceFile as e:
+        output.unlink(missing_ok=True)
+        raise click.ClickException(str(e))
+    print(f"Wrote {count} invoices to {output}")
+
+
+@app.cli.command('send-invoices')
+@click.option('--order-id', 'order_ids', multiple=True, help='Invoice number (repeatable)')
+@click.option('--date-from', type=click.DateTime(['%Y-%m-%d']), help='First invoice date')
+@click.option('--date-to', type=click.DateTime(['%Y-%m-%d']), help='Last invoice date')
+@click.option('--batch-id', help='Batch job id')
+@click.option('--retry-failed', is_flag=True, help='Also resend previously failed emails')
+def send_invoices_command(order_ids, date_from, date_to, batch_id, retry_failed):
+    """Email the selected invoices that are still pending to their buyers"""
+    if mailer.settings is None:
+        raise click.ClickException('Set SMTP_HOST to send invoices')
+    records = registry.iter_records(
+        order_ids=list(order_ids) or None,
+        date_from=date_from.date() if date_from else None,
+        date_to=date_to.date() if date_to else None,
+        batch_id=batch_id
+    )
+    try:
+        counts = mailer.send(records, retry_failed=retry_failed)
+    except smtplib.SMTPAuthenticationError as e:
+        raise click.ClickException(f'SMTP login failed, nothing more was sent: {e.smtp_code} {e.smtp_error!r}')
+    print(f"Sent {counts['sent']}, failed {counts['failed']}, skipped {counts['skipped']}")
+
+
+CURRENCY_SYMBOLS = {'EUR': '€', 'USD': '$', 'GBP': '£'}
+
+
+def render_marketplace_order(order, batch_id: str, numbers: NumberBlocks = None) -> InvoiceRecord:
+    """
+    Render the invoice of an imported marketplace order
+
+    Marketplace prices include VAT; they are converted to net prices at the
+    standard rate of the buyer country.
+    """
+    invoice_date = datetime.now()
+    vat_rate = get_vat_rate(order.buyer_country, 'standard', invoice_date)
+    payload = {
+        'buyer_name': order.buyer_name,
+        'buyer_country': order.buyer_country,
+        'buyer_street': order.buyer_street,
+        'buyer_city': order.buyer_city,
+        'buyer_postal': order.buyer_postal,
+        'buyer_email': order.buyer_email,
+        'currency': CURRENCY_SYMBOLS.get(order.currency, order.currency),
+        'shipping_total': round(order.shipping_total / (1 + vat_rate), 4),
+        'payment_terms': 'Immediate',
+        'payment_means': order.marketplace,
+        'payment_reference': order.external_id,
+        'language': 'de' if order.buyer_country in ('DE', 'AT', 'CH', 'LI') else 'en',
+        'items': [dict(item, unit_price=round(item['unit_price'] / (1 + vat_rate), 4)) for item in order.items]
+    }
+    return render_invoice(
+        decode_invoice_payload(payload),
+        MARKETPLACE_PROFILE,
+        invoice_date,
+        sales_channel=order.marketplace,
+        fulfillment='Seller',
+        seller_order_id=order.external_id,
+        purchased_at=order.purchased_at.astimezone(),
+        batch_id=batch_id,
+        numbers=numbers
+    )
+
+
+@app.cli.command('sync-marketplaces')
+@click.option('--marketplace', 'names', multiple=True, help='Amazon, eBay or Etsy (repeatable, default: all configured)')
+@click.option('--since', type=click.DateTime(['%Y-%m-%d', '%Y-%m-%dT%H:%M:%S']),
+              help='Re-scan orders changed since this time (UTC) instead of the last sync')
+def sync_marketplaces_command(names, since):
+    """Invoice the marketplace orders changed since the last sync"""
+    connectors = marketplace_connectors()
+    if names:
+        wanted = {name.lower() for name in names}
+        connectors = [c for c in connectors if c.name.lower() in wanted]
+    if not connectors:
+        raise click.ClickException('No marketplace configured (see docs/SETUP_GUIDE.md)')
+
+    failed = False
+    for connector in connectors:
+        try:
+            with NumberBlocks(invoice_numbers, f'Reserved for {connector.name} sync, not used') as numbers:
+                result = marketplace_sync.sync(
+                    connector, lambda order, batch_id: render_marketplace_order(order, batch_id, numbers),
+                    register_invoices, discard_invoice, since=since,
+                    initial=timedelta(days=MARKETPLACE_SYNC_INITIAL_DAYS)
+                )
+        except MarketplaceError as e:
+            print(f"{connector.name}: {e}")
+            failed = True
+            continue
+        finally:
+            connector.close()
+        print(f"{connector.name}: imported {result['imported']}, skipped {result['skipped']}, "
+              f"failed {result['failed']} (batch {result['batch_id']})")
+        if result['failed_orders']:
+            print(f"  failed orders: {', '.join(result['failed_orders'])}")
+            failed = True
+    if failed:
+        raise SystemExit(1)
+
+
+@app.cli.command('import-invoices')
+@click.argument('input_file', type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option('--manifest', type=click.Path(dir_okay=False, path_type=Path),
+              help='Result manifest (default: <input>.manifest.jsonl)')
+@click.option('--workers', type=int, help='Render processes (default: CPU count)')
+@click.option('--profile', default=DEFAULT_PROFILE, help='Company profile of records without company_profile')
+@click.option('--column', 'columns', multiple=True, help='Rename a CSV column, e.g. "Kunde=buyer_name" (repeatable)')
+def import_invoices_command(input_file, manifest, workers, profile, columns):
+    """Generate invoices from a CSV or JSONL export; re-run to resume after an interruption"""
+    renames = {}
+    for column in columns:
+        source, sep, target = column.partition('=')
+        if not sep:
+            raise click.BadParameter(f'Expected SOURCE=FIELD, got {column!r}', param_hint='--column')
+        renames[source.strip()] = target.strip()
+    batch_id = f"import-{secure_filename(input_file.stem) or 'file'}"
+    # One catalog snapshot for the whole file, looked up in memory per item
+    products = product_catalog.lookup()
+
+    def prepare(payload, import_key):
+        data = decode_invoice_payload(payload, products)
+        record_profile = data['company_profile'] or profile
+        if not company_profiles.exists(record_profile):
+            raise ValueError(f'Unknown company profile: {record_profile}')
+        record = prepare_invoice(data, record_profile, datetime.now(), sales_channel=IMPORT_CHANNEL,
+                                 seller_order_id=import_key, batch_id=batch_id, numbers=numbers)
+        return record, load_company_settings(record_profile), storage.path_for(record.filename)
+
+    started = time.perf_counter()
+    # Numbers are reserved in blocks; the unused rest is voided when the import ends
+    with NumberBlocks(invoice_numbers, f'Reserved for {batch_id}, not used') as numbers:
+        counts = bulk_importer.run(
+            input_file,
+            manifest or input_file.with_name(input_file.name + '.manifest.jsonl'),
+            prepare=prepare,
+            commit=lambda record: storage.commit(record.filename),
+            register=register_invoices,
+            discard=discard_invoice,
+            columns=renames,
+            workers=workers,
+            signing=invoice_signing
+        )
+    elapsed = time.perf_counter() - started
+    print(f"Imported {counts['imported']}, skipped {counts['skipped']}, failed {counts['failed']} "
+          f"in {elapsed:.1f}s (batch {batch_id})")
+    if counts['failed']:
+        raise SystemExit(1)
+
+
 @app.route('/download/<filename>')
 def download_invoice(filename):
     """Download generated invoice PDF"""
     try:
-        file_path = INVOICE_DIR / filename
+        if secure_filename(filename) == filename:
+            cached = cached_file_response('pdf:' + filename, 'application/pdf', filename, as_attachment=True)
+            if cached is not None:
+                return cached
+
+        file_path = invoice_file(filename)
         
-        if not file_path.exists():
+        if file_path is None:
             return jsonify({'error': 'File not found'}), 404
         
-        return send_file(
-            file_path,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='application/pdf'
-        )
+        remember_file('pdf:' + filename, file_path)
+        return send_invoice_file(file_path, 'application/pdf', as_attachment=True)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -363,19 +1316,60 @@ def preview_invoice(filename):
             if static_sample.exists():
                 return send_file(static_sample, mimetype='application/pdf')
 
-        file_path = INVOICE_DIR / filename
+        if secure_filename(filename) == filename:
+            cached = cached_file_response('pdf:' + filename, 'application/pdf', filename)
+            if cached is not None:
+                return cached
+
+        file_path = invoice_file(filename)
         
-        if not file_path.exists():
+        if file_path is None:
             return jsonify({'error': 'File not found'}), 404
         
-        return send_file(
-            file_path,
-            mimetype='application/pdf'
-        )
+        remember_file('pdf:' + filename, file_path)
+        return send_invoice_file(file_path, 'application/pdf')
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/thumbnail/<filename>')
+def invoice_thumbnail(filename):
+    """First-page thumbnail of an invoice PDF (rendered once, then cached)"""
+    fmt = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'png'
+    cache_key = None
+    if filename == 'sample_invoice.pdf':
+        # The sample can change with a deploy, so it is cached in the invoice folder for a day
+        pdf_path = Path("static") / "sample_invoice.pdf"
+        cache_dir = INVOICE_DIR
+        cache_control = 'public, max-age=86400'
+    else:
+        # Invoice files are never rewritten, so their thumbnails are immutable
+        cache_dir = None
+        cache_control = 'public, max-age=31536000, immutable'
+        cache_key = f'thumb:{fmt}:{filename}'
+        response = cached_file_response(cache_key, f'image/{fmt}', thumbnail_path(Path(filename), fmt).name)
+        if response is not None:
+            response.headers['Cache-Control'] = cache_control
+            response.headers['Vary'] = 'Accept'
+            return response
+        pdf_path = invoice_file(filename)
+
+    if pdf_path is None or not pdf_path.exists():
+        return jsonify({'error': 'File not found'}), 404
+
+    try:
+        thumbnail = get_thumbnail(pdf_path, fmt, cache_dir=cache_dir)
+    except ThumbnailUnavailable as e:
+        return jsonify({'error': str(e)}), 503
+
+    if cache_key:
+        remember_file(cache_key, thumbnail)
+    response = send_invoice_file(thumbnail, f'image/{fmt}')
+    response.headers['Cache-Control'] = cache_control
+    response.headers['Vary'] = 'Accept'
+    return response
+
+
 @app.route('/terms')
 def terms():
     """Terms of Service page"""
@@ -394,6 +1388,38 @@ def favicon():
     return '', 204
 
 
+@app.before_request
+def start_request():
+    """Assign the request id used in log lines (an incoming X-Request-ID is kept)"""
+    incoming = request.headers.get('X-Request-ID', '')
+    g.request_id = incoming if re.fullmatch(r'[\w.-]{1,64}', incoming) else uuid.uuid4().hex
+    g.request_started = time.perf_counter()
+    request_id_var.set(g.request_id)
+
+
+@app.after_request
+def finish_request(response):
+    """Echo the request id and log the request (sampled, see LOG_SAMPLE_RATES)"""
+    request_id = getattr(g, 'request_id', None)
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+        # Server errors are logged as warnings, which are never sampled away
+        level = logging.WARNING if response.status_code >= 500 else logging.INFO
+        logger.log(level, "Request handled", extra={
+            'event': 'request',
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - g.request_started) * 1000, 1)
+        })
+    return response
+
+
+@app.teardown_request
+def clear_request_id(exc):
+    request_id_var.set(None)
+
+
 @app.before_request
 def before_request():
     """Ensure URLs work with and without trailing slashes"""
@@ -414,7 +1440,6 @@ def server_error(e):
 
 
 if __name__ == '__main__':
-    import os
     port = int(os.environ.get('PORT', 5001))
     debug = os.environ.get('FLASK_ENV') != 'production'
     
@@ -0,0 +1,158 @@
+"""
+Structured logging
+One JSON object per line with request id, event and timing fields. Records
+are handed to a background thread through a bounded queue, so a slow log
+sink never blocks a request; high-volume events can be sampled.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+# Id of the request being handled (set by the web app per request)
+request_id_var: contextvars.ContextVar = contextvars.ContextVar('request_id', default=None)
+
+# Attributes every LogRecord has; anything else was passed via `extra`
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single-line JSON object including its `extra` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """Adds the current request id to every record"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, 'request_id', None) is None:
+            request_id = request_id_var.get()
+            if request_id is not None:
+                record.request_id = request_id
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a share of high-volume events
+
+    Records logged with extra={'event': name} are kept with the configured
+    probability; warnings and errors are never dropped.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(getattr(record, 'event', None))
+        if rate is None or rate >= 1.0:
+            return True
+        if random.random() >= rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of waiting when the queue is full"""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve the message and traceback now (the listener runs later, on
+        # another thread) but keep the extra fields for the JSON formatter
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+
+_listener: Optional[QueueListener] = None
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """'request=0.1,invoice_generated=0.5' -> {'request': 0.1, 'invoice_generated': 0.5}"""
+    rates = {}
+    for part in spec.split(','):
+        name, _, rate = part.partition('=')
+        if name.strip() and rate.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+def configure_logging(level: str = 'INFO', sample_rates: Optional[Dict[str, float]] = None,
+                      queue_size: int = 10000, stream=None):
+    """
+    Route all logging through a bounded queue to a JSON stream handler
+
+    Safe to call more than once (later calls are ignored).
+
+    Args:
+        level: Root log level
+        sample_rates: Keep probability per event name
+        queue_size: Records buffered before new ones are dropped
+        stream: Output stream (defaults to stdout)
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    sink = logging.StreamHandler(stream or sys.stdout)
+    sink.setFormatter(JsonFormatter())
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    handler.addFilter(ContextFilter())
+    if sample_rates:
+        handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level.upper())
+
+    _listener = QueueListener(handler.queue, sink, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def configure_from_env():
+    """configure_logging() using LOG_LEVEL and LOG_SAMPLE_RATES"""
+    configure_logging(
+        level=os.environ.get('LOG_LEVEL', 'INFO'),
+        sample_rates=parse_sample_rates(os.environ.get('LOG_SAMPLE_RATES', 'request=0.1'))
+    )
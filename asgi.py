@@ -0,0 +1,488 @@
+"""
+Async API entry point (ASGI)
+Serves invoice generation, batch jobs, job status and downloads from one
+event loop: slow clients and storage calls are awaited without holding a
+thread, and rendering runs in a bounded pool of processes. All other routes
+are passed on to the Flask app. Run one worker per host:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+
+Needs starlette, uvicorn and a2wsgi (not installed by requirements.txt).
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import quote as url_quote
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.requests import ClientDisconnect, Request
+from starlette.responses import FileResponse, JSONResponse, Response
+from starlette.routing import Mount, Route
+from werkzeug.utils import secure_filename
+
+import app as web
+from bulk_import import render_pdf
+from idempotency import STARTED, REPLAY, MISMATCH, IN_PROGRESS
+from invoice_numbers import NumberBlocks
+from invoice_schema import decode_invoice_payload, ValidationError
+from vat_rates import UnknownCountryError
+
+logger = logging.getLogger(__name__)
+
+# Render processes, and how many renders may queue for them before requests get a 429
+RENDER_WORKERS = int(os.environ.get('ASYNC_RENDER_WORKERS', web.RENDER_CONCURRENCY))
+RENDER_QUEUE = int(os.environ.get('ASYNC_RENDER_QUEUE', RENDER_WORKERS * 4))
+# Threads for blocking calls (SQLite, S3, file reads)
+IO_THREADS = int(os.environ.get('ASYNC_IO_THREADS', 32))
+BATCH_MAX_INVOICES = int(os.environ.get('ASYNC_BATCH_MAX_INVOICES', 500))
+MAX_JOBS = int(os.environ.get('ASYNC_MAX_JOBS', 8))
+JOB_TTL = 3600  # seconds a finished job stays queryable
+
+
+class RenderPool:
+    """
+    Process pool for PDF rendering with back-pressure
+
+    Requests take a place with try_reserve() and get a 429 when all
+    workers + queue places are taken, instead of piling up. Batch jobs wait
+    for a place, but hold at most one per worker, so interactive requests
+    always find room in the queue.
+    """
+
+    def __init__(self, workers: int, queue: int):
+        self.workers = max(1, workers)
+        self.limit = self.workers + max(0, queue)
+        self.admitted = 0
+        # Spawned workers do not inherit the parent's SQLite connections
+        self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        self._batch_places = asyncio.Semaphore(self.workers)
+
+    def try_reserve(self) -> bool:
+        """Take a place if one is free (release() it afterwards)"""
+        if self.admitted >= self.limit:
+            return False
+        self.admitted += 1
+        return True
+
+    def release(self):
+        self.admitted -= 1
+
+    @asynccontextmanager
+    async def batch_place(self):
+        """Wait for a place for one batch invoice"""
+        async with self._batch_places:
+            self.admitted += 1
+            try:
+                yield
+            finally:
+                self.release()
+
+    def submit(self, *args) -> asyncio.Future:
+        """Run render_pdf(*args) in a worker process"""
+        return asyncio.get_running_loop().run_in_executor(self._executor, render_pdf, *args)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+@dataclass
+class Job:
+    """A batch of invoices rendered in the background"""
+    job_id: str
+    total: int
+    status: str = 'queued'
+    results: List[Optional[Dict]] = field(default_factory=list)
+    finished_at: Optional[float] = None
+
+    @property
+    def batch_id(self) -> str:
+        return f'job-{self.job_id}'
+
+    def to_dict(self) -> Dict:
+        done = [result for result in self.results if result]
+        return {
+            'job_id': self.job_id,
+            'batch_id': self.batch_id,
+            'status': self.status,
+            'total': self.total,
+            'completed': sum(1 for result in done if 'invoice_id' in result),
+            'failed': sum(1 for result in done if 'error' in result),
+            'invoices': done
+        }
+
+
+render_pool: Optional[RenderPool] = None
+jobs: Dict[str, Job] = {}
+job_tasks = set()
+
+
+def client_key(request: Request) -> str:
+    forwarded = request.headers.get('X-Forwarded-For')
+    # The last X-Forwarded-For hop is the address our own proxy saw
+    address = forwarded.split(',')[-1].strip() if forwarded else (request.client.host if request.client else None)
+    return web.caller_key(request.headers.get('X-API-Key'), address)
+
+
+def too_many_requests(retry_after: float) -> JSONResponse:
+    return JSONResponse({'error': 'Too many requests, please retry later'}, status_code=429,
+                        headers={'Retry-After': str(max(1, math.ceil(retry_after)))})
+
+
+def requested_profile(request: Request, data: Dict, default: str = None) -> str:
+    """
+    Company profile of a payload, resolved like the Flask routes do
+
+    Raises:
+        KeyError: If the profile does not exist
+        PermissionError: If the caller may not choose it
+    """
+    return web.pick_profile(
+        request.headers.get('X-API-Key'),
+        request.headers.get('X-Company-Profile')
+        or data.get('company_profile')
+        or default
+        or request.query_params.get('profile'),
+        request.client.host if request.client else None
+    )
+
+
+def profile_forbidden(request: Request) -> JSONResponse:
+    """Response for a caller that requested a company profile it may not use"""
+    if request.headers.get('X-API-Key'):
+        return JSONResponse({'error': 'This API key may not use the requested company profile'}, status_code=403)
+    return JSONResponse({'error': 'An API key is required to use another company profile'}, status_code=401)
+
+
+async def read_body(request: Request):
+    """
+    Read the request body without blocking the event loop on slow clients
+
+    Returns:
+        (body, None), or (None, error response) if the body is too large or
+        the client went away
+    """
+    limit = web.app.config['MAX_CONTENT_LENGTH']
+    too_large = JSONResponse({'error': 'Request body too large'}, status_code=413)
+    if int(request.headers.get('Content-Length') or 0) > limit:
+        return None, too_large
+    body = bytearray()
+    try:
+        async for chunk in request.stream():
+            body += chunk
+            if len(body) > limit:
+                return None, too_large
+    except ClientDisconnect:
+        return None, Response(status_code=400)
+    return bytes(body), None
+
+
+def parse_json(body: bytes):
+    try:
+        return json.loads(body) if body else None
+    except ValueError:
+        return None
+
+
+async def produce(data, profile: str, **options):
+    """
+    Number, render and register one invoice (the caller holds a render place)
+
+    Raises:
+        UnknownCountryError: If no VAT rates are known for the buyer country
+        RenderFailed: If the PDF could not be generated
+    """
+    record = await asyncio.to_thread(web.prepare_invoice, data, profile, datetime.now(), **options)
+    path = web.storage.path_for(record.filename)
+    future = None
+    try:
+        future = render_pool.submit(web.load_company_settings(profile), record.language,
+                                    record.invoice, str(path.resolve()), web.invoice_signing)
+        try:
+            timings = await asyncio.shield(future)
+        except Exception as e:
+            raise web.RenderFailed(f"PDF generation failed for {record.invoice.order_id}") from e
+        await asyncio.to_thread(web.storage.commit, record.filename)
+    except BaseException as e:
+        if isinstance(e, asyncio.CancelledError):
+            reason = 'Request cancelled'
+        else:
+            reason = 'PDF generation failed' if isinstance(e, web.RenderFailed) else f'Server error: {e}'
+        if future is not None and not future.done():
+            # The worker process finishes the file anyway; remove it only then
+            loop = asyncio.get_running_loop()
+            future.add_done_callback(lambda _: loop.run_in_executor(None, web.discard_invoice, record, reason))
+        else:
+            await asyncio.to_thread(web.discard_invoice, record, reason)
+        raise
+
+    await asyncio.to_thread(web.register_invoices, [record])
+    logger.info("Invoice generated", extra={
+        'event': 'invoice_generated',
+        'invoice_id': record.invoice.order_id,
+        'company_profile': profile,
+        'language': record.language,
+        'items': len(record.invoice.items),
+        **timings
+    })
+    return record
+
+
+async def throttle(request: Request, cost: int) -> Optional[Response]:
+    """Charge the caller's rate limit; a 429 response if it is exhausted"""
+    allowed, retry_after = await asyncio.to_thread(web.rate_limiter.acquire, client_key(request), cost)
+    return None if allowed else too_many_requests(retry_after)
+
+
+async def idempotent(request: Request, body: bytes, view) -> Response:
+    """Honour an Idempotency-Key header like the Flask routes do (call it after throttle())"""
+    header = request.headers.get('Idempotency-Key')
+    if not header:
+        return await view()
+    if len(header) > 255:
+        return JSONResponse({'error': 'Idempotency-Key must be at most 255 characters'}, status_code=400)
+
+    key = f"{client_key(request)}:{request.url.path}:{header}"
+    fingerprint = hashlib.sha256(body).hexdigest()
+    outcome, stored = await asyncio.to_thread(web.idempotency.try_begin, key, fingerprint)
+    # Wait for the in-flight duplicate without tying up a thread in between
+    for delay in web.idempotency.wait_delays():
+        if outcome != IN_PROGRESS:
+            break
+        await asyncio.sleep(delay)
+        outcome, stored = await asyncio.to_thread(web.idempotency.try_begin, key, fingerprint)
+    if outcome == REPLAY:
+        status_code, stored_body = stored
+        return Response(stored_body, status_code=status_code, media_type='application/json',
+                        headers={'Idempotent-Replayed': 'true'})
+    if outcome == MISMATCH:
+        return JSONResponse({'error': 'Idempotency-Key was already used for a different request'}, status_code=422)
+    if outcome != STARTED:
+        return JSONResponse({'error': 'A request with this Idempotency-Key is still in progress'},
+                            status_code=409, headers={'Retry-After': '5'})
+
+    try:
+        response = await view()
+    except BaseException:
+        await asyncio.to_thread(web.idempotency.release, key)
+        raise
+    # Server errors and throttling are not final - let the client retry them
+    if response.status_code >= 500 or response.status_code == 429:
+        await asyncio.to_thread(web.idempotency.release, key)
+    else:
+        await asyncio.to_thread(web.idempotency.complete, key, response.status_code, response.body.decode('utf-8'))
+    return response
+
+
+async def generate_invoice(request: Request) -> Response:
+    """Generate one invoice (same payload and response as the Flask route)"""
+    body, error = await read_body(request)
+    if error is not None:
+        return error
+
+    throttled = await throttle(request, 1 + len(body) // web.RATE_LIMIT_COST_BYTES)
+    if throttled is not None:
+        return throttled
+
+    async def view():
+        if not render_pool.try_reserve():
+            return too_many_requests(1)
+        record = None
+        try:
+            try:
+                products = await asyncio.to_thread(web.product_catalog.lookup)
+                data = decode_invoice_payload(parse_json(body), products)
+            except ValidationError as e:
+                return JSONResponse({'error': str(e), 'errors': e.errors}, status_code=400)
+            try:
+                profile = requested_profile(request, data)
+            except KeyError:
+                return JSONResponse({'error': 'Unknown company profile'}, status_code=400)
+            except PermissionError:
+                return profile_forbidden(request)
+
+            try:
+                record = await produce(data, profile)
+            except UnknownCountryError as e:
+                return JSONResponse({'error': str(e)}, status_code=400)
+            except web.RenderFailed:
+                return JSONResponse({'error': 'Failed to generate PDF'}, status_code=500)
+        except Exception as e:
+            logger.exception("Invoice generation failed", extra={'event': 'invoice_failed'})
+            return JSONResponse({'error': f'Server error: {str(e)}'}, status_code=500)
+        finally:
+            render_pool.release()
+
+        # The next request for it (download, preview) may land on another worker
+        await asyncio.to_thread(web.remember_file, 'pdf:' + record.filename,
+                                web.storage.path_for(record.filename))
+        return JSONResponse({
+            'success': True,
+            'invoice_id': record.invoice.order_id,
+            'filename': record.filename,
+            'download_url': f'/download/{record.filename}'
+        })
+
+    return await idempotent(request, body, view)
+
+
+async def run_job(job: Job, invoices: List):
+    """Render a job's invoices, at most one per render worker at a time"""
+    job.status = 'running'
+    numbers = NumberBlocks(web.invoice_numbers, f'Reserved for {job.batch_id}, not used', expected=job.total)
+
+    async def one(index, data, profile):
+        async with render_pool.batch_place():
+            try:
+                record = await produce(data, profile, batch_id=job.batch_id, numbers=numbers)
+            except Exception as e:
+                job.results[index] = {'index': index, 'error': str(e)}
+                logger.warning("Batch invoice %s of job %s failed: %s", index, job.job_id, e,
+                               extra={'event': 'batch_invoice_failed'})
+                return
+        job.results[index] = {'index': index, 'invoice_id': record.invoice.order_id,
+                              'filename': record.filename, 'download_url': f'/download/{record.filename}'}
+
+    try:
+        await asyncio.gather(*(one(index, data, profile) for index, (data, profile) in enumerate(invoices)))
+    finally:
+        await asyncio.to_thread(numbers.close)
+        job.status = 'done'
+        job.finished_at = time.time()
+
+
+async def create_batch(request: Request) -> Response:
+    """
+    Start a batch job: {"invoices": [<generate-invoice payload>, ...]}
+
+    Every invoice is validated before any is numbered. Returns 202 with the
+    job id; poll /api/jobs/<job_id> for progress and download links.
+    """
+    body, error = await read_body(request)
+    if error is not None:
+        return error
+
+    payload = parse_json(body)
+    invoices = payload.get('invoices') if isinstance(payload, dict) else None
+    # Each invoice is charged like a single request
+    count = min(len(invoices), BATCH_MAX_INVOICES) if isinstance(invoices, list) else 0
+    throttled = await throttle(request, max(count, 1) + len(body) // web.RATE_LIMIT_COST_BYTES)
+    if throttled is not None:
+        return throttled
+
+    async def view():
+        if not isinstance(invoices, list) or not invoices:
+            return JSONResponse({'error': 'invoices must be a non-empty list'}, status_code=400)
+        if len(invoices) > BATCH_MAX_INVOICES:
+            return JSONResponse({'error': f'At most {BATCH_MAX_INVOICES} invoices per batch'}, status_code=400)
+
+        decoded = []
+        errors = []
+        # One catalog snapshot for the whole batch (reloading it may read the database)
+        products = await asyncio.to_thread(web.product_catalog.lookup)
+        for index, invoice in enumerate(invoices):
+            try:
+                data = decode_invoice_payload(invoice, products)
+                decoded.append((data, requested_profile(request, data, payload.get('company_profile'))))
+            except ValidationError as e:
+                errors.append({'index': index, 'error': str(e), 'errors': e.errors})
+            except KeyError:
+                errors.append({'index': index, 'error': 'Unknown company profile'})
+            except PermissionError:
+                return profile_forbidden(request)
+        if errors:
+            return JSONResponse({'error': 'Invalid invoices', 'invoices': errors}, status_code=400)
+
+        now = time.time()
+        for job_id, job in list(jobs.items()):
+            if job.finished_at and now - job.finished_at > JOB_TTL:
+                del jobs[job_id]
+        if sum(1 for job in jobs.values() if job.finished_at is None) >= MAX_JOBS:
+            return too_many_requests(10)
+
+        job = Job(job_id=uuid.uuid4().hex, total=len(decoded), results=[None] * len(decoded))
+        jobs[job.job_id] = job
+        task = asyncio.create_task(run_job(job, decoded))
+        job_tasks.add(task)
+        task.add_done_callback(job_tasks.discard)
+
+        status_url = f'/api/jobs/{job.job_id}'
+        return JSONResponse({'job_id': job.job_id, 'batch_id': job.batch_id, 'status': job.status,
+                             'total': job.total, 'status_url': status_url},
+                            status_code=202, headers={'Location': status_url})
+
+    return await idempotent(request, body, view)
+
+
+async def job_status(request: Request) -> Response:
+    """Progress of a batch job, with the invoices finished so far"""
+    job = jobs.get(request.path_params['job_id'])
+    if job is None:
+        return JSONResponse({'error': 'Job not found'}, status_code=404)
+    return JSONResponse(job.to_dict())
+
+
+async def download_invoice(request: Request) -> Response:
+    """Download a generated invoice PDF"""
+    filename = request.path_params['filename']
+    disposition = f'attachment; filename="{filename}"'
+    if web.shared_cache is not None and secure_filename(filename) == filename:
+        data = web.shared_cache.get('pdf:' + filename)
+        if data is not None:
+            return Response(data, media_type='application/pdf', headers={'Content-Disposition': disposition})
+
+    path = await asyncio.to_thread(web.invoice_file, filename)
+    if path is None:
+        return JSONResponse({'error': 'File not found'}, status_code=404)
+
+    if web.FILE_OFFLOAD == 'nginx':
+        location = web.FILE_OFFLOAD_PREFIX.rstrip('/') + '/' + url_quote(
+            path.relative_to(web.INVOICE_DIR).as_posix())
+        return Response(media_type='application/pdf',
+                        headers={'X-Accel-Redirect': location, 'Content-Disposition': disposition})
+    if web.FILE_OFFLOAD == 'sendfile':
+        return Response(media_type='application/pdf',
+                        headers={'X-Sendfile': str(path.resolve()), 'Content-Disposition': disposition})
+
+    await asyncio.to_thread(web.remember_file, 'pdf:' + filename, path)
+    return FileResponse(path, media_type='application/pdf', filename=filename)
+
+
+@asynccontextmanager
+async def lifespan(_):
+    global render_pool
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix='asgi-io'))
+    render_pool = RenderPool(RENDER_WORKERS, RENDER_QUEUE)
+    try:
+        yield
+    finally:
+        # Running batch jobs are finished, so no invoice number is left dangling
+        if job_tasks:
+            await asyncio.gather(*job_tasks, return_exceptions=True)
+        render_pool.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/api/generate-invoice', generate_invoice, methods=['POST']),
+        Route('/api/batches', create_batch, methods=['POST']),
+        Route('/api/jobs/{job_id}', job_status, methods=['GET']),
+        Route('/download/{filename}', download_invoice, methods=['GET']),
+        Mount('/', app=WSGIMiddleware(web.app))
+    ],
+    lifespan=lifespan
+)
@@ -0,0 +1,297 @@
+"""
+Bulk invoice import
+Generates invoices straight from CSV or JSONL order exports, without HTTP.
+The file is streamed record by record; invoices are numbered in input
+order by the importing process and rendered on all CPU cores by worker
+processes. Every imported record is written to the registry together with
+its import key, so an interrupted import resumes where it stopped.
+"""
+
+import csv
+import json
+import logging
+import multiprocessing
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from invoice_generator_web import PDFInvoiceGenerator
+from invoice_generator_web_en import PDFInvoiceGenerator as PDFInvoiceGeneratorEN
+from invoice_registry import InvoiceRegistry, InvoiceRecord
+from invoice_schema import ITEM_SCHEMA
+from signing import SigningConfig, signer_for
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS imported_records (
+    import_key TEXT PRIMARY KEY,
+    order_id TEXT NOT NULL
+);
+"""
+
+# Sales channel of imported invoices; their seller_order_id is the import key
+IMPORT_CHANNEL = 'Import'
+
+ITEM_FIELDS = ITEM_SCHEMA.names
+
+
+class RecordError(ValueError):
+    """A record of the input file that cannot be parsed (reported, the import goes on)"""
+
+    def __init__(self, message: str, order_ref: Optional[str] = None):
+        super().__init__(message)
+        self.order_ref = order_ref
+
+
+def _csv_records(f, columns: Dict[str, str]) -> Iterator[Any]:
+    """
+    Invoices from a CSV export
+
+    Invoice columns are named like the API fields, item columns like the
+    item fields (product_name, sku, quantity, ...). Consecutive rows with the
+    same order_ref form one invoice with several items; without an order_ref
+    column every row is an invoice. An 'items' column may hold a JSON list;
+    an invoice whose list is malformed is yielded as a RecordError.
+    """
+    current = None
+    error = None
+    ref = None
+    for row in csv.DictReader(f):
+        row = {columns.get(key, key): (value or '').strip() for key, value in row.items() if key}
+        row_ref = row.get('order_ref') or None
+        if current is not None and (row_ref is None or row_ref != ref):
+            yield error or current
+            current = error = None
+        if current is None:
+            ref = row_ref
+            current = {key: value for key, value in row.items() if key not in ITEM_FIELDS and key != 'items'}
+            current['items'] = []
+        if row.get('items'):
+            try:
+                items = json.loads(row['items'])
+            except ValueError as e:
+                error = error or RecordError(f"items: invalid JSON ({e})", ref)
+            else:
+                if isinstance(items, list):
+                    current['items'].extend(items)
+                else:
+                    error = error or RecordError("items: must be a JSON list", ref)
+        item = {key: row[key] for key in ITEM_FIELDS if row.get(key)}
+        if item:
+            current['items'].append(item)
+    if current is not None:
+        yield error or current
+
+
+def _jsonl_records(f) -> Iterator[Any]:
+    """Invoices from a JSONL file; a malformed line is yielded as a RecordError"""
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield RecordError(f"Invalid JSON: {e}")
+
+
+def read_records(path: Path, columns: Optional[Dict[str, str]] = None) -> Iterator[Tuple[int, Any]]:
+    """
+    Stream (record number, invoice payload) from a .csv or .jsonl file
+
+    Records that cannot be parsed come as a RecordError instead of a payload,
+    so the caller can report them and carry on.
+
+    Args:
+        path: Input file; JSONL lines are API payloads (plus optional order_ref)
+        columns: Renames CSV columns to payload fields, e.g. {'Kunde': 'buyer_name'}
+    """
+    path = Path(path)
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if path.suffix.lower() == '.csv':
+            records = _csv_records(f, columns or {})
+        else:
+            records = _jsonl_records(f)
+        for number, payload in enumerate(records, start=1):
+            yield number, payload
+
+
+# Per worker process: prepared generators by (language, company settings)
+_generators: Dict[Tuple[str, str], Any] = {}
+
+
+def render_pdf(company_settings: Dict, language: str, invoice_data, output_path: str,
+               signing: Optional[SigningConfig] = None) -> Dict[str, float]:
+    """
+    Render (and optionally sign) one invoice in a worker process
+
+    Returns:
+        Timings in milliseconds: render_ms, and sign_ms if signed
+
+    Raises:
+        RuntimeError: If the generator reported a failure
+    """
+    key = (language, json.dumps(company_settings, sort_keys=True, default=str))
+    generator = _generators.get(key)
+    if generator is None:
+        cls = PDFInvoiceGeneratorEN if language == 'en' else PDFInvoiceGenerator
+        generator = _generators[key] = cls(company_info=company_settings)
+    started = time.perf_counter()
+    if not generator.generate(invoice_data, Path(output_path)):
+        raise RuntimeError(f"PDF generation failed for {invoice_data.order_id}")
+    timings = {'render_ms': round((time.perf_counter() - started) * 1000, 1)}
+    if signing is not None:
+        timings['sign_ms'] = round(signer_for(signing).sign(Path(output_path)), 1)
+    return timings
+
+
+class BulkImporter:
+    """
+    Runs imports and remembers which records already have an invoice
+
+    Records are keyed by their order_ref, or by file name and record number
+    when the export has none. The key is stored in the transaction that
+    registers the invoice, so no record is ever invoiced twice.
+    """
+
+    def __init__(self, registry: InvoiceRegistry):
+        """
+        Args:
+            registry: Invoice registry to attach to (before its first use)
+        """
+        self.registry = registry
+        registry.add_listener(self._on_commit, schema=SCHEMA)
+
+    @staticmethod
+    def _on_commit(conn: sqlite3.Connection, records: List[InvoiceRecord]):
+        conn.executemany(
+            "INSERT OR IGNORE INTO imported_records (import_key, order_id) VALUES (?, ?)",
+            [(r.invoice.seller_order_id, r.invoice.order_id)
+             for r in records if r.invoice.sales_channel == IMPORT_CHANNEL]
+        )
+
+    def invoice_for(self, import_key: str) -> Optional[str]:
+        """Invoice id of an imported record, if any"""
+        row = self.registry.connection().execute(
+            "SELECT order_id FROM imported_records WHERE import_key = ?", (import_key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def run(self, path: Path, manifest_path: Path,
+            prepare: Callable[[Dict[str, Any], str], Tuple[InvoiceRecord, Dict, Path]],
+            commit: Callable[[InvoiceRecord], None],
+            register: Callable[[List[InvoiceRecord]], None],
+            discard: Callable[[InvoiceRecord, str], None],
+            columns: Optional[Dict[str, str]] = None, workers: Optional[int] = None,
+            batch_size: int = 100, signing: Optional[SigningConfig] = None) -> Dict[str, int]:
+        """
+        Import a file, appending one JSON line per record to the manifest
+
+        Args:
+            path: CSV or JSONL export
+            manifest_path: Result manifest (appended to, so resumed runs extend it)
+            prepare: Decodes and numbers one record, prepare(payload, import_key) ->
+                (record, company settings, output path); raises ValueError for invalid records
+            commit: Stores a rendered file
+            register: Persists rendered invoices in one transaction
+            discard: Voids a prepared invoice that could not be rendered
+            columns: CSV column renames
+            workers: Render processes (default: CPU count)
+            batch_size: Invoices registered per transaction
+            signing: Sign every invoice with this key (loaded once per worker)
+
+        Returns:
+            Counts: imported, skipped (already imported), failed
+        """
+        workers = workers or multiprocessing.cpu_count()
+        max_in_flight = workers * 4
+        counts = {'imported': 0, 'skipped': 0, 'failed': 0}
+        in_flight = deque()
+        rendered: List[Tuple[int, str, InvoiceRecord, Dict[str, float]]] = []
+        pending_keys = set()  # Keys in the current window, not yet registered
+
+        with open(manifest_path, 'a', encoding='utf-8') as manifest:
+            def write(entry):
+                manifest.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+            def flush():
+                if not rendered:
+                    return
+                batch = rendered[:]
+                rendered.clear()
+                register([record for _, _, record, _ in batch])
+                for number, key, record, timings in batch:
+                    write({'record': number, 'key': key, 'status': 'imported',
+                           'invoice_id': record.invoice.order_id, 'filename': record.filename, **timings})
+                manifest.flush()
+                counts['imported'] += len(batch)
+                pending_keys.difference_update(key for _, key, _, _ in batch)
+
+            def fail(number, key, error):
+                counts['failed'] += 1
+                pending_keys.discard(key)
+                write({'record': number, 'key': key, 'status': 'failed', 'error': str(error)})
+                logger.warning("Import record %s (%s) failed: %s", number, key, error,
+                               extra={'event': 'import_record_failed'})
+
+            def collect():
+                number, key, record, future = in_flight[0]
+                try:
+                    timings = future.result()
+                    commit(record)
+                except Exception as e:
+                    in_flight.popleft()
+                    discard(record, f'PDF generation failed: {e}')
+                    fail(number, key, e)
+                    return
+                in_flight.popleft()
+                rendered.append((number, key, record, timings))
+                if len(rendered) >= batch_size:
+                    flush()
+
+            # Spawned workers do not inherit the parent's SQLite connections
+            context = multiprocessing.get_context('spawn')
+            try:
+                with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                    try:
+                        for number, payload in read_records(path, columns):
+                            if isinstance(payload, RecordError):
+                                ref = payload.order_ref
+                            else:
+                                ref = payload.get('order_ref') if isinstance(payload, dict) else None
+                            key = str(ref or f"{Path(path).name}:{number}")
+                            if key in pending_keys or self.invoice_for(key):
+                                counts['skipped'] += 1
+                                continue
+                            if isinstance(payload, RecordError):
+                                fail(number, key, payload)
+                                continue
+                            try:
+                                record, company_settings, output_path = prepare(payload, key)
+                            except ValueError as e:
+                                fail(number, key, e)
+                                continue
+                            pending_keys.add(key)
+                            future = pool.submit(render_pdf, company_settings, record.language,
+                                                 record.invoice, str(Path(output_path).resolve()), signing)
+                            in_flight.append((number, key, record, future))
+                            # Bounded window: memory stays flat however large the file is
+                            if len(in_flight) >= max_in_flight:
+                                collect()
+                        while in_flight:
+                            collect()
+                        flush()
+                    except BaseException:
+                        for *_, future in in_flight:
+                            future.cancel()
+                        raise
+            except BaseException:
+                # Prepared invoices that never reached the registry give their numbers back
+                for _, _, record, _ in list(in_flight) + rendered:
+                    discard(record, 'Import interrupted')
+                raise
+        return counts
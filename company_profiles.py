@@ -0,0 +1,165 @@
+"""
+Company profiles for multi-tenant deployments
+Named company settings selectable per request or per API key, plus a
+bounded LRU of prepared PDF generators so switching tenants is a lookup
+"""
+
+import json
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_PROFILE = 'default'
+
+
+def _mtime(path: Path) -> int:
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return 0
+
+
+class CompanyProfiles:
+    """
+    Company settings by profile name
+
+    The 'default' profile is the single-company settings file
+    (company_config.json); further profiles live in the profiles file:
+
+        {
+            "profiles": {"acme": {"name": "ACME GmbH", ...}},
+            "api_keys": {"<api key>": "acme"}
+        }
+    """
+
+    def __init__(self, profiles_file: Path, default_settings_file: Path, fallback: Dict):
+        """
+        Args:
+            profiles_file: JSON file with named profiles and API key bindings
+            default_settings_file: Settings file of the default profile
+            fallback: Settings used when the default profile was never saved
+        """
+        self.profiles_file = Path(profiles_file)
+        self.default_settings_file = Path(default_settings_file)
+        self.fallback = fallback
+        self._lock = threading.Lock()
+        self._loaded_mtime = None
+        self._document = {'profiles': {}, 'api_keys': {}}
+        self._default = (None, fallback)
+
+    def _profiles_document(self) -> Dict:
+        """Parsed profiles file, re-read only when it changed on disk"""
+        mtime = _mtime(self.profiles_file)
+        if mtime != self._loaded_mtime:
+            with self._lock:
+                if mtime != self._loaded_mtime:
+                    document = {'profiles': {}, 'api_keys': {}}
+                    if mtime:
+                        try:
+                            with open(self.profiles_file, 'r', encoding='utf-8') as f:
+                                document.update(json.load(f))
+                        except (OSError, ValueError) as e:
+                            logger.error("Error loading company profiles: %s", e)
+                    self._document, self._loaded_mtime = document, mtime
+        return self._document
+
+    def version(self, name: str) -> int:
+        """Changes whenever the stored settings of a profile may have changed"""
+        if name == DEFAULT_PROFILE:
+            return _mtime(self.default_settings_file)
+        return _mtime(self.profiles_file)
+
+    def names(self) -> List[str]:
+        """All available profile names"""
+        return [DEFAULT_PROFILE] + sorted(
+            name for name in self._profiles_document()['profiles'] if name != DEFAULT_PROFILE
+        )
+
+    def exists(self, name: str) -> bool:
+        return name == DEFAULT_PROFILE or name in self._profiles_document()['profiles']
+
+    def get(self, name: str = DEFAULT_PROFILE) -> Dict:
+        """
+        Settings of a profile
+
+        Raises:
+            KeyError: If the profile does not exist
+        """
+        if name == DEFAULT_PROFILE:
+            mtime = _mtime(self.default_settings_file)
+            loaded_mtime, settings = self._default
+            if mtime != loaded_mtime:
+                settings = self.fallback
+                if mtime:
+                    try:
+                        with open(self.default_settings_file, 'r', encoding='utf-8') as f:
+                            settings = json.load(f)
+                    except Exception as e:
+                        logger.error("Error loading settings: %s", e)
+                self._default = (mtime, settings)
+            return settings
+        return self._profiles_document()['profiles'][name]
+
+    def save(self, name: str, settings: Dict):
+        """Create or replace the settings of a profile"""
+        if name == DEFAULT_PROFILE:
+            with open(self.default_settings_file, 'w', encoding='utf-8') as f:
+                json.dump(settings, f, indent=4, ensure_ascii=False)
+            return
+
+        with self._lock:
+            document = {'profiles': {}, 'api_keys': {}}
+            if self.profiles_file.exists():
+                with open(self.profiles_file, 'r', encoding='utf-8') as f:
+                    document.update(json.load(f))
+            document['profiles'][name] = settings
+            tmp_path = self.profiles_file.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(document, f, indent=4, ensure_ascii=False)
+            tmp_path.replace(self.profiles_file)
+            self._loaded_mtime = None
+
+    def profile_for_api_key(self, api_key: Optional[str]) -> Optional[str]:
+        """Profile an API key is bound to, if any"""
+        if not api_key:
+            return None
+        return self._profiles_document()['api_keys'].get(api_key)
+
+
+class GeneratorCache:
+    """Bounded LRU of prepared generator instances keyed by (profile, language, version)"""
+
+    def __init__(self, factory: Callable[[str, str], object], maxsize: int = 16):
+        """
+        Args:
+            factory: Builds a generator for (profile, language)
+            maxsize: Maximum number of prepared generators kept in memory
+        """
+        self.factory = factory
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Tuple, object]' = OrderedDict()
+
+    def get(self, profile: str, language: str, version) -> object:
+        key = (profile, language, version)
+        with self._lock:
+            generator = self._entries.get(key)
+            if generator is not None:
+                self._entries.move_to_end(key)
+                return generator
+
+        # Build outside the lock; a concurrent duplicate build is harmless
+        generator = self.factory(profile, language)
+        with self._lock:
+            # Drop stale versions of the same profile and language
+            for stale in [k for k in self._entries if k[:2] == key[:2]]:
+                del self._entries[stale]
+            self._entries[key] = generator
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return generator
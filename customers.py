@@ -0,0 +1,175 @@
+"""
+Customer master data
+Every buyer of a generated invoice is kept as a customer (per company
+profile, buyer name, postal code and country; the latest invoice's address
+wins), updated in the same transaction as the invoice itself. Name search
+runs on an in-memory prefix index per process (search keys and ids only)
+that only reads customers changed since its last refresh.
+"""
+
+import json
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from invoice_registry import InvoiceRegistry, InvoiceRecord, buyer_key
+from prefix_index import PrefixIndex, word_keys
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    id INTEGER PRIMARY KEY,
+    company_profile TEXT NOT NULL,
+    customer_key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    contact_name TEXT NOT NULL,
+    street TEXT NOT NULL,
+    city TEXT NOT NULL,
+    postal TEXT NOT NULL,
+    country TEXT NOT NULL,
+    vat_id TEXT NOT NULL,
+    email TEXT NOT NULL,
+    invoice_count INTEGER NOT NULL,
+    last_invoice_date TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    UNIQUE (company_profile, customer_key)
+);
+CREATE INDEX IF NOT EXISTS idx_customers_version ON customers (version);
+"""
+
+# Address fields follow the latest invoice; an invoice without VAT id or email keeps the known one
+UPSERT = (
+    "INSERT INTO customers (company_profile, customer_key, name, contact_name, street, city, postal, country, "
+    "vat_id, email, invoice_count, last_invoice_date, version) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (company_profile, customer_key) DO UPDATE SET "
+    "name = excluded.name, contact_name = excluded.contact_name, street = excluded.street, city = excluded.city, "
+    "vat_id = COALESCE(NULLIF(excluded.vat_id, ''), vat_id), "
+    "email = COALESCE(NULLIF(excluded.email, ''), email), "
+    "invoice_count = {count}, "
+    "last_invoice_date = MAX(last_invoice_date, excluded.last_invoice_date), "
+    "version = excluded.version"
+)
+
+FIELDS = ('name', 'contact_name', 'street', 'city', 'postal', 'country', 'vat_id', 'email',
+          'invoice_count', 'last_invoice_date')
+
+MAX_WORDS = 4  # Name words a search may start at ("muster" finds "Max Mustermann")
+
+
+def customer_key(name: str, postal: str, country: str) -> str:
+    """Identity of a customer within a company profile"""
+    return '\x1f'.join((buyer_key(name), ' '.join((postal or '').split()).casefold(), (country or '').upper()))
+
+
+def _merge(rows: Dict[Tuple[str, str], List], profile: str, invoice_date: str, get: Callable[[str], Any]):
+    """Fold one invoice's buyer into the upsert rows (later invoices win, like the upsert itself)"""
+    name = get('buyer_name')
+    key = (profile, customer_key(name, get('buyer_postal'), get('buyer_country')))
+    previous = rows.get(key)
+    rows[key] = [
+        profile, key[1], name, get('buyer_contact_name') or '', get('buyer_street') or '',
+        get('buyer_city') or '', get('buyer_postal') or '', (get('buyer_country') or '').upper(),
+        get('buyer_vat_id') or (previous[8] if previous else ''),
+        get('buyer_email') or (previous[9] if previous else ''),
+        (previous[10] if previous else 0) + 1,
+        max(invoice_date, previous[11]) if previous else invoice_date
+    ]
+
+
+class CustomerStore:
+    """Customers kept in the registry database, with a prefix index for autocomplete"""
+
+    def __init__(self, registry: InvoiceRegistry):
+        """
+        Args:
+            registry: Invoice registry to attach to (before its first use)
+        """
+        self.registry = registry
+        registry.add_listener(self._on_commit, schema=SCHEMA)
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._data_version = None
+        self._version = 0
+        self._index: PrefixIndex[int] = PrefixIndex()  # "profile\0name key" -> customer id
+        self._indexed: Set[int] = set()
+
+    @staticmethod
+    def _write(conn: sqlite3.Connection, rows: Iterable[List], replace_counts: bool = False):
+        # Versions grow with every committing transaction (writers are serialized)
+        version = conn.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM customers").fetchone()[0]
+        count = 'excluded.invoice_count' if replace_counts else 'invoice_count + excluded.invoice_count'
+        conn.executemany(UPSERT.format(count=count), [row + [version] for row in rows])
+
+    def _on_commit(self, conn: sqlite3.Connection, records: List[InvoiceRecord]):
+        rows: Dict[Tuple[str, str], List] = {}
+        for record in records:
+            _merge(rows, record.company_profile, record.invoice_date.isoformat(),
+                   lambda field, invoice=record.invoice: getattr(invoice, field, None))
+        self._write(conn, rows.values())
+
+    def rebuild(self) -> int:
+        """
+        Recompute all customers from the stored invoices in one streaming pass
+
+        Returns:
+            Number of customers
+        """
+        conn = self.registry.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows: Dict[Tuple[str, str], List] = {}
+            cursor = conn.execute("SELECT company_profile, invoice_date, data FROM invoices ORDER BY id")
+            for profile, invoice_date, data in cursor:
+                _merge(rows, profile, invoice_date, json.loads(data).get)
+            self._write(conn, rows.values(), replace_counts=True)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+    def _refresh(self):
+        """Merge customers changed by any process since the last call (caller holds the lock)"""
+        if self._conn is None:
+            self.registry.connection()  # Creates the schema
+            self._conn = sqlite3.connect(str(self.registry.db_path), timeout=30.0,
+                                         isolation_level=None, check_same_thread=False)
+        # Changes whenever another connection committed - a cheap check per search
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+
+        rows = self._conn.execute(
+            "SELECT id, company_profile, name, version FROM customers WHERE version > ? ORDER BY version",
+            (self._version,)
+        ).fetchall()
+        added = []
+        for customer_id, profile, name, version in rows:
+            # Names only change within the same normalized form, so known customers keep their keys
+            if customer_id not in self._indexed:
+                self._indexed.add(customer_id)
+                added.extend((f"{profile}\x00{key}", customer_id) for key in word_keys(name, MAX_WORDS))
+            self._version = version
+
+        self._index.add(added)
+
+    def search(self, profile: str, query: str, limit: int = 10) -> List[Dict]:
+        """
+        Customers of a company profile whose name, or a later word of it, starts with `query`
+
+        Returns:
+            Up to `limit` customers in name order
+        """
+        prefix = f"{profile}\x00{buyer_key(query)}"
+        with self._lock:
+            self._refresh()
+            found = self._index.search(prefix, limit)
+            # Details come from the database (by primary key) rather than from memory
+            rows = self._conn.execute(
+                f"SELECT id, {', '.join(FIELDS)} FROM customers WHERE id IN ({', '.join('?' * len(found))})",
+                found
+            ).fetchall() if found else []
+        by_id = {customer_id: fields for customer_id, *fields in rows}
+        return [dict(zip(FIELDS, by_id[customer_id])) for customer_id in found]
@@ -0,0 +1,146 @@
+"""
+Idempotency keys
+Remembers the response to each Idempotency-Key in a SQLite file shared by
+all workers, so a retried request returns the original result instead of
+creating a second invoice. A duplicate sent while the first is still
+running waits for its result, up to a bound.
+"""
+
+import random
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    status_code INTEGER,
+    body TEXT,
+    started_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys (expires_at);
+"""
+
+# Outcomes of IdempotencyStore.begin()
+STARTED = 'started'      # Caller owns the key and must complete() or release() it
+REPLAY = 'replay'        # Stored (status_code, body) is returned
+MISMATCH = 'mismatch'    # Key was used for a different request
+IN_PROGRESS = 'in_progress'  # Still running after the wait timeout
+
+
+class IdempotencyStore:
+    """Stored responses by idempotency key"""
+
+    def __init__(self, db_path: Path, ttl: float = 24 * 3600, wait_timeout: float = 20.0,
+                 stale_after: float = 300.0):
+        """
+        Args:
+            db_path: SQLite file shared by all workers
+            ttl: Seconds a stored response is replayed
+            wait_timeout: How long a duplicate waits for the in-flight request (keep it
+                well below the worker timeout)
+            stale_after: Seconds after which an unfinished request counts as crashed
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.stale_after = stale_after
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def try_begin(self, key: str, fingerprint: str) -> Tuple[str, Optional[Tuple[int, str]]]:
+        """
+        One attempt at claiming a key, without waiting for a request that holds it
+
+        Args:
+            key: Idempotency key (scope it per client)
+            fingerprint: Hash of the request; reusing a key for another request is an error
+
+        Returns:
+            (outcome, stored response) - the response is (status_code, body) for REPLAY
+        """
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (now,))
+            row = conn.execute(
+                "SELECT fingerprint, status_code, body, started_at FROM idempotency_keys WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is not None:
+                stored_fingerprint, status_code, body, started_at = row
+                if stored_fingerprint != fingerprint:
+                    conn.execute("COMMIT")
+                    return MISMATCH, None
+                if status_code is not None:
+                    conn.execute("COMMIT")
+                    return REPLAY, (status_code, body)
+                if now - started_at < self.stale_after:
+                    conn.execute("COMMIT")
+                    return IN_PROGRESS, None
+            # New key, or the previous owner died - take it over
+            conn.execute(
+                "INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, started_at, expires_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, fingerprint, now, now + self.ttl)
+            )
+            conn.execute("COMMIT")
+            return STARTED, None
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def wait_delays(self) -> Iterator[float]:
+        """Growing, jittered pauses between claim attempts, until wait_timeout has passed"""
+        deadline = time.monotonic() + self.wait_timeout
+        delay = 0.05
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            yield min(remaining, delay * random.uniform(0.8, 1.2))
+            delay = min(delay * 1.5, 1.0)
+
+    def begin(self, key: str, fingerprint: str) -> Tuple[str, Optional[Tuple[int, str]]]:
+        """
+        Claim a key, waiting (up to wait_timeout) while another request with the same key runs
+
+        Returns:
+            (outcome, stored response) as for try_begin(); IN_PROGRESS only after the wait timed out
+        """
+        outcome, stored = self.try_begin(key, fingerprint)
+        for delay in self.wait_delays():
+            if outcome != IN_PROGRESS:
+                break
+            time.sleep(delay)
+            outcome, stored = self.try_begin(key, fingerprint)
+        return outcome, stored
+
+    def complete(self, key: str, status_code: int, body: str):
+        """Store the response of a request that claimed the key"""
+        self._connection().execute(
+            "UPDATE idempotency_keys SET status_code = ?, body = ? WHERE key = ?",
+            (status_code, body, key)
+        )
+
+    def release(self, key: str):
+        """Forget a claimed key without a response (e.g. after a server error), so it can be retried"""
+        self._connection().execute(
+            "DELETE FROM idempotency_keys WHERE key = ? AND status_code IS NULL", (key,)
+        )
@@ -4,6 +4,7 @@ Contains only PDF generation logic (no web scraping)
 """
 
 import json
+import logging
 from dataclasses import dataclass
 from pathlib import Path
 from typing import List, Optional, Dict
@@ -12,6 +13,11 @@ from datetime import datetime
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
+from reportlab.lib.utils import ImageReader
+
+from text_layout import ellipsize, text_width, wrap
+
+logger = logging.getLogger(__name__)
 
 
 # Company Configuration (customizable)
@@ -72,11 +78,13 @@ class InvoiceData:
     promotion_discount: float = 0.0
     # EN 16931 Required Fields
     buyer_vat_id: str = None
+    buyer_email: str = None
     due_date: str = None
     invoice_type_code: str = "380"  # 380 = Commercial invoice
     payment_means: str = "Credit transfer"
     payment_terms: str = "Net 30"
     payment_reference: str = None
+    invoice_date: str = None  # DD.MM.YYYY, defaults to the rendering day
 
 
 class PDFInvoiceGenerator:
@@ -86,14 +94,51 @@ class PDFInvoiceGenerator:
     FONT_NORMAL = "Helvetica"
     FONT_BOLD = "Helvetica-Bold"
     
-    def __init__(self, company_info: Dict = None):
+    # Text layout: widths in points, measured from the column positions
+    ADDRESS_WIDTH = 211.57      # Envelope window (delivery and billing address)
+    SKU_COL_WIDTH = 78.0        # "Number" column, up to the item column
+    NAME_COL_WIDTH = 205.0      # Item column, up to the right-aligned quantity
+    NAME_MAX_LINES = 3
+    ROW_HEIGHT = 25.20          # Item row with a one-line name
+    ROW_LEADING = 10.0          # Added per extra name line
+    SKU_LIST_WIDTH = 490.0
+    
+    def __init__(self, company_info: Dict = None, logo_path: Path = None):
         """
         Initialize generator with company information
         
+        Company-dependent parts (logo, footer text) are prepared once here,
+        so a single instance can render any number of invoices.
+        
         Args:
             company_info: Dictionary with company details (uses COMPANY_INFO if None)
+            logo_path: Logo image (defaults to company_info['logo'] or company_logo.png)
         """
+        # Incomplete settings (e.g. a new profile) render empty fields rather than fail
         self.company_info = company_info or COMPANY_INFO
+        
+        logo_path = Path(logo_path or self.company_info.get('logo') or "company_logo.png")
+        self.logo = ImageReader(str(logo_path)) if logo_path.exists() else None
+        
+        # Footer columns (invoice-specific payment lines are appended per invoice)
+        self.footer_left_lines = [
+            self.company_info.get("control", ""),
+            f"Bank Details: {self.company_info.get('bank', '')}",
+            f"IBAN: {self.company_info.get('iban', '')}"
+        ]
+        if self.company_info.get('bic'):
+            self.footer_left_lines.append(f"BIC: {self.company_info['bic']}")
+        
+        self.footer_right_lines = [
+            self.company_info.get("court", ""),
+            f"UID: {self.company_info.get('uid', '')}"
+        ]
+        if self.company_info.get('vat_id'):
+            self.footer_right_lines.append(f"VAT ID: {self.company_info['vat_id']}")
+        if self.company_info.get('company_registration'):
+            self.footer_right_lines.append(f"Registration: {self.company_info['company_registration']}")
+        if self.company_info.get('ceo'):
+            self.footer_right_lines.append(f"Management: {self.company_info['ceo']}")
 
     def _to_pdf_y(self, user_y, height=0):
         """Convert Top-Left user coordinate to Bottom-Left PDF coordinate"""
@@ -128,282 +173,288 @@ class PDFInvoiceGenerator:
         """
         try:
             c = canvas.Canvas(str(output_path), pagesize=A4)
-            c.setFont(self.FONT_NORMAL, 10)
-            
-            # Generate invoice date (current date in DD.MM.YYYY format)
-            invoice_date = datetime.now().strftime("%d.%m.%Y")
-            
-            # --- Logo Section ---
-            logo_x = 447.42
-            logo_y_user = 33.45
-            logo_w = 97.35
-            logo_h = 24.66
-            logo_y_pdf = self._to_pdf_y(logo_y_user, logo_h)
-            
-            # Draw logo or company name
-            logo_path = Path("company_logo.png")
-            if logo_path.exists():
-                c.drawImage(str(logo_path), logo_x, logo_y_pdf, width=logo_w, height=logo_h, mask='auto', preserveAspectRatio=True)
-            else:
-                c.saveState()
-                c.setFillColor(colors.black)
-                c.setFont(self.FONT_BOLD, 16)
-                c.drawString(logo_x + 10, logo_y_pdf + 8, self.company_info["name"][:10].upper())
-                c.restoreState()
-            
-            # --- Delivery Address Block ---
-            addr_start_y = 91.75
-            
-            c.setFont(self.FONT_NORMAL, 7)
-            c.drawString(57.58, self._to_pdf_y(addr_start_y), "Delivery Address:")
-            
-            c.setFont(self.FONT_NORMAL, 10)
-            text_obj = c.beginText(57.58, self._to_pdf_y(addr_start_y + 12))
-            text_obj.textLine(invoice_data.buyer_name)
-            if invoice_data.buyer_street:
-                for street_line in invoice_data.buyer_street.split('\n'):
-                    text_obj.textLine(street_line)
-            text_obj.textLine(f"{invoice_data.buyer_postal} {invoice_data.buyer_city}")
-            country_english = self._translate_country_to_english(invoice_data.buyer_country)
-            text_obj.textLine(country_english.upper())
-            c.drawText(text_obj)
-            
-            # --- Sender Line ---
-            sender_y_user = 172.26
-            sender_y_pdf = self._to_pdf_y(sender_y_user) - 6
-            
-            c.setFont(self.FONT_NORMAL, 6)
-            c.drawString(56.16, sender_y_pdf, f"From: {self.company_info['address_line']}")
-            
-            line_y_user = 180.345
-            line_y_pdf = self._to_pdf_y(line_y_user)
-            c.setLineWidth(0.75)
-            c.line(56.16, line_y_pdf, 269.15, line_y_pdf)
-            
-            # --- Billing Address ---
-            billing_y = 199.55
-            text_obj = c.beginText(57.58, self._to_pdf_y(billing_y) - 9)
-            text_obj.setFont(self.FONT_NORMAL, 10)
-            
-            billing_address_lines = 1
-            if invoice_data.buyer_street:
-                billing_address_lines += len([line for line in invoice_data.buyer_street.split('\n') if line.strip()])
-            billing_address_lines += 2
-            if invoice_data.buyer_vat_id:
-                billing_address_lines += 1
-            
-            text_obj.textLine(invoice_data.buyer_name)
-            if invoice_data.buyer_street:
-                for street_line in invoice_data.buyer_street.split('\n'):
-                    text_obj.textLine(street_line)
-            text_obj.textLine(f"{invoice_data.buyer_postal} {invoice_data.buyer_city}")
-            text_obj.textLine(country_english.upper())
-            if invoice_data.buyer_vat_id:
-                text_obj.textLine(f"VAT ID: {invoice_data.buyer_vat_id}")
-            c.drawText(text_obj)
-            
-            # --- Title & Meta Section ---
-            title_y_base = 243.63
-            line_height = 12
-            billing_address_height = billing_address_lines * line_height
-            min_spacing_after_address = 15
-            
-            billing_end_y = billing_y + billing_address_height
-            required_title_y = billing_end_y + min_spacing_after_address
-            title_y = max(title_y_base, required_title_y)
-            
-            c.setFont(self.FONT_BOLD, 18)
-            c.drawString(57.58, self._to_pdf_y(title_y) - 14, "INVOICE")
-            
-            layout_shift = title_y - 243.63
-            if layout_shift < 0:
-                layout_shift = 0
-            
-            # Meta information
-            label_x = 57.58
-            value_x = 168.164
-            
-            c.setFont(self.FONT_NORMAL, 9)
-            
-            y1 = self._to_pdf_y(title_y + 29.007)
-            c.drawString(label_x, y1, "Invoice")
-            c.drawString(value_x, y1, invoice_data.order_id)
-            
-            y2 = self._to_pdf_y(title_y + 40.346)
-            c.drawString(label_x, y2, "Invoice Date")
-            c.drawString(value_x, y2, invoice_date)
-            
-            y3 = self._to_pdf_y(title_y + 51.836)
-            c.drawString(label_x, y3, "Order Date")
-            c.drawString(value_x, y3, invoice_data.purchase_date)
-            
-            y4 = self._to_pdf_y(title_y + 62.966)
-            c.drawString(label_x, y4, "Due Date")
-            c.drawString(value_x, y4, invoice_data.due_date)
-            
-            y5 = self._to_pdf_y(title_y + 74.817)
-            c.drawString(label_x, y5, "Payment Method")
-            c.drawString(value_x, y5, invoice_data.payment_means or invoice_data.sales_channel)
-            
-            y_ord = self._to_pdf_y(365.0 + layout_shift)
-            c.drawString(56.16, y_ord, f"Order Number: {invoice_data.order_id}")
-            
-            # --- Items Table ---
-            header_rect_y_user = 376.106 + layout_shift
-            header_h = 18.0
-            header_rect_y_pdf = self._to_pdf_y(header_rect_y_user, header_h)
-            
-            c.setFillColorRGB(0.9, 0.9, 0.9)
-            c.rect(56.16, header_rect_y_pdf, 494.362, header_h, fill=1, stroke=0)
-            c.setFillColor(colors.black)
-            
-            target_top_y = self._to_pdf_y(376.106 + layout_shift)
-            target_bot_y = self._to_pdf_y(394.248 + layout_shift)
-            
-            c.setLineWidth(0.75)
-            c.line(56.16, target_top_y, 56.16 + 494.36, target_top_y)
-            c.line(56.16, target_bot_y, 56.16 + 494.36, target_bot_y)
-            
-            header_text_y = self._to_pdf_y(379.90 + layout_shift) - 7
-            
-            cols = [
-                (65.57, "No"),
-                (93.01, "Number"),
-                (175.22, "Item"),
-                (398.06, "Qty"),
-                (467.36, "Price"),
-                (508.70, "Total")
-            ]
-            
-            for i, (x, title) in enumerate(cols):
-                if title in ["Qty", "Price", "Total"]:
-                    c.drawRightString(x + 40, header_text_y, title)
-                else:
-                    c.drawString(x, header_text_y, title)
-            
-            # Draw items
-            current_y_user = 395.00 + layout_shift
-            
-            for i, item in enumerate(invoice_data.items, 1):
-                y_pos = self._to_pdf_y(current_y_user) - 9
-                
-                c.drawString(cols[0][0], y_pos, str(i))
-                c.drawString(cols[1][0], y_pos, item.sku)
-                c.drawString(cols[2][0], y_pos, item.product_name[:45])
-                
-                c.drawRightString(435.0, y_pos, f"{item.quantity},00")
-                c.drawRightString(505.0, y_pos, self._format_price(item.unit_price_incl, invoice_data.currency))
-                c.drawRightString(547.62, y_pos, self._format_price(item.item_total, invoice_data.currency))
-                
-                line_y = self._to_pdf_y(current_y_user + 25.20)
-                c.line(56.16, line_y, 550.52, line_y)
-                
-                current_y_user += 25.20
-            
-            # --- Totals ---
-            label_x_totals = 332.81
-            value_right_x = 547.62
-            
-            item_count_shift = (len(invoice_data.items) - 1) * 25.20
-            
-            def draw_total_row_fixed(user_y, label, val_str, bold=False):
-                y = self._to_pdf_y(user_y + layout_shift + item_count_shift) - 8
-                if bold:
-                    c.setFont(self.FONT_BOLD, 9)
-                else:
-                    c.setFont(self.FONT_NORMAL, 9)
-                
-                c.drawString(label_x_totals, y, label)
-                c.drawRightString(value_right_x, y, val_str)
-            
-            vat_percent = f"{invoice_data.vat_rate*100:.1f}".replace('.', ',') + "%"
-            
-            item_gross = sum(item.item_total for item in invoice_data.items)
-            has_promotion = invoice_data.promotion_discount > 0
-            
-            if has_promotion:
-                item_net_before_discount = item_gross / (1 + invoice_data.vat_rate) if invoice_data.vat_rate > 0 else item_gross
-                discount_net = invoice_data.promotion_discount
-                item_net = item_net_before_discount - discount_net
-            else:
-                item_net = item_gross / (1 + invoice_data.vat_rate) if invoice_data.vat_rate > 0 else item_gross
-            
-            shipping_net = invoice_data.shipping_total / (1 + invoice_data.vat_rate) if invoice_data.vat_rate > 0 else invoice_data.shipping_total
-            total_net = item_net + shipping_net
-            
-            if has_promotion:
-                draw_total_row_fixed(425.33, "Subtotal (net)", self._format_price(item_net_before_discount, invoice_data.currency))
-                draw_total_row_fixed(439.65, "Discount", "-" + self._format_price(discount_net, invoice_data.currency))
-                draw_total_row_fixed(453.95, "Shipping", self._format_price(invoice_data.shipping_total, invoice_data.currency))
-                draw_total_row_fixed(468.12, "Total (net)", self._format_price(total_net, invoice_data.currency))
-                draw_total_row_fixed(482.29, f"VAT ({vat_percent})", self._format_price(invoice_data.vat_amount, invoice_data.currency))
-                draw_total_row_fixed(501.97, "Grand Total", self._format_price(invoice_data.grand_total, invoice_data.currency), bold=True)
-            else:
-                draw_total_row_fixed(425.33, "Subtotal (net)", self._format_price(item_net, invoice_data.currency))
-                draw_total_row_fixed(439.65, "Shipping", self._format_price(invoice_data.shipping_total, invoice_data.currency))
-                draw_total_row_fixed(453.95, "Total (net)", self._format_price(total_net, invoice_data.currency))
-                draw_total_row_fixed(468.12, f"VAT ({vat_percent})", self._format_price(invoice_data.vat_amount, invoice_data.currency))
-                draw_total_row_fixed(487.97, "Grand Total", self._format_price(invoice_data.grand_total, invoice_data.currency), bold=True)
-            
-            # --- Thank You Message ---
-            ty_y = self._to_pdf_y(542.24 + layout_shift + item_count_shift) - 8
-            c.setFont(self.FONT_NORMAL, 8)
-            c.drawString(57.58, ty_y, "Thank you for your order!")
-            
-            # --- SKU Reference ---
-            sku_section_y = ty_y - 36
-            c.setFont(self.FONT_BOLD, 8)
-            c.drawString(57.58, sku_section_y, "Item Numbers (SKU):")
-            
-            c.setFont(self.FONT_NORMAL, 8)
-            current_sku_y = sku_section_y - 12
-            for item in invoice_data.items:
-                sku_info = f"{item.sku} - {item.product_name[:60]}"
-                c.drawString(57.58, current_sku_y, sku_info)
-                current_sku_y -= 10
-            
-            # --- Footer ---
-            footer_y = self._to_pdf_y(773.29) - 8
-            
-            text_obj = c.beginText(56.16, footer_y)
-            text_obj.setFont(self.FONT_NORMAL, 8)
-            text_obj.setLeading(10)
-            text_obj.textLine(self.company_info["control"])
-            text_obj.textLine(f"Bank Details: {self.company_info['bank']}")
-            text_obj.textLine(f"IBAN: {self.company_info['iban']}")
-            if self.company_info.get('bic'):
-                text_obj.textLine(f"BIC: {self.company_info['bic']}")
-            if invoice_data.payment_terms:
-                text_obj.textLine(f"Payment Terms: {invoice_data.payment_terms}")
-            if invoice_data.payment_reference:
-                text_obj.textLine(f"Payment Reference: {invoice_data.payment_reference}")
-            c.drawText(text_obj)
-            
-            text_obj = c.beginText(304.56, footer_y)
-            text_obj.setFont(self.FONT_NORMAL, 8)
-            text_obj.setLeading(10)
-            text_obj.textLine(self.company_info["court"])
-            text_obj.textLine(f"UID: {self.company_info['uid']}")
-            if self.company_info.get('vat_id'):
-                text_obj.textLine(f"VAT ID: {self.company_info['vat_id']}")
-            if self.company_info.get('company_registration'):
-                text_obj.textLine(f"Registration: {self.company_info['company_registration']}")
-            if self.company_info.get('ceo'):
-                text_obj.textLine(f"Management: {self.company_info['ceo']}")
-            c.drawText(text_obj)
-            
-            # Copyright notice at bottom
-            copyright_y = 20
-            c.setFont(self.FONT_NORMAL, 7)
-            c.setFillColor(colors.grey)
-            c.drawCentredString(297.64, copyright_y, "© 2026 Invoice Generator. All rights reserved.")
-            
+            self.draw(c, invoice_data)
             c.showPage()
             c.save()
             return True
             
-        except Exception as e:
-            print(f"Error generating PDF: {e}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            logger.exception("PDF rendering failed", extra={
+                'event': 'pdf_failed',
+                'invoice_id': invoice_data.order_id
+            })
             return False
+
+    def draw(self, c: canvas.Canvas, invoice_data: InvoiceData):
+        """
+        Draw one invoice onto the current page of a canvas
+        
+        Does not start a new page or save; the caller owns the document.
+        """
+        c.setFont(self.FONT_NORMAL, 10)
+        
+        # Invoice date in DD.MM.YYYY format (today unless given, e.g. for reprints)
+        invoice_date = invoice_data.invoice_date or datetime.now().strftime("%d.%m.%Y")
+        
+        # --- Logo Section ---
+        logo_x = 447.42
+        logo_y_user = 33.45
+        logo_w = 97.35
+        logo_h = 24.66
+        logo_y_pdf = self._to_pdf_y(logo_y_user, logo_h)
+        
+        # Draw logo or company name
+        if self.logo is not None:
+            c.drawImage(self.logo, logo_x, logo_y_pdf, width=logo_w, height=logo_h, mask='auto', preserveAspectRatio=True)
+        else:
+            c.saveState()
+            c.setFillColor(colors.black)
+            c.setFont(self.FONT_BOLD, 16)
+            c.drawString(logo_x + 10, logo_y_pdf + 8, (self.company_info.get("name") or "")[:10].upper())
+            c.restoreState()
+        
+        # --- Delivery Address Block ---
+        addr_start_y = 91.75
+        
+        c.setFont(self.FONT_NORMAL, 7)
+        c.drawString(57.58, self._to_pdf_y(addr_start_y), "Delivery Address:")
+        
+        c.setFont(self.FONT_NORMAL, 10)
+        country_english = self._translate_country_to_english(invoice_data.buyer_country)
+        address_lines = [invoice_data.buyer_name]
+        if invoice_data.buyer_street:
+            address_lines.extend(invoice_data.buyer_street.split('\n'))
+        address_lines.append(f"{invoice_data.buyer_postal} {invoice_data.buyer_city}")
+        address_lines.append(country_english.upper())
+        
+        text_obj = c.beginText(57.58, self._to_pdf_y(addr_start_y + 12))
+        for line in address_lines:
+            text_obj.textLine(ellipsize(line, self.FONT_NORMAL, 10, self.ADDRESS_WIDTH))
+        c.drawText(text_obj)
+        
+        # --- Sender Line ---
+        sender_y_user = 172.26
+        sender_y_pdf = self._to_pdf_y(sender_y_user) - 6
+        
+        c.setFont(self.FONT_NORMAL, 6)
+        c.drawString(56.16, sender_y_pdf, f"From: {self.company_info.get('address_line', '')}")
+        
+        line_y_user = 180.345
+        line_y_pdf = self._to_pdf_y(line_y_user)
+        c.setLineWidth(0.75)
+        c.line(56.16, line_y_pdf, 269.15, line_y_pdf)
+        
+        # --- Billing Address ---
+        billing_y = 199.55
+        text_obj = c.beginText(57.58, self._to_pdf_y(billing_y) - 9)
+        text_obj.setFont(self.FONT_NORMAL, 10)
+        
+        billing_lines = []
+        for line in address_lines:
+            billing_lines.extend(wrap(line, self.FONT_NORMAL, 10, self.ADDRESS_WIDTH, max_lines=2))
+        if invoice_data.buyer_vat_id:
+            billing_lines.append(f"VAT ID: {invoice_data.buyer_vat_id}")
+        billing_address_lines = len(billing_lines)
+        
+        for line in billing_lines:
+            text_obj.textLine(line)
+        c.drawText(text_obj)
+        
+        # --- Title & Meta Section ---
+        title_y_base = 243.63
+        line_height = 12
+        billing_address_height = billing_address_lines * line_height
+        min_spacing_after_address = 15
+        
+        billing_end_y = billing_y + billing_address_height
+        required_title_y = billing_end_y + min_spacing_after_address
+        title_y = max(title_y_base, required_title_y)
+        
+        c.setFont(self.FONT_BOLD, 18)
+        c.drawString(57.58, self._to_pdf_y(title_y) - 14, "INVOICE")
+        
+        layout_shift = title_y - 243.63
+        if layout_shift < 0:
+            layout_shift = 0
+        
+        # Meta information
+        label_x = 57.58
+        value_x = 168.164
+        
+        c.setFont(self.FONT_NORMAL, 9)
+        
+        y1 = self._to_pdf_y(title_y + 29.007)
+        c.drawString(label_x, y1, "Invoice")
+        c.drawString(value_x, y1, invoice_data.order_id)
+        
+        y2 = self._to_pdf_y(title_y + 40.346)
+        c.drawString(label_x, y2, "Invoice Date")
+        c.drawString(value_x, y2, invoice_date)
+        
+        y3 = self._to_pdf_y(title_y + 51.836)
+        c.drawString(label_x, y3, "Order Date")
+        c.drawString(value_x, y3, invoice_data.purchase_date)
+        
+        y4 = self._to_pdf_y(title_y + 62.966)
+        c.drawString(label_x, y4, "Due Date")
+        c.drawString(value_x, y4, invoice_data.due_date)
+        
+        y5 = self._to_pdf_y(title_y + 74.817)
+        c.drawString(label_x, y5, "Payment Method")
+        c.drawString(value_x, y5, invoice_data.payment_means or invoice_data.sales_channel)
+        
+        y_ord = self._to_pdf_y(365.0 + layout_shift)
+        c.drawString(56.16, y_ord, f"Order Number: {invoice_data.order_id}")
+        
+        # --- Items Table ---
+        header_rect_y_user = 376.106 + layout_shift
+        header_h = 18.0
+        header_rect_y_pdf = self._to_pdf_y(header_rect_y_user, header_h)
+        
+        c.setFillColorRGB(0.9, 0.9, 0.9)
+        c.rect(56.16, header_rect_y_pdf, 494.362, header_h, fill=1, stroke=0)
+        c.setFillColor(colors.black)
+        
+        target_top_y = self._to_pdf_y(376.106 + layout_shift)
+        target_bot_y = self._to_pdf_y(394.248 + layout_shift)
+        
+        c.setLineWidth(0.75)
+        c.line(56.16, target_top_y, 56.16 + 494.36, target_top_y)
+        c.line(56.16, target_bot_y, 56.16 + 494.36, target_bot_y)
+        
+        header_text_y = self._to_pdf_y(379.90 + layout_shift) - 7
+        
+        cols = [
+            (65.57, "No"),
+            (93.01, "Number"),
+            (175.22, "Item"),
+            (398.06, "Qty"),
+            (467.36, "Price"),
+            (508.70, "Total")
+        ]
+        
+        for i, (x, title) in enumerate(cols):
+            if title in ["Qty", "Price", "Total"]:
+                c.drawRightString(x + 40, header_text_y, title)
+            else:
+                c.drawString(x, header_text_y, title)
+        
+        # Draw items - all cells go into one text object, which is much
+        # cheaper than a drawString per cell on long invoices
+        current_y_user = 395.00 + layout_shift
+        font, size = self.FONT_NORMAL, 9
+        cells = c.beginText()
+        
+        def cell(x, y, text):
+            cells.setTextOrigin(x, y)
+            cells.textLine(text)
+        
+        for i, item in enumerate(invoice_data.items, 1):
+            y_pos = self._to_pdf_y(current_y_user) - 9
+            
+            cell(cols[0][0], y_pos, str(i))
+            cell(cols[1][0], y_pos, ellipsize(item.sku, font, size, self.SKU_COL_WIDTH))
+            name_lines = wrap(item.product_name, font, size, self.NAME_COL_WIDTH, self.NAME_MAX_LINES)
+            for line_no, line in enumerate(name_lines):
+                cell(cols[2][0], y_pos - line_no * self.ROW_LEADING, line)
+            
+            for right_x, value in ((435.0, f"{item.quantity},00"),
+                                   (505.0, self._format_price(item.unit_price_incl, invoice_data.currency)),
+                                   (547.62, self._format_price(item.item_total, invoice_data.currency))):
+                cell(right_x - text_width(value, font, size), y_pos, value)
+            
+            row_height = self.ROW_HEIGHT + (len(name_lines) - 1) * self.ROW_LEADING
+            line_y = self._to_pdf_y(current_y_user + row_height)
+            c.line(56.16, line_y, 550.52, line_y)
+            
+            current_y_user += row_height
+        c.drawText(cells)
+        
+        # --- Totals ---
+        label_x_totals = 332.81
+        value_right_x = 547.62
+        
+        item_count_shift = current_y_user - (395.00 + layout_shift) - self.ROW_HEIGHT
+        
+        def draw_total_row_fixed(user_y, label, val_str, bold=False):
+            y = self._to_pdf_y(user_y + layout_shift + item_count_shift) - 8
+            if bold:
+                c.setFont(self.FONT_BOLD, 9)
+            else:
+                c.setFont(self.FONT_NORMAL, 9)
+            
+            c.drawString(label_x_totals, y, label)
+            c.drawRightString(value_right_x, y, val_str)
+        
+        vat_percent = f"{invoice_data.vat_rate*100:.1f}".replace('.', ',') + "%"
+        
+        item_gross = sum(item.item_total for item in invoice_data.items)
+        has_promotion = invoice_data.promotion_discount > 0
+        
+        if has_promotion:
+            item_net_before_discount = item_gross / (1 + invoice_data.vat_rate) if invoice_data.vat_rate > 0 else item_gross
+            discount_net = invoice_data.promotion_discount
+            item_net = item_net_before_discount - discount_net
+        else:
+            item_net = item_gross / (1 + invoice_data.vat_rate) if invoice_data.vat_rate > 0 else item_gross
+        
+        shipping_net = invoice_data.shipping_total / (1 + invoice_data.vat_rate) if invoice_data.vat_rate > 0 else invoice_data.shipping_total
+        total_net = item_net + shipping_net
+        
+        if has_promotion:
+            draw_total_row_fixed(425.33, "Subtotal (net)", self._format_price(item_net_before_discount, invoice_data.currency))
+            draw_total_row_fixed(439.65, "Discount", "-" + self._format_price(discount_net, invoice_data.currency))
+            draw_total_row_fixed(453.95, "Shipping", self._format_price(invoice_data.shipping_total, invoice_data.currency))
+            draw_total_row_fixed(468.12, "Total (net)", self._format_price(total_net, invoice_data.currency))
+            draw_total_row_fixed(482.29, f"VAT ({vat_percent})", self._format_price(invoice_data.vat_amount, invoice_data.currency))
+            draw_total_row_fixed(501.97, "Grand Total", self._format_price(invoice_data.grand_total, invoice_data.currency), bold=True)
+        else:
+            draw_total_row_fixed(425.33, "Subtotal (net)", self._format_price(item_net, invoice_data.currency))
+            draw_total_row_fixed(439.65, "Shipping", self._format_price(invoice_data.shipping_total, invoice_data.currency))
+            draw_total_row_fixed(453.95, "Total (net)", self._format_price(total_net, invoice_data.currency))
+            draw_total_row_fixed(468.12, f"VAT ({vat_percent})", self._format_price(invoice_data.vat_amount, invoice_data.currency))
+            draw_total_row_fixed(487.97, "Grand Total", self._format_price(invoice_data.grand_total, invoice_data.currency), bold=True)
+        
+        # --- Thank You Message ---
+        ty_y = self._to_pdf_y(542.24 + layout_shift + item_count_shift) - 8
+        c.setFont(self.FONT_NORMAL, 8)
+        c.drawString(57.58, ty_y, "Thank you for your order!")
+        
+        # --- SKU Reference ---
+        sku_section_y = ty_y - 36
+        c.setFont(self.FONT_BOLD, 8)
+        c.drawString(57.58, sku_section_y, "Item Numbers (SKU):")
+        
+        c.setFont(self.FONT_NORMAL, 8)
+        current_sku_y = sku_section_y - 12
+        for item in invoice_data.items:
+            sku_info = f"{item.sku} - {item.product_name}"
+            c.drawString(57.58, current_sku_y, ellipsize(sku_info, self.FONT_NORMAL, 8, self.SKU_LIST_WIDTH))
+            current_sku_y -= 10
+        
+        # --- Footer ---
+        footer_y = self._to_pdf_y(773.29) - 8
+        
+        text_obj = c.beginText(56.16, footer_y)
+        text_obj.setFont(self.FONT_NORMAL, 8)
+        text_obj.setLeading(10)
+        for line in self.footer_left_lines:
+            text_obj.textLine(line)
+        if invoice_data.payment_terms:
+            text_obj.textLine(f"Payment Terms: {invoice_data.payment_terms}")
+        if invoice_data.payment_reference:
+            text_obj.textLine(f"Payment Reference: {invoice_data.payment_reference}")
+        c.drawText(text_obj)
+        
+        text_obj = c.beginText(304.56, footer_y)
+        text_obj.setFont(self.FONT_NORMAL, 8)
+        text_obj.setLeading(10)
+        for line in self.footer_right_lines:
+            text_obj.textLine(line)
+        c.drawText(text_obj)
+        
+        # Copyright notice at bottom
+        copyright_y = 20
+        c.setFont(self.FONT_NORMAL, 7)
+        c.setFillColor(colors.grey)
+        c.drawCentredString(297.64, copyright_y, "© 2026 Invoice Generator. All rights reserved.")
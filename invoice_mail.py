@@ -0,0 +1,334 @@
+"""
+Invoice email dispatch
+Sends invoice PDFs to buyers through a small pool of persistent SMTP
+connections, with retries and a delivery status recorded per invoice.
+Deliveries are claimed before sending, so concurrent runs never send the
+same invoice twice.
+"""
+
+import random
+import smtplib
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from email.message import EmailMessage
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from invoice_registry import InvoiceRegistry, InvoiceRecord
+from storage import LocalStorage
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS email_deliveries (
+    order_id TEXT PRIMARY KEY,
+    recipient TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_email_deliveries_status ON email_deliveries (status);
+"""
+
+PENDING = 'pending'
+SENDING = 'sending'  # Claimed by a running send()
+SENT = 'sent'
+FAILED = 'failed'
+
+
+@dataclass
+class SmtpSettings:
+    """Where and how to deliver mail"""
+    host: str
+    port: int = 587
+    username: Optional[str] = None
+    password: Optional[str] = None
+    starttls: bool = True
+    sender: str = 'invoices@localhost'
+    timeout: float = 30.0
+
+
+class PermanentFailure(Exception):
+    """The server rejected the message; retrying will not help"""
+
+
+class _Connection:
+    """One pooled SMTP session, reopened when dropped or worn out"""
+
+    def __init__(self, settings: SmtpSettings, max_messages: int):
+        self.settings = settings
+        self.max_messages = max_messages
+        self.smtp: Optional[smtplib.SMTP] = None
+        self.sent = 0
+
+    def _open(self):
+        settings = self.settings
+        smtp = smtplib.SMTP(settings.host, settings.port, timeout=settings.timeout)
+        try:
+            smtp.ehlo()
+            if settings.starttls:
+                smtp.starttls()
+                smtp.ehlo()
+            if settings.username:
+                smtp.login(settings.username, settings.password or '')
+        except BaseException:
+            smtp.close()
+            raise
+        self.smtp = smtp
+        self.sent = 0
+
+    def send(self, message: EmailMessage):
+        if self.smtp is not None and self.sent >= self.max_messages:
+            self.close()
+        if self.smtp is None:
+            self._open()
+        try:
+            self.smtp.send_message(message)
+        except smtplib.SMTPRecipientsRefused as e:
+            # 4xx (mailbox busy, greylisting) is worth retrying; the session stays usable
+            if all(500 <= code < 600 for code, _ in e.recipients.values()):
+                raise PermanentFailure(f"Recipient refused: {e.recipients}")
+            raise
+        except smtplib.SMTPResponseException as e:
+            if 500 <= e.smtp_code < 600:
+                raise PermanentFailure(f"{e.smtp_code} {e.smtp_error!r}")
+            self.close()
+            raise
+        except (smtplib.SMTPException, OSError):
+            # Broken session - reconnect on the next attempt
+            self.close()
+            raise
+        self.sent += 1
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                self.smtp.close()
+            self.smtp = None
+
+
+class InvoiceMailer:
+    """
+    Dispatches invoice emails
+
+    Invoices generated with a buyer email are queued as 'pending' in the
+    same transaction that registers them; send() delivers the pending ones.
+    Each worker thread keeps its own SMTP session open for the whole run,
+    so thousands of invoices cost a handful of handshakes.
+    """
+
+    def __init__(self, registry: InvoiceRegistry, storage: LocalStorage, settings: Optional[SmtpSettings],
+                 pool_size: int = 4, max_attempts: int = 4, backoff: float = 2.0,
+                 messages_per_connection: int = 100, claim_timeout: float = 1800.0):
+        """
+        Args:
+            registry: Invoice registry to attach to (before its first use)
+            storage: Where the generated PDFs are kept
+            settings: SMTP server (None disables sending, invoices are still queued)
+            pool_size: Concurrent SMTP connections
+            max_attempts: Tries per message before it is marked failed
+            backoff: Base delay in seconds, doubled after every failed try
+            messages_per_connection: Reconnect after this many messages
+            claim_timeout: Seconds after which a delivery claimed by a run that died is sent again
+        """
+        self.registry = registry
+        self.storage = storage
+        self.settings = settings
+        self.pool_size = max(1, pool_size)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.messages_per_connection = messages_per_connection
+        self.claim_timeout = claim_timeout
+        registry.add_listener(self._on_commit, schema=SCHEMA)
+
+    def _on_commit(self, conn: sqlite3.Connection, records: List[InvoiceRecord]):
+        now = time.time()
+        conn.executemany(
+            "INSERT OR IGNORE INTO email_deliveries (order_id, recipient, status, updated_at) "
+            "VALUES (?, ?, ?, ?)",
+            [(r.invoice.order_id, r.invoice.buyer_email, PENDING, now)
+             for r in records if getattr(r.invoice, 'buyer_email', None)]
+        )
+
+    def status(self, order_id: str) -> Optional[Dict]:
+        """Delivery status of one invoice (None if it has no email)"""
+        row = self.registry.connection().execute(
+            "SELECT recipient, status, attempts, last_error, updated_at "
+            "FROM email_deliveries WHERE order_id = ?",
+            (order_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        recipient, status, attempts, last_error, updated_at = row
+        return {
+            'recipient': recipient,
+            'status': status,
+            'attempts': attempts,
+            'last_error': last_error,
+            'updated_at': updated_at
+        }
+
+    def build_message(self, record: Dict, recipient: str) -> EmailMessage:
+        """Email with the invoice PDF attached"""
+        data = record['data']
+        order_id = record['order_id']
+        message = EmailMessage()
+        message['From'] = self.settings.sender
+        message['To'] = recipient
+        message['Subject'] = f"Invoice {order_id}"
+        message.set_content(
+            f"Dear {data.get('buyer_name') or 'customer'},\n\n"
+            f"please find attached invoice {order_id} "
+            f"(total {data['grand_total']:.2f} {data.get('currency', '')}).\n"
+        )
+        path = self.storage.fetch(record['filename'])
+        if path is None:
+            raise FileNotFoundError(record['filename'])
+        with open(path, 'rb') as f:
+            message.add_attachment(f.read(), maintype='application', subtype='pdf',
+                                   filename=record['filename'])
+        return message
+
+    def _record_result(self, order_id: str, status: str, attempts: int, error: Optional[str]):
+        self.registry.connection().execute(
+            "UPDATE email_deliveries SET status = ?, attempts = attempts + ?, last_error = ?, "
+            "updated_at = ? WHERE order_id = ?",
+            (status, attempts, error, time.time(), order_id)
+        )
+
+    def _claim(self, order_id: str, wanted: Tuple[str, ...]) -> Optional[Tuple[str, str]]:
+        """Take a delivery for this run; returns (recipient, previous status), or None if it is not ours to send"""
+        conn = self.registry.connection()
+        row = conn.execute(
+            "SELECT recipient, status, updated_at FROM email_deliveries WHERE order_id = ?", (order_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        recipient, status, updated_at = row
+        abandoned = status == SENDING and updated_at < time.time() - self.claim_timeout
+        if status not in wanted and not abandoned:
+            return None
+        # Only succeeds if no other run claimed or finished it since the SELECT
+        claimed = conn.execute(
+            "UPDATE email_deliveries SET status = ?, updated_at = ? "
+            "WHERE order_id = ? AND status = ? AND updated_at = ?",
+            (SENDING, time.time(), order_id, status, updated_at)
+        ).rowcount
+        if not claimed:
+            return None
+        return recipient, PENDING if abandoned else status
+
+    def _release(self, order_id: str, status: str):
+        """Give back a claimed delivery that was not attempted"""
+        self.registry.connection().execute(
+            "UPDATE email_deliveries SET status = ?, updated_at = ? WHERE order_id = ? AND status = ?",
+            (status, time.time(), order_id, SENDING)
+        )
+
+    def _deliver(self, local: threading.local, connections: List[_Connection],
+                 lock: threading.Lock, record: Dict, recipient: str, previous: str) -> str:
+        """
+        Send one claimed invoice with retries; runs on a pool thread
+
+        Raises:
+            smtplib.SMTPAuthenticationError: Login failed (the claim is released)
+        """
+        connection = getattr(local, 'connection', None)
+        if connection is None:
+            connection = local.connection = _Connection(self.settings, self.messages_per_connection)
+            with lock:
+                connections.append(connection)
+
+        attempts = 0
+        error = None
+        try:
+            message = self.build_message(record, recipient)
+        except Exception as e:
+            self._record_result(record['order_id'], FAILED, 0, f"Cannot attach PDF: {e!r}")
+            return FAILED
+
+        while attempts < self.max_attempts:
+            attempts += 1
+            try:
+                connection.send(message)
+                self._record_result(record['order_id'], SENT, attempts, None)
+                return SENT
+            except smtplib.SMTPAuthenticationError:
+                # Wrong credentials fail every message alike - give it back and stop the run
+                self._release(record['order_id'], previous)
+                raise
+            except PermanentFailure as e:
+                error = str(e)
+                break
+            except (smtplib.SMTPException, OSError) as e:
+                error = f"{type(e).__name__}: {e}"
+                if attempts < self.max_attempts:
+                    # Exponential backoff with jitter, so workers do not retry in lockstep
+                    time.sleep(self.backoff * 2 ** (attempts - 1) * random.uniform(0.5, 1.5))
+        self._record_result(record['order_id'], FAILED, attempts, error)
+        return FAILED
+
+    def send(self, records: Iterable[Dict], retry_failed: bool = False) -> Dict[str, int]:
+        """
+        Deliver the pending emails among `records` (registry records, e.g. from iter_records)
+
+        Args:
+            records: Invoices to consider; ones without a pending delivery are skipped
+            retry_failed: Also resend deliveries that previously failed
+
+        Returns:
+            Counts per outcome: sent, failed, skipped
+
+        Raises:
+            smtplib.SMTPAuthenticationError: The server rejected the login; the run stops and
+                unsent deliveries keep their status
+        """
+        if self.settings is None:
+            raise RuntimeError("SMTP is not configured")
+
+        wanted = (PENDING, FAILED) if retry_failed else (PENDING,)
+        counts = {SENT: 0, FAILED: 0, 'skipped': 0}
+        local = threading.local()
+        connections: List[_Connection] = []
+        lock = threading.Lock()
+
+        with ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='smtp') as pool:
+            in_flight: Dict[Future, Tuple[str, str]] = {}  # -> (order_id, status before the claim)
+
+            def collect(futures):
+                for future in futures:
+                    del in_flight[future]
+                    counts[future.result()] += 1
+
+            try:
+                for record in records:
+                    # Keep the queue short so records stay streamed (and claims few)
+                    if len(in_flight) >= self.pool_size * 2:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        collect(done)
+
+                    claim = self._claim(record['order_id'], wanted) if record.get('filename') else None
+                    if claim is None:
+                        counts['skipped'] += 1
+                        continue
+                    recipient, previous = claim
+                    future = pool.submit(self._deliver, local, connections, lock, record, recipient, previous)
+                    in_flight[future] = (record['order_id'], previous)
+
+                collect(list(in_flight))
+            except BaseException:
+                # Deliveries that never started go back to their previous status
+                pool.shutdown(wait=True, cancel_futures=True)
+                for future, (order_id, previous) in in_flight.items():
+                    if future.cancelled():
+                        self._release(order_id, previous)
+                raise
+            finally:
+                pool.shutdown(wait=True)
+                for connection in connections:
+                    connection.close()
+        return counts
@@ -0,0 +1,178 @@
+"""
+Sequential invoice number allocation
+Hands out strictly increasing, gap-free numbers per series (e.g. per year)
+from a locked SQLite counter shared by all workers and batch processes
+"""
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+
+BLOCK_SIZE = 100  # Numbers a batch reserves per transaction
+
+
+def format_invoice_number(series: str, number: int) -> str:
+    """Render an allocated number as an invoice id, e.g. INV-2026-000042"""
+    return f"{series}-{number:06d}"
+
+
+def parse_invoice_number(invoice_id: str) -> Tuple[str, int]:
+    """Inverse of format_invoice_number: INV-2026-000042 -> ('INV-2026', 42)"""
+    series, _, number = invoice_id.rpartition('-')
+    return series, int(number)
+
+
+class InvoiceNumberAllocator:
+    """
+    Durable per-series counters
+
+    Every allocation is committed (and fsynced) before the number is handed out,
+    so a crash can never hand out the same number twice. Batches reserve blocks
+    of numbers through NumberBlocks instead of one transaction per invoice.
+    Numbers that were allocated but not used must be recorded with void(),
+    which keeps the sequence free of unexplained gaps.
+    """
+
+    def __init__(self, db_path: Path):
+        """
+        Args:
+            db_path: SQLite file holding the counters
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sequences (
+                    series TEXT PRIMARY KEY,
+                    last_value INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS voided (
+                    series TEXT NOT NULL,
+                    number INTEGER NOT NULL,
+                    reason TEXT NOT NULL,
+                    voided_at REAL NOT NULL,
+                    PRIMARY KEY (series, number)
+                );
+            """)
+            self._local.conn = conn
+        return conn
+
+    def allocate(self, series: str, count: int = 1) -> int:
+        """
+        Reserve `count` consecutive numbers in a series
+
+        Returns:
+            The first number of the reserved block
+        """
+        if count < 1:
+            raise ValueError("count must be at least 1")
+
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR IGNORE INTO sequences (series, last_value) VALUES (?, 0)",
+                (series,)
+            )
+            conn.execute(
+                "UPDATE sequences SET last_value = last_value + ? WHERE series = ?",
+                (count, series)
+            )
+            last_value = conn.execute(
+                "SELECT last_value FROM sequences WHERE series = ?", (series,)
+            ).fetchone()[0]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return last_value - count + 1
+
+    def void(self, series: str, number: int, reason: str):
+        """Record that an allocated number was not used for an invoice"""
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO voided (series, number, reason, voided_at) VALUES (?, ?, ?, ?)",
+            (series, number, reason, time.time())
+        )
+
+    def void_block(self, series: str, first: int, end: int, reason: str):
+        """Record that the numbers first..end-1 were not used, in one transaction"""
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO voided (series, number, reason, voided_at) VALUES (?, ?, ?, ?)",
+                [(series, number, reason, now) for number in range(first, end)]
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+class NumberBlocks:
+    """
+    Numbers for one batch, reserved from an allocator a block at a time
+
+    Stands in for the allocator wherever one number is allocated, so a batch
+    of thousands of invoices commits one counter transaction per block rather
+    than per invoice. Numbers still reserved when the batch ends are voided
+    with `reason`; use it as a context manager so that also happens on errors.
+    Safe to share between threads.
+    """
+
+    def __init__(self, allocator: InvoiceNumberAllocator, reason: str,
+                 expected: Optional[int] = None, block_size: int = BLOCK_SIZE):
+        """
+        Args:
+            allocator: Shared counters to reserve from
+            reason: Recorded for numbers reserved but not used
+            expected: Invoices the batch will number at most, if known (keeps the last block small)
+            block_size: Numbers reserved per transaction
+        """
+        self.allocator = allocator
+        self.reason = reason
+        self.remaining = expected
+        self.block_size = block_size
+        self._blocks: Dict[str, Tuple[int, int]] = {}  # series -> (next number, end of block)
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> 'NumberBlocks':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def allocate(self, series: str) -> int:
+        """Next reserved number of a series, reserving a new block when needed"""
+        with self._lock:
+            number, end = self._blocks.get(series, (0, 0))
+            if number == end:
+                count = self.block_size
+                if self.remaining is not None:
+                    count = max(1, min(count, self.remaining))
+                number = self.allocator.allocate(series, count)
+                end = number + count
+            self._blocks[series] = (number + 1, end)
+            if self.remaining is not None:
+                self.remaining -= 1
+            return number
+
+    def close(self):
+        """Void the numbers reserved but not handed out"""
+        with self._lock:
+            for series, (number, end) in self._blocks.items():
+                if number < end:
+                    self.allocator.void_block(series, number, end, self.reason)
+            self._blocks.clear()
@@ -0,0 +1,314 @@
+"""
+Invoice registry
+Persists every generated invoice to a local SQLite database with indexes
+for lookups by order id, buyer, country, date and totals
+"""
+
+import base64
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from invoice_generator_web import InvoiceData, invoice_to_dict
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoices (
+    id INTEGER PRIMARY KEY,
+    order_id TEXT NOT NULL UNIQUE,
+    invoice_date TEXT NOT NULL,
+    buyer_name TEXT NOT NULL,
+    buyer_key TEXT NOT NULL,
+    buyer_country TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    vat_rate REAL NOT NULL,
+    net_total REAL NOT NULL,
+    vat_amount REAL NOT NULL,
+    grand_total REAL NOT NULL,
+    filename TEXT,
+    language TEXT,
+    batch_id TEXT,
+    created_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices (invoice_date, id);
+CREATE INDEX IF NOT EXISTS idx_invoices_buyer ON invoices (buyer_key, invoice_date, id);
+CREATE INDEX IF NOT EXISTS idx_invoices_country ON invoices (buyer_country, invoice_date, id);
+CREATE INDEX IF NOT EXISTS idx_invoices_total ON invoices (grand_total);
+CREATE INDEX IF NOT EXISTS idx_invoices_batch ON invoices (batch_id) WHERE batch_id IS NOT NULL;
+"""
+
+# Columns added after the first release: (name, definition)
+MIGRATIONS = (
+    ('company_profile', "TEXT NOT NULL DEFAULT 'default'"),
+)
+
+# Columns returned by queries (everything except the full JSON document)
+SUMMARY_COLUMNS = (
+    'order_id', 'invoice_date', 'buyer_name', 'buyer_country', 'currency', 'vat_rate',
+    'net_total', 'vat_amount', 'grand_total', 'filename', 'language', 'batch_id',
+    'company_profile'
+)
+
+
+@dataclass
+class InvoiceRecord:
+    """A generated invoice together with where and how it was rendered"""
+    invoice: InvoiceData
+    invoice_date: date
+    filename: Optional[str] = None
+    language: str = 'en'
+    batch_id: Optional[str] = None
+    company_profile: str = 'default'
+
+
+def buyer_key(name: str) -> str:
+    """Normalized buyer name used for case-insensitive prefix search"""
+    return ' '.join((name or '').split()).casefold()
+
+
+def encode_cursor(invoice_date: str, row_id: int) -> str:
+    """Opaque keyset pagination cursor"""
+    raw = json.dumps([invoice_date, row_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """Inverse of encode_cursor; raises ValueError on malformed input"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        invoice_date, row_id = json.loads(raw)
+        return str(invoice_date), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+class InvoiceRegistry:
+    """SQLite-backed index of every generated invoice"""
+
+    def __init__(self, db_path: Path):
+        """
+        Args:
+            db_path: SQLite file for the registry
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._schemas: List[str] = []
+        self._listeners: List[Callable[[sqlite3.Connection, List[InvoiceRecord]], None]] = []
+
+    def add_listener(self, callback: Callable[[sqlite3.Connection, List[InvoiceRecord]], None],
+                     schema: Optional[str] = None):
+        """
+        Run `callback(conn, records)` inside every insert transaction, so derived
+        tables commit (or roll back) together with the invoices themselves.
+        Register listeners at startup, before the registry is first used.
+
+        Args:
+            callback: Called with the open connection and the inserted records
+            schema: Extra DDL the listener needs, applied to every new connection
+        """
+        if schema:
+            self._schemas.append(schema)
+        self._listeners.append(callback)
+
+    def connection(self) -> sqlite3.Connection:
+        """Per-thread connection (created on first use)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(invoices)")}
+            for name, definition in MIGRATIONS:
+                if name not in columns:
+                    try:
+                        conn.execute(f"ALTER TABLE invoices ADD COLUMN {name} {definition}")
+                    except sqlite3.OperationalError:
+                        pass  # Added concurrently by another worker
+            for schema in self._schemas:
+                conn.executescript(schema)
+            self._local.conn = conn
+        return conn
+
+    def add(self, record: InvoiceRecord):
+        """Persist a single invoice"""
+        self.add_many([record])
+
+    def add_many(self, records: Iterable[InvoiceRecord]):
+        """Persist many invoices in one transaction"""
+        now = time.time()
+        records = list(records)
+        rows = []
+        for record in records:
+            invoice = record.invoice
+            rows.append((
+                invoice.order_id,
+                record.invoice_date.isoformat(),
+                invoice.buyer_name,
+                buyer_key(invoice.buyer_name),
+                (invoice.buyer_country or '').upper(),
+                invoice.currency,
+                invoice.vat_rate,
+                invoice.item_subtotal,
+                invoice.vat_amount,
+                invoice.grand_total,
+                record.filename,
+                record.language,
+                record.batch_id,
+                record.company_profile,
+                now,
+                json.dumps(invoice_to_dict(invoice), ensure_ascii=False, separators=(',', ':'))
+            ))
+        if not rows:
+            return
+
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO invoices (order_id, invoice_date, buyer_name, buyer_key, buyer_country, "
+                "currency, vat_rate, net_total, vat_amount, grand_total, filename, language, "
+                "batch_id, company_profile, created_at, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            for listener in self._listeners:
+                listener(conn, records)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, order_id: str) -> Optional[Dict]:
+        """Full record of one invoice, including the stored invoice data"""
+        row = self.connection().execute(
+            f"SELECT {', '.join(SUMMARY_COLUMNS)}, data FROM invoices WHERE order_id = ?",
+            (order_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        result = dict(zip(SUMMARY_COLUMNS, row[:-1]))
+        result['data'] = json.loads(row[-1])
+        return result
+
+    def query(self, order_id: Optional[str] = None, buyer: Optional[str] = None,
+              country: Optional[str] = None, date_from: Optional[date] = None,
+              date_to: Optional[date] = None, min_total: Optional[float] = None,
+              max_total: Optional[float] = None, batch_id: Optional[str] = None,
+              limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Search invoices, newest invoice date first
+
+        Args:
+            buyer: Case-insensitive buyer name prefix
+            cursor: next_cursor value of the previous page
+
+        Returns:
+            (invoices, next_cursor) - next_cursor is None on the last page
+        """
+        where = []
+        params = []
+        if order_id:
+            where.append("order_id = ?")
+            params.append(order_id)
+        if buyer:
+            key = buyer_key(buyer)
+            where.append("buyer_key >= ? AND buyer_key < ?")
+            params.extend([key, key + '\uffff'])
+        if country:
+            where.append("buyer_country = ?")
+            params.append(country.upper())
+        if date_from:
+            where.append("invoice_date >= ?")
+            params.append(date_from.isoformat())
+        if date_to:
+            where.append("invoice_date <= ?")
+            params.append(date_to.isoformat())
+        if min_total is not None:
+            where.append("grand_total >= ?")
+            params.append(min_total)
+        if max_total is not None:
+            where.append("grand_total <= ?")
+            params.append(max_total)
+        if batch_id:
+            where.append("batch_id = ?")
+            params.append(batch_id)
+        if cursor:
+            after_date, after_id = decode_cursor(cursor)
+            where.append("(invoice_date, id) < (?, ?)")
+            params.extend([after_date, after_id])
+
+        sql = f"SELECT id, {', '.join(SUMMARY_COLUMNS)} FROM invoices"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY invoice_date DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        rows = self.connection().execute(sql, params).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(last[2], last[0])
+        return [dict(zip(SUMMARY_COLUMNS, row[1:])) for row in rows], next_cursor
+
+    def iter_records(self, batch_size: int = 1000, order_ids: Optional[List[str]] = None,
+                     date_from: Optional[date] = None, date_to: Optional[date] = None,
+                     batch_id: Optional[str] = None) -> Iterator[Dict]:
+        """
+        Stream stored invoices (summary plus data) in insertion order
+
+        Args:
+            batch_size: Rows fetched per query
+            order_ids, date_from, date_to, batch_id: Optional filters
+        """
+        where, params = self._selection(order_ids, date_from, date_to, batch_id)
+        conn = self.connection()
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                f"SELECT id, {', '.join(SUMMARY_COLUMNS)}, data FROM invoices "
+                f"WHERE {' AND '.join(['id > ?'] + where)} ORDER BY id LIMIT ?",
+                [last_id] + params + [batch_size]
+            ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                result = dict(zip(SUMMARY_COLUMNS, row[1:-1]))
+                result['data'] = json.loads(row[-1])
+                yield result
+            last_id = rows[-1][0]
+
+    def count(self, order_ids: Optional[List[str]] = None, date_from: Optional[date] = None,
+              date_to: Optional[date] = None, batch_id: Optional[str] = None) -> int:
+        """Number of invoices iter_records would yield for the same filters"""
+        where, params = self._selection(order_ids, date_from, date_to, batch_id)
+        sql = "SELECT COUNT(*) FROM invoices"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return self.connection().execute(sql, params).fetchone()[0]
+
+    @staticmethod
+    def _selection(order_ids, date_from, date_to, batch_id) -> Tuple[List[str], List]:
+        where = []
+        params = []
+        if order_ids is not None:
+            where.append(f"order_id IN ({', '.join('?' * len(order_ids)) or 'NULL'})")
+            params.extend(order_ids)
+        if date_from:
+            where.append("invoice_date >= ?")
+            params.append(date_from.isoformat())
+        if date_to:
+            where.append("invoice_date <= ?")
+            params.append(date_to.isoformat())
+        if batch_id:
+            where.append("batch_id = ?")
+            params.append(batch_id)
+        return where, params
@@ -0,0 +1,298 @@
+"""
+Invoice payload schema
+Validates and converts the /api/generate-invoice payload in a single pass,
+collecting every error with its path. Line items are decoded straight into
+an ItemBatch; with a product catalog, items that name only a SKU get the
+rest of their fields from it. Shared by the web endpoints and the batch /
+import paths.
+"""
+
+import math
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+from invoice_generator_web import ItemBatch
+
+
+class ValidationError(ValueError):
+    """Payload did not match the schema; `errors` lists every problem"""
+
+    def __init__(self, errors: List[Dict[str, str]]):
+        self.errors = errors
+        first = errors[0]
+        super().__init__(f"{first['path']}: {first['message']}" if first['path'] else first['message'])
+
+
+_INVALID = object()
+
+# Caps on money amounts, so totals stay finite and fit the integer cents of the
+# registry and VAT rollups
+MAX_AMOUNT = 1e9   # Unit price or shipping
+MAX_TOTAL = 1e12   # Net total of one invoice
+
+# A converter takes (value, path, errors) and returns the converted value,
+# or _INVALID after appending an error
+Converter = Callable[[Any, str, List[Dict[str, str]]], Any]
+
+
+def _error(errors: List[Dict[str, str]], path: str, message: str):
+    errors.append({'path': path, 'message': message})
+    return _INVALID
+
+
+def string(max_length: int = 500, choices: Optional[Tuple[str, ...]] = None,
+           upper: bool = False) -> Converter:
+    """Text field, optionally restricted to a set of values"""
+    def convert(value, path, errors):
+        if not isinstance(value, str):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                value = str(value)
+            else:
+                return _error(errors, path, "must be a string")
+        value = value.strip()
+        if upper:
+            value = value.upper()
+        if len(value) > max_length:
+            return _error(errors, path, f"must be at most {max_length} characters")
+        if choices is not None and value not in choices:
+            return _error(errors, path, f"must be one of: {', '.join(choices)}")
+        return value
+    return convert
+
+
+def number(minimum: Optional[float] = None, maximum: Optional[float] = None) -> Converter:
+    """Finite decimal number (numeric strings are accepted)"""
+    def convert(value, path, errors):
+        if isinstance(value, bool):
+            return _error(errors, path, "must be a number")
+        if not isinstance(value, float):
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                return _error(errors, path, "must be a number")
+        if not math.isfinite(value):
+            return _error(errors, path, "must be a finite number")
+        if minimum is not None and value < minimum:
+            return _error(errors, path, f"must be at least {minimum:g}")
+        if maximum is not None and value > maximum:
+            return _error(errors, path, f"must be at most {maximum:g}")
+        return value
+    return convert
+
+
+def integer(minimum: Optional[int] = None, maximum: Optional[int] = None) -> Converter:
+    """Whole number (integral floats and numeric strings are accepted)"""
+    def convert(value, path, errors):
+        if isinstance(value, bool):
+            return _error(errors, path, "must be an integer")
+        if not isinstance(value, int):
+            try:
+                as_float = float(value)
+            except (TypeError, ValueError):
+                return _error(errors, path, "must be an integer")
+            if not as_float.is_integer():
+                return _error(errors, path, "must be an integer")
+            value = int(as_float)
+        if minimum is not None and value < minimum:
+            return _error(errors, path, f"must be at least {minimum}")
+        if maximum is not None and value > maximum:
+            return _error(errors, path, f"must be at most {maximum}")
+        return value
+    return convert
+
+
+def email() -> Converter:
+    """Single email address (syntax check only)"""
+    check = string(max_length=254)
+
+    def convert(value, path, errors):
+        value = check(value, path, errors)
+        if value is _INVALID:
+            return value
+        local, _, domain = value.rpartition('@')
+        if not local or '.' not in domain or any(ch.isspace() or ch in ',;<>' for ch in value):
+            return _error(errors, path, "must be an email address")
+        return value
+    return convert
+
+
+class Field:
+    """One schema entry; `default` may be a callable taking the item index"""
+
+    __slots__ = ('name', 'convert', 'required', 'default')
+
+    def __init__(self, name: str, convert: Converter, required: bool = False, default: Any = None):
+        self.name = name
+        self.convert = convert
+        self.required = required
+        self.default = default
+
+
+class Schema:
+    """
+    Compiled object schema
+
+    Missing, null and blank-string values count as absent: required fields
+    report an error, optional ones take their default.
+    """
+
+    def __init__(self, fields: List[Field]):
+        # Compile to plain tuples for a tight decode loop
+        self._fields = tuple((f.name, f.convert, f.required, f.default) for f in fields)
+        self.names = frozenset(f.name for f in fields)
+
+    def decode_into(self, obj: Any, path: str, errors: List[Dict[str, str]],
+                    index: int = 0) -> Optional[Dict[str, Any]]:
+        """Convert one object, appending problems to `errors`"""
+        if not isinstance(obj, dict):
+            _error(errors, path, "must be an object")
+            return None
+        prefix = f"{path}." if path else ""
+        result = {}
+        for name, convert, required, default in self._fields:
+            value = obj.get(name)
+            if isinstance(value, str):
+                value = value.strip()
+            if value is None or value == "":
+                if required:
+                    _error(errors, prefix + name, "is required")
+                    continue
+                result[name] = default(index) if callable(default) else default
+                continue
+            value = convert(value, prefix + name, errors)
+            if value is not _INVALID:
+                result[name] = value
+        return result
+
+
+ITEM_SCHEMA = Schema([
+    Field('product_name', string(), default=lambda idx: f'Item {idx + 1}'),
+    Field('sku', string(max_length=100), default=lambda idx: f'SKU-{idx + 1}'),
+    Field('quantity', integer(minimum=1, maximum=1_000_000), default=1),
+    Field('unit_price', number(minimum=0, maximum=MAX_AMOUNT), default=0.0),
+    Field('unit_code', string(max_length=3, upper=True), default='C62'),
+    Field('asin', string(max_length=20), default='N/A'),
+])
+
+INVOICE_SCHEMA = Schema([
+    Field('buyer_name', string(max_length=200), required=True),
+    Field('buyer_country', string(max_length=2, upper=True), required=True),
+    Field('buyer_street', string(), default=''),
+    Field('buyer_city', string(max_length=200), default=''),
+    Field('buyer_postal', string(max_length=20), default=''),
+    Field('buyer_vat_id', string(max_length=30)),
+    Field('buyer_email', email()),
+    Field('vat_id', string(max_length=30)),
+    Field('vat_rate_type', string(choices=('standard', 'reduced')), default='standard'),
+    Field('shipping_total', number(minimum=0, maximum=MAX_AMOUNT), default=0.0),
+    Field('currency', string(max_length=5), default='€'),
+    Field('shipping_service', string(max_length=100), default='Standard'),
+    Field('payment_terms', string(max_length=100), default='Net 30'),
+    Field('payment_means', string(max_length=100), default='Credit transfer'),
+    Field('payment_reference', string(max_length=140)),
+    Field('language', string(choices=('en', 'de')), default='en'),
+    Field('company_profile', string(max_length=100)),
+])
+
+# Just what /api/quote needs to compute totals, so a half-filled form can be priced
+QUOTE_SCHEMA = Schema([
+    Field('buyer_country', string(max_length=2, upper=True), required=True),
+    Field('vat_rate_type', string(choices=('standard', 'reduced')), default='standard'),
+    Field('shipping_total', number(minimum=0, maximum=MAX_AMOUNT), default=0.0),
+    Field('currency', string(max_length=5), default='€'),
+    Field('payment_terms', string(max_length=100), default='Net 30'),
+])
+
+
+# Item fields a catalog product fills in when the item leaves them out
+PRODUCT_FIELDS = ('product_name', 'unit_price', 'unit_code', 'asin')
+
+
+def _blank(value: Any) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _expand(raw: Dict[str, Any], products: Mapping[str, Any], path: str,
+            errors: List[Dict[str, str]]) -> Dict[str, Any]:
+    """Complete an item from the catalog product of its SKU; explicit fields win"""
+    sku = raw.get('sku')
+    if not isinstance(sku, str) or not (_blank(raw.get('product_name')) or _blank(raw.get('unit_price'))):
+        return raw
+    product = products.get(sku.strip())
+    if product is None:
+        # A SKU-only item cannot be priced; a named one keeps the old defaults
+        if _blank(raw.get('product_name')) and _blank(raw.get('unit_price')):
+            _error(errors, f"{path}.sku", "is not in the product catalog")
+        return raw
+    expanded = {field: getattr(product, field) for field in PRODUCT_FIELDS}
+    expanded.update((key, value) for key, value in raw.items() if not _blank(value))
+    return expanded
+
+
+def decode_items(raw_items: Any, errors: List[Dict[str, str]], path: str = 'items',
+                 products: Optional[Mapping[str, Any]] = None) -> ItemBatch:
+    """
+    Validate line items and append them to a new ItemBatch
+
+    Args:
+        products: Catalog products by SKU (see products.ProductCatalog.lookup); when
+            given, even empty, a SKU-only item must be in it
+    """
+    items = ItemBatch()
+    if not isinstance(raw_items, list) or not raw_items:
+        _error(errors, path, "at least one item is required")
+        return items
+
+    decode = ITEM_SCHEMA.decode_into
+    append = items.append
+    for idx, raw in enumerate(raw_items):
+        before = len(errors)
+        item_path = f"{path}[{idx}]"
+        if products is not None and isinstance(raw, dict):
+            raw = _expand(raw, products, item_path, errors)
+        item = decode(raw, item_path, errors, idx)
+        if item is not None and len(errors) == before:
+            append(item['product_name'], item['sku'], item['quantity'],
+                   item['unit_price'], item['unit_code'], item['asin'])
+    return items
+
+
+def _decode_payload(payload: Any, schema: Schema, products: Optional[Mapping[str, Any]]) -> Dict[str, Any]:
+    errors: List[Dict[str, str]] = []
+    if not isinstance(payload, dict):
+        raise ValidationError([{'path': '', 'message': 'Request body must be a JSON object'}])
+
+    data = schema.decode_into(payload, '', errors)
+    data['items'] = decode_items(payload.get('items'), errors, products=products)
+    if not errors and data['items'].total() + data['shipping_total'] > MAX_TOTAL:
+        _error(errors, 'items', f"net total must be at most {MAX_TOTAL:g}")
+    if errors:
+        raise ValidationError(errors)
+    return data
+
+
+def decode_invoice_payload(payload: Any, products: Optional[Mapping[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Validate and convert an invoice payload in one pass
+
+    Args:
+        payload: Parsed JSON body
+        products: Catalog products by SKU, to complete SKU-only items
+
+    Returns:
+        Dict with every INVOICE_SCHEMA field (defaults applied) and
+        'items' as an ItemBatch
+
+    Raises:
+        ValidationError: With every problem found, each with its path
+    """
+    return _decode_payload(payload, INVOICE_SCHEMA, products)
+
+
+def decode_quote_payload(payload: Any, products: Optional[Mapping[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Validate the subset of an invoice payload needed for a quote
+
+    Raises:
+        ValidationError: With every problem found, each with its path
+    """
+    return _decode_payload(payload, QUOTE_SCHEMA, products)
@@ -0,0 +1,445 @@
+"""
+Load-test harness
+Replays the request mix of a gunicorn access log (plus synthesized
+/api/generate-invoice payloads) against a local instance started with
+gunicorn_config.py, and reports throughput, latency percentiles, error
+rates and CPU time per gunicorn worker. With --start it also reports the
+render and signing times the workers logged for each invoice.
+
+Usage:
+    python loadtest.py invoicegen-*.log.txt --start --concurrency 16 --requests 2000
+    python loadtest.py access.log --url http://127.0.0.1:8000 --replay --speed 60
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
+
+# Timestamp prefix added by the log collector, then gunicorn's default access log format
+LOG_LINE = re.compile(
+    r'^(?P<ts>\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(?:\.\d+)?)Z?\s+\S+ \S+ \S+ \[[^\]]+\] '
+    r'"(?P<method>[A-Z]+) (?P<path>\S+) HTTP/[\d.]+" (?P<status>\d{3}) (?P<size>\d+|-)'
+)
+
+GENERATE_PATH = '/api/generate-invoice'
+
+
+class LoggedRequest(NamedTuple):
+    offset: float  # Seconds since the first request in the log
+    method: str
+    path: str
+    status: int
+
+
+class Result(NamedTuple):
+    group: str
+    status: int  # 0 for connection errors
+    latency: float
+
+
+def parse_log(paths: List[Path]) -> List[LoggedRequest]:
+    """Requests from access logs, ordered by time"""
+    entries = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                match = LOG_LINE.match(line)
+                if match:
+                    ts = datetime.fromisoformat(match['ts']).timestamp()
+                    entries.append((ts, match['method'], match['path'], int(match['status'])))
+    entries.sort()
+    if not entries:
+        return []
+    start = entries[0][0]
+    return [LoggedRequest(ts - start, method, path, status) for ts, method, path, status in entries]
+
+
+class PayloadFactory:
+    """Random but realistic invoice payloads (countries from vat_rates.json)"""
+
+    PRODUCTS = ['Widget', 'Consulting hour', 'Cable 2m', 'Spare part', 'Subscription', 'Gift card']
+
+    def __init__(self, rates_file: Path, max_items: int, seed: Optional[int] = None):
+        with open(rates_file, 'r', encoding='utf-8') as f:
+            self.countries = sorted(json.load(f)['countries'])
+        self.max_items = max_items
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def make(self) -> bytes:
+        with self._lock:
+            rnd = self.random
+            # Mostly small invoices with a long tail of large ones
+            count = min(self.max_items, max(1, int(rnd.paretovariate(1.5))))
+            payload = {
+                'buyer_name': f"Load Test {rnd.randrange(10 ** 6)}",
+                'buyer_street': 'Teststraße 1',
+                'buyer_city': 'Wien',
+                'buyer_postal': '1010',
+                'buyer_country': rnd.choice(self.countries),
+                'vat_rate_type': rnd.choice(['standard', 'standard', 'reduced']),
+                'shipping_total': round(rnd.uniform(0, 15), 2),
+                'language': rnd.choice(['en', 'de']),
+                'items': [{
+                    'product_name': rnd.choice(self.PRODUCTS),
+                    'sku': f"SKU-{rnd.randrange(10 ** 5)}",
+                    'quantity': rnd.randint(1, 5),
+                    'unit_price': round(rnd.uniform(1, 500), 2)
+                } for _ in range(count)]
+            }
+        return json.dumps(payload).encode('utf-8')
+
+
+def route_group(method: str, path: str) -> str:
+    """Bucket for reporting: the route without ids and file names"""
+    path = path.split('?', 1)[0]
+    if path.startswith('/static/'):
+        return f"{method} /static/*"
+    for prefix in ('/download/', '/preview/', '/thumbnail/', '/api/invoices/'):
+        if path.startswith(prefix):
+            return f"{method} {prefix}*"
+    return f"{method} {path}"
+
+
+class LoadRunner:
+    """Sends requests on a thread pool and records one Result per request"""
+
+    def __init__(self, base_url: str, payloads: PayloadFactory, timeout: float):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.payloads = payloads
+        self.timeout = timeout
+        self.results: List[Result] = []
+        self._lock = threading.Lock()
+
+    def send(self, method: str, path: str):
+        body = None
+        headers = {'User-Agent': 'invoice-loadtest'}
+        if method == 'POST' and path == GENERATE_PATH:
+            body = self.payloads.make()
+            headers['Content-Type'] = 'application/json'
+        elif method not in ('GET', 'HEAD'):
+            method = 'GET'
+
+        started = time.perf_counter()
+        status = 0
+        try:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            finally:
+                conn.close()
+        except (OSError, http.client.HTTPException):
+            pass
+        result = Result(route_group(method, path), status, time.perf_counter() - started)
+        with self._lock:
+            self.results.append(result)
+
+    def run_closed_loop(self, requests: Iterator[Tuple[str, str]], concurrency: int):
+        """Keep `concurrency` requests in flight until the iterator is exhausted"""
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    item = next(requests, None)
+                if item is None:
+                    return
+                self.send(*item)
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run_replay(self, logged: List[Tuple[float, str, str]], concurrency: int, speed: float):
+        """Send each request at its (scaled) original offset; at most `concurrency` in flight"""
+        slots = threading.BoundedSemaphore(concurrency)
+        threads = []
+        start = time.monotonic()
+
+        def send(method, path):
+            try:
+                self.send(method, path)
+            finally:
+                slots.release()
+
+        for offset, method, path in logged:
+            delay = offset / speed - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+            slots.acquire()
+            thread = threading.Thread(target=send, args=(method, path), daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+
+class GunicornServer:
+    """A local gunicorn started with gunicorn_config.py (worker settings overridable)"""
+
+    def __init__(self, port: int, workers: Optional[int], threads: Optional[int], timeout: Optional[int]):
+        self.port = port
+        self.data_dir = tempfile.mkdtemp(prefix='invoice-loadtest-')
+        command = [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn_config.py',
+                   '--bind', f'127.0.0.1:{port}', '--access-logfile', os.devnull]
+        if workers:
+            command += ['--workers', str(workers)]
+        if threads:
+            command += ['--threads', str(threads)]
+        if timeout:
+            command += ['--timeout', str(timeout)]
+        command.append('app:app')
+
+        env = dict(os.environ)
+        env.setdefault('INVOICE_DATA_DIR', os.path.join(self.data_dir, 'data'))
+        env.setdefault('INVOICE_RUNTIME_DIR', os.path.join(self.data_dir, 'runtime'))
+        # Measure capacity, not the rate limiter
+        env.setdefault('RATE_LIMIT_PER_MINUTE', '1000000')
+        env.setdefault('RATE_LIMIT_BURST', '1000000')
+        # Every rendered invoice, not a sample
+        env['LOG_SAMPLE_RATES'] = env.get('LOG_SAMPLE_RATES', 'request=0.1') + ',invoice_generated=1'
+        self.timings: List[Dict[str, float]] = []
+        self.process = subprocess.Popen(command, env=env, stdout=subprocess.PIPE,
+                                        text=True, encoding='utf-8', errors='replace')
+        self._reader = threading.Thread(target=self._read_log, daemon=True)
+        self._reader.start()
+
+    def _read_log(self):
+        """Collect the timings of invoice_generated events; pass all other output through"""
+        for line in self.process.stdout:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                entry = None
+            if isinstance(entry, dict) and entry.get('event') == 'invoice_generated':
+                self.timings.append({key: entry[key] for key in ('render_ms', 'sign_ms') if key in entry})
+            else:
+                sys.stdout.write(line)
+
+    def wait_ready(self, timeout: float = 30.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("gunicorn exited during startup")
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=1)
+                conn.request('GET', '/robots.txt')
+                conn.getresponse().read()
+                conn.close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError("gunicorn did not become ready")
+
+    def worker_pids(self) -> List[int]:
+        pids = []
+        for entry in Path('/proc').glob('[0-9]*'):
+            try:
+                fields = (entry / 'stat').read_text().rsplit(')', 1)[1].split()
+            except OSError:
+                continue
+            if int(fields[1]) == self.process.pid:
+                pids.append(int(entry.name))
+        return sorted(pids)
+
+    def stop(self):
+        self.process.send_signal(signal.SIGTERM)
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self._reader.join(timeout=5)
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+
+def cpu_seconds(pid: int) -> Optional[float]:
+    """User + system CPU time of a process (Linux /proc)"""
+    try:
+        fields = Path(f'/proc/{pid}/stat').read_text().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def render_stats(timings: List[Dict[str, float]]) -> Dict:
+    """Server-side render and signing times, and what signing adds to a render"""
+    stats = {'invoices': len(timings)}
+    for name in ('render_ms', 'sign_ms'):
+        values = sorted(t[name] for t in timings if name in t)
+        if values:
+            stats[name] = {
+                'mean': round(sum(values) / len(values), 1),
+                **{label: percentile(values, p) for label, p in (('p50', 50), ('p95', 95), ('max', 100))}
+            }
+    signed = [t for t in timings if 'sign_ms' in t]
+    if signed:
+        render_total = sum(t['render_ms'] for t in signed)
+        sign_total = sum(t['sign_ms'] for t in signed)
+        stats['signed'] = len(signed)
+        stats['signing_overhead'] = round(sign_total / render_total, 3) if render_total else 0.0
+        stats['signatures_per_s'] = round(len(signed) / (sign_total / 1000), 1) if sign_total else 0.0
+    return stats
+
+
+def summarize(results: List[Result], elapsed: float, worker_cpu: Dict[int, float],
+              timings: Optional[List[Dict[str, float]]] = None) -> Dict:
+    """Throughput, latency percentiles, status counts, CPU per worker and render timings"""
+    groups = defaultdict(list)
+    for result in results:
+        groups[result.group].append(result)
+
+    def stats(items: List[Result]) -> Dict:
+        latencies = sorted(r.latency for r in items)
+        statuses = Counter(r.status for r in items)
+        errors = sum(n for status, n in statuses.items() if status == 0 or status >= 500)
+        return {
+            'requests': len(items),
+            'throughput_rps': round(len(items) / elapsed, 2) if elapsed else 0.0,
+            'error_rate': round(errors / len(items), 4) if items else 0.0,
+            'throttled': statuses.get(429, 0),
+            'latency_ms': {
+                name: round(percentile(latencies, p) * 1000, 1)
+                for name, p in (('p50', 50), ('p90', 90), ('p95', 95), ('p99', 99), ('max', 100))
+            },
+            'status': {str(status): n for status, n in sorted(statuses.items())}
+        }
+
+    return {
+        'elapsed_s': round(elapsed, 2),
+        'total': stats(results),
+        'routes': {group: stats(items) for group, items in sorted(groups.items())},
+        'worker_cpu': {
+            str(pid): {'cpu_s': round(cpu, 2), 'utilization': round(cpu / elapsed, 3) if elapsed else 0.0}
+            for pid, cpu in sorted(worker_cpu.items())
+        },
+        'renders': render_stats(timings or [])
+    }
+
+
+def print_report(report: Dict):
+    total = report['total']
+    print(f"\n{total['requests']} requests in {report['elapsed_s']}s "
+          f"= {total['throughput_rps']} req/s, error rate {total['error_rate']:.2%}, "
+          f"{total['throttled']} throttled")
+    print(f"\n{'route':<36} {'reqs':>6} {'rps':>8} {'err':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for group, stats in report['routes'].items():
+        lat = stats['latency_ms']
+        print(f"{group[:36]:<36} {stats['requests']:>6} {stats['throughput_rps']:>8} "
+              f"{stats['error_rate']:>7.2%} {lat['p50']:>8} {lat['p95']:>8} {lat['p99']:>8} {lat['max']:>8}")
+    if report['worker_cpu']:
+        print("\nworker pid   CPU s   utilization")
+        for pid, cpu in report['worker_cpu'].items():
+            print(f"{pid:>10} {cpu['cpu_s']:>7} {cpu['utilization']:>12.1%}")
+    renders = report['renders']
+    if renders['invoices']:
+        print(f"\n{renders['invoices']} invoices rendered (server side, ms)")
+        print(f"{'stage':<10} {'mean':>8} {'p50':>8} {'p95':>8} {'max':>8}")
+        for name in ('render_ms', 'sign_ms'):
+            if name in renders:
+                stage = renders[name]
+                print(f"{name[:-3]:<10} {stage['mean']:>8} {stage['p50']:>8} {stage['p95']:>8} {stage['max']:>8}")
+        if 'signed' in renders:
+            print(f"signing adds {renders['signing_overhead']:.1%} to render time, "
+                  f"{renders['signatures_per_s']} signatures/s per worker thread")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('logs', nargs='+', type=Path, help='gunicorn access log files')
+    parser.add_argument('--url', default=None, help='Target (default: the instance started with --start)')
+    parser.add_argument('--start', action='store_true', help='Start gunicorn with gunicorn_config.py')
+    parser.add_argument('--port', type=int, default=8765, help='Port for --start')
+    parser.add_argument('--workers', type=int, help='Override workers for --start')
+    parser.add_argument('--threads', type=int, help='Override threads for --start')
+    parser.add_argument('--timeout', type=int, help='Override the worker timeout for --start')
+    parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight')
+    parser.add_argument('--requests', type=int, default=1000, help='Requests to send (closed loop)')
+    parser.add_argument('--replay', action='store_true', help='Keep the original request timing')
+    parser.add_argument('--speed', type=float, default=1.0, help='Time compression for --replay')
+    parser.add_argument('--generate-ratio', type=float, default=0.2,
+                        help='Share of requests replaced by synthesized invoice renders')
+    parser.add_argument('--max-items', type=int, default=200, help='Largest synthesized invoice')
+    parser.add_argument('--only-ok', action='store_true', help='Skip requests that failed in the log')
+    parser.add_argument('--seed', type=int, help='Random seed for reproducible runs')
+    parser.add_argument('--request-timeout', type=float, default=120.0)
+    parser.add_argument('--json', type=Path, help='Also write the report as JSON')
+    args = parser.parse_args(argv)
+
+    logged = parse_log(args.logs)
+    if args.only_ok:
+        logged = [r for r in logged if r.status < 400]
+    if not logged:
+        parser.error('no requests found in the logs')
+
+    rnd = random.Random(args.seed)
+
+    def pick(request: LoggedRequest) -> Tuple[str, str]:
+        if rnd.random() < args.generate_ratio:
+            return 'POST', GENERATE_PATH
+        return request.method, request.path
+
+    server = None
+    if args.start:
+        server = GunicornServer(args.port, args.workers, args.threads, args.timeout)
+        server.wait_ready()
+    base_url = args.url or f"http://127.0.0.1:{args.port}"
+    runner = LoadRunner(base_url, PayloadFactory(Path('vat_rates.json'), args.max_items, args.seed),
+                        args.request_timeout)
+
+    try:
+        workers = server.worker_pids() if server else []
+        cpu_before = {pid: cpu_seconds(pid) for pid in workers}
+        started = time.monotonic()
+        if args.replay:
+            runner.run_replay([(r.offset,) + pick(r) for r in logged], args.concurrency, args.speed)
+        else:
+            requests = (pick(logged[i % len(logged)]) for i in range(args.requests))
+            runner.run_closed_loop(requests, args.concurrency)
+        elapsed = time.monotonic() - started
+        worker_cpu = {}
+        for pid, before in cpu_before.items():
+            after = cpu_seconds(pid)
+            if before is not None and after is not None:
+                worker_cpu[pid] = after - before
+    finally:
+        if server:
+            server.stop()
+
+    report = summarize(runner.results, elapsed, worker_cpu, server.timings if server else None)
+    print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+    return 0 if report['total']['error_rate'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,556 @@
+"""
+Marketplace order sync
+Pulls new orders from Amazon (SP-API), eBay (Fulfillment API) and Etsy
+(Open API v3) and turns each into an invoice. Every marketplace keeps a
+watermark, so a nightly run only asks for orders changed since the last
+one; orders that already have an invoice are skipped by their marketplace
+order id. Base URLs are configurable, so connectors run against local
+mock APIs as well.
+"""
+
+import http.client
+import json
+import logging
+import queue
+import random
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+from invoice_registry import InvoiceRegistry, InvoiceRecord
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS marketplace_orders (
+    marketplace TEXT NOT NULL,
+    external_id TEXT NOT NULL,
+    order_id TEXT NOT NULL,
+    PRIMARY KEY (marketplace, external_id)
+);
+CREATE TABLE IF NOT EXISTS marketplace_watermarks (
+    marketplace TEXT PRIMARY KEY,
+    synced_until TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class MarketplaceError(Exception):
+    """A marketplace API request failed"""
+
+
+@dataclass
+class MarketplaceOrder:
+    """An order as reported by a marketplace (prices include VAT)"""
+    marketplace: str
+    external_id: str
+    purchased_at: datetime
+    buyer_name: str
+    buyer_country: str
+    currency: str
+    items: List[Dict[str, Any]] = field(default_factory=list)  # product_name, sku, quantity, unit_price, asin
+    shipping_total: float = 0.0
+    buyer_street: str = ''
+    buyer_city: str = ''
+    buyer_postal: str = ''
+    buyer_email: Optional[str] = None
+
+
+def _utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def _iso(value: datetime) -> str:
+    return _utc(value).strftime('%Y-%m-%dT%H:%M:%S.') + f"{_utc(value).microsecond // 1000:03d}Z"
+
+
+def _parse_iso(value: str) -> datetime:
+    return _utc(datetime.fromisoformat(value.replace('Z', '+00:00')))
+
+
+class HttpPool:
+    """
+    Keep-alive connections to one API host, shared by the fetch threads
+
+    Idle connections are reused, so a sync with hundreds of pages costs a
+    handful of TLS handshakes. Rate limits (429) and server errors are
+    retried with backoff, honouring Retry-After.
+    """
+
+    def __init__(self, base_url: str, timeout: float = 30.0, max_attempts: int = 5, backoff: float = 1.0):
+        """
+        Args:
+            base_url: Scheme, host and optional path prefix, e.g. https://api.ebay.com
+            timeout: Socket timeout per request
+            max_attempts: Tries per request before giving up
+            backoff: Base retry delay in seconds, doubled after every failed try
+        """
+        parts = urlsplit(base_url)
+        if parts.scheme not in ('http', 'https') or not parts.netloc:
+            raise ValueError(f"Invalid API base URL: {base_url}")
+        self.https = parts.scheme == 'https'
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self._idle: "queue.LifoQueue[http.client.HTTPConnection]" = queue.LifoQueue()
+
+    def _open(self) -> http.client.HTTPConnection:
+        if self.https:
+            return http.client.HTTPSConnection(self.netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(self.netloc, timeout=self.timeout)
+
+    def get_json(self, path: str, params: Optional[Dict[str, Any]] = None,
+                 headers: Optional[Dict[str, str]] = None) -> Any:
+        """GET a JSON document, retrying transient failures"""
+        url = self.prefix + path
+        if params:
+            url += '?' + urlencode(params)
+        headers = dict(headers or {}, Accept='application/json')
+
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._open()
+            delay = self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            try:
+                conn.request('GET', url, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                # Dropped keep-alive connection or network error
+                conn.close()
+                if attempt == self.max_attempts:
+                    raise MarketplaceError(f"GET {path} failed: {e}") from e
+                time.sleep(delay)
+                continue
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._idle.put(conn)
+
+            status = response.status
+            if status == 429 or status >= 500:
+                if attempt == self.max_attempts:
+                    raise MarketplaceError(f"GET {path} returned {status}")
+                retry_after = response.getheader('Retry-After')
+                try:
+                    delay = max(delay, float(retry_after)) if retry_after else delay
+                except ValueError:
+                    pass
+                time.sleep(delay)
+                continue
+            if status >= 400:
+                raise MarketplaceError(f"GET {path} returned {status}: {body[:300].decode('utf-8', 'replace')}")
+            return json.loads(body) if body else {}
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class MarketplaceConnector:
+    """
+    Base class of the marketplace connectors
+
+    Subclasses implement orders(since, until), yielding every paid order
+    last changed within the window.
+    """
+
+    name = ''
+
+    def __init__(self, base_url: str, page_size: int = 100, concurrency: int = 4, timeout: float = 30.0):
+        """
+        Args:
+            base_url: API root (point it at a mock server for testing)
+            page_size: Orders requested per page
+            concurrency: Pages (or per-order requests) fetched in parallel
+            timeout: Socket timeout per request
+        """
+        self.http = HttpPool(base_url, timeout=timeout)
+        self.page_size = page_size
+        self.concurrency = max(1, concurrency)
+
+    def headers(self) -> Dict[str, str]:
+        return {}
+
+    def get(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        return self.http.get_json(path, params, self.headers())
+
+    def orders(self, since: datetime, until: datetime) -> Iterator[MarketplaceOrder]:
+        raise NotImplementedError
+
+    def _offset_pages(self, fetch: Callable[[int], Tuple[List[Dict], int]], limit: int) -> Iterator[Dict]:
+        """
+        Yield the entries of every page of an offset-paginated listing
+
+        The first page reports the total, the remaining pages are then
+        fetched concurrently (and yielded in order).
+        """
+        entries, total = fetch(0)
+        yield from entries
+        offsets = range(limit, total, limit)
+        if not offsets:
+            return
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=f'{self.name}-fetch') as pool:
+            for entries, _ in pool.map(fetch, offsets):
+                yield from entries
+
+    def close(self):
+        self.http.close()
+
+
+class AmazonConnector(MarketplaceConnector):
+    """Amazon Selling Partner API (Orders v0)"""
+
+    name = 'Amazon'
+
+    def __init__(self, access_token: str, marketplace_ids: List[str],
+                 base_url: str = 'https://sellingpartnerapi-eu.amazon.com', **kwargs):
+        """
+        Args:
+            access_token: Login with Amazon access token (x-amz-access-token)
+            marketplace_ids: Marketplaces to import, e.g. A1PA6795UKMFR9 (amazon.de)
+        """
+        super().__init__(base_url, **kwargs)
+        self.access_token = access_token
+        self.marketplace_ids = marketplace_ids
+
+    def headers(self) -> Dict[str, str]:
+        return {'x-amz-access-token': self.access_token}
+
+    def _order_items(self, amazon_order_id: str) -> List[Dict]:
+        items = []
+        params = None
+        while True:
+            payload = self.get(f'/orders/v0/orders/{amazon_order_id}/orderItems', params)['payload']
+            items.extend(payload.get('OrderItems', []))
+            if not payload.get('NextToken'):
+                return items
+            params = {'NextToken': payload['NextToken']}
+
+    def orders(self, since: datetime, until: datetime) -> Iterator[MarketplaceOrder]:
+        params = {
+            'MarketplaceIds': ','.join(self.marketplace_ids),
+            'LastUpdatedAfter': _iso(since),
+            'LastUpdatedBefore': _iso(until),
+            'OrderStatuses': 'Shipped',
+            'MaxResultsPerPage': min(self.page_size, 100)
+        }
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='Amazon-fetch') as pool:
+            while True:
+                payload = self.get('/orders/v0/orders', params)['payload']
+                orders = payload.get('Orders', [])
+                # Pages are chained by NextToken; line items are one request per order,
+                # so those are fetched in parallel
+                for order, items in zip(orders, pool.map(self._order_items,
+                                                          [o['AmazonOrderId'] for o in orders])):
+                    yield self._convert(order, items)
+                if not payload.get('NextToken'):
+                    return
+                params = {'MarketplaceIds': params['MarketplaceIds'], 'NextToken': payload['NextToken']}
+
+    def _convert(self, order: Dict, items: List[Dict]) -> MarketplaceOrder:
+        address = order.get('ShippingAddress') or {}
+        converted = []
+        shipping = 0.0
+        for item in items:
+            quantity = int(item.get('QuantityOrdered') or 1)
+            converted.append({
+                'product_name': item.get('Title') or item.get('SellerSKU') or 'Item',
+                'sku': item.get('SellerSKU') or '',
+                'quantity': quantity,
+                'unit_price': float((item.get('ItemPrice') or {}).get('Amount') or 0) / quantity,
+                'asin': item.get('ASIN') or 'N/A'
+            })
+            shipping += float((item.get('ShippingPrice') or {}).get('Amount') or 0)
+        return MarketplaceOrder(
+            marketplace=self.name,
+            external_id=order['AmazonOrderId'],
+            purchased_at=_parse_iso(order['PurchaseDate']),
+            buyer_name=address.get('Name') or (order.get('BuyerInfo') or {}).get('BuyerName') or 'Amazon customer',
+            buyer_country=address.get('CountryCode') or '',
+            currency=(order.get('OrderTotal') or {}).get('CurrencyCode') or 'EUR',
+            items=converted,
+            shipping_total=shipping,
+            buyer_street=address.get('AddressLine1') or '',
+            buyer_city=address.get('City') or '',
+            buyer_postal=address.get('PostalCode') or '',
+            buyer_email=(order.get('BuyerInfo') or {}).get('BuyerEmail')
+        )
+
+
+class EbayConnector(MarketplaceConnector):
+    """eBay Sell Fulfillment API"""
+
+    name = 'eBay'
+
+    def __init__(self, access_token: str, base_url: str = 'https://api.ebay.com', **kwargs):
+        """
+        Args:
+            access_token: OAuth user access token
+        """
+        super().__init__(base_url, **kwargs)
+        self.access_token = access_token
+
+    def headers(self) -> Dict[str, str]:
+        return {'Authorization': f'Bearer {self.access_token}'}
+
+    def orders(self, since: datetime, until: datetime) -> Iterator[MarketplaceOrder]:
+        window = f"lastmodifieddate:[{_iso(since)}..{_iso(until)}]"
+        limit = min(self.page_size, 200)
+
+        def fetch(offset: int) -> Tuple[List[Dict], int]:
+            page = self.get('/sell/fulfillment/v1/order', {'filter': window, 'limit': limit, 'offset': offset})
+            return page.get('orders', []), int(page.get('total', 0))
+
+        for order in self._offset_pages(fetch, limit):
+            if order.get('orderPaymentStatus') == 'PAID':
+                yield self._convert(order)
+
+    def _convert(self, order: Dict) -> MarketplaceOrder:
+        instructions = order.get('fulfillmentStartInstructions') or [{}]
+        ship_to = (instructions[0].get('shippingStep') or {}).get('shipTo') or {}
+        address = ship_to.get('contactAddress') or {}
+        pricing = order.get('pricingSummary') or {}
+        items = []
+        for item in order.get('lineItems', []):
+            quantity = int(item.get('quantity') or 1)
+            items.append({
+                'product_name': item.get('title') or 'Item',
+                'sku': item.get('sku') or item.get('legacyItemId') or '',
+                'quantity': quantity,
+                'unit_price': float((item.get('lineItemCost') or {}).get('value') or 0) / quantity,
+                'asin': 'N/A'
+            })
+        return MarketplaceOrder(
+            marketplace=self.name,
+            external_id=order['orderId'],
+            purchased_at=_parse_iso(order['creationDate']),
+            buyer_name=ship_to.get('fullName') or (order.get('buyer') or {}).get('username') or 'eBay customer',
+            buyer_country=address.get('countryCode') or '',
+            currency=(pricing.get('total') or {}).get('currency') or 'EUR',
+            items=items,
+            shipping_total=float((pricing.get('deliveryCost') or {}).get('value') or 0),
+            buyer_street=address.get('addressLine1') or '',
+            buyer_city=address.get('city') or '',
+            buyer_postal=address.get('postalCode') or '',
+            buyer_email=ship_to.get('email')
+        )
+
+
+class EtsyConnector(MarketplaceConnector):
+    """Etsy Open API v3 (shop receipts)"""
+
+    name = 'Etsy'
+
+    def __init__(self, api_key: str, access_token: str, shop_id: str,
+                 base_url: str = 'https://openapi.etsy.com', **kwargs):
+        """
+        Args:
+            api_key: App keystring (x-api-key)
+            access_token: OAuth access token with transactions_r scope
+            shop_id: Numeric shop id
+        """
+        super().__init__(base_url, **kwargs)
+        self.api_key = api_key
+        self.access_token = access_token
+        self.shop_id = shop_id
+
+    def headers(self) -> Dict[str, str]:
+        return {'x-api-key': self.api_key, 'Authorization': f'Bearer {self.access_token}'}
+
+    def orders(self, since: datetime, until: datetime) -> Iterator[MarketplaceOrder]:
+        limit = min(self.page_size, 100)
+        params = {
+            'min_last_modified': int(_utc(since).timestamp()),
+            'max_last_modified': int(_utc(until).timestamp()),
+            'was_paid': 'true',
+            'limit': limit
+        }
+
+        def fetch(offset: int) -> Tuple[List[Dict], int]:
+            page = self.get(f'/v3/application/shops/{self.shop_id}/receipts', dict(params, offset=offset))
+            return page.get('results', []), int(page.get('count', 0))
+
+        for receipt in self._offset_pages(fetch, limit):
+            yield self._convert(receipt)
+
+    @staticmethod
+    def _money(value: Optional[Dict]) -> float:
+        if not value:
+            return 0.0
+        return value.get('amount', 0) / (value.get('divisor') or 100)
+
+    def _convert(self, receipt: Dict) -> MarketplaceOrder:
+        items = []
+        for transaction in receipt.get('transactions', []):
+            items.append({
+                'product_name': transaction.get('title') or 'Item',
+                'sku': transaction.get('sku') or str(transaction.get('listing_id') or ''),
+                'quantity': int(transaction.get('quantity') or 1),
+                'unit_price': self._money(transaction.get('price')),
+                'asin': 'N/A'
+            })
+        street = ' '.join(filter(None, (receipt.get('first_line'), receipt.get('second_line'))))
+        return MarketplaceOrder(
+            marketplace=self.name,
+            external_id=str(receipt['receipt_id']),
+            purchased_at=datetime.fromtimestamp(receipt['create_timestamp'], timezone.utc),
+            buyer_name=receipt.get('name') or 'Etsy customer',
+            buyer_country=receipt.get('country_iso') or '',
+            currency=(receipt.get('grandtotal') or {}).get('currency_code') or 'EUR',
+            items=items,
+            shipping_total=self._money(receipt.get('total_shipping_cost')),
+            buyer_street=street,
+            buyer_city=receipt.get('city') or '',
+            buyer_postal=receipt.get('zip') or '',
+            buyer_email=receipt.get('buyer_email')
+        )
+
+
+MARKETPLACES = {cls.name: cls for cls in (AmazonConnector, EbayConnector, EtsyConnector)}
+
+
+class MarketplaceSync:
+    """
+    Watermarks and imported order ids, stored next to the invoice registry
+
+    The marketplace order id of every synced invoice is recorded in the
+    transaction that registers it, so an order can never be invoiced twice,
+    even when a run is interrupted and repeated.
+    """
+
+    def __init__(self, registry: InvoiceRegistry, overlap: timedelta = timedelta(minutes=15),
+                 batch_size: int = 50):
+        """
+        Args:
+            registry: Invoice registry to attach to (before its first use)
+            overlap: Re-read this much before the watermark, for late-arriving updates
+            batch_size: Invoices registered per transaction
+        """
+        self.registry = registry
+        self.overlap = overlap
+        self.batch_size = max(1, batch_size)
+        registry.add_listener(self._on_commit, schema=SCHEMA)
+
+    @staticmethod
+    def _on_commit(conn: sqlite3.Connection, records: List[InvoiceRecord]):
+        conn.executemany(
+            "INSERT OR IGNORE INTO marketplace_orders (marketplace, external_id, order_id) VALUES (?, ?, ?)",
+            [(r.invoice.sales_channel, r.invoice.seller_order_id, r.invoice.order_id)
+             for r in records if r.invoice.sales_channel in MARKETPLACES]
+        )
+
+    def watermark(self, marketplace: str) -> Optional[datetime]:
+        """End of the last completed sync window"""
+        row = self.registry.connection().execute(
+            "SELECT synced_until FROM marketplace_watermarks WHERE marketplace = ?", (marketplace,)
+        ).fetchone()
+        return _parse_iso(row[0]) if row else None
+
+    def _set_watermark(self, marketplace: str, until: datetime):
+        self.registry.connection().execute(
+            "INSERT OR REPLACE INTO marketplace_watermarks (marketplace, synced_until, updated_at) "
+            "VALUES (?, ?, ?)",
+            (marketplace, _iso(until), time.time())
+        )
+
+    def invoice_for(self, marketplace: str, external_id: str) -> Optional[str]:
+        """Invoice id of an imported order, if any"""
+        row = self.registry.connection().execute(
+            "SELECT order_id FROM marketplace_orders WHERE marketplace = ? AND external_id = ?",
+            (marketplace, external_id)
+        ).fetchone()
+        return row[0] if row else None
+
+    def sync(self, connector: MarketplaceConnector,
+             render: Callable[[MarketplaceOrder, str], InvoiceRecord],
+             register: Callable[[List[InvoiceRecord]], None],
+             discard: Callable[[InvoiceRecord, str], None],
+             since: Optional[datetime] = None, initial: timedelta = timedelta(days=30)) -> Dict[str, Any]:
+        """
+        Invoice the orders of one marketplace changed since its watermark
+
+        Args:
+            connector: Marketplace to read from
+            render: Renders one order's invoice, render(order, batch_id) -> InvoiceRecord
+            register: Persists rendered invoices in one transaction
+            discard: Voids a rendered invoice that cannot be registered, discard(record, reason)
+            since: Start of the window instead of the watermark (re-scan)
+            initial: Window of the very first sync
+
+        Returns:
+            Counts (imported, skipped, failed), the failed order ids and the batch id
+        """
+        name = connector.name
+        # Amazon only lists orders updated at least two minutes ago
+        until = datetime.now(timezone.utc) - timedelta(minutes=2)
+        if since is None:
+            watermark = self.watermark(name)
+            since = watermark - self.overlap if watermark else until - initial
+        since = _utc(since)
+        batch_id = f"{name.lower()}-{until.strftime('%Y%m%dT%H%M%S')}"
+
+        result = {'imported': 0, 'skipped': 0, 'failed': 0, 'failed_orders': [], 'batch_id': batch_id}
+        seen = set()
+        pending: List[InvoiceRecord] = []
+
+        def flush():
+            if pending:
+                register(pending)
+                result['imported'] += len(pending)
+                pending.clear()
+
+        try:
+            for order in connector.orders(since, until):
+                if order.external_id in seen or self.invoice_for(name, order.external_id):
+                    result['skipped'] += 1
+                    continue
+                seen.add(order.external_id)
+                try:
+                    pending.append(render(order, batch_id))
+                except Exception as e:
+                    result['failed'] += 1
+                    result['failed_orders'].append(order.external_id)
+                    logger.error("Cannot invoice %s order %s: %s", name, order.external_id, e,
+                                 extra={'event': 'marketplace_order_failed', 'marketplace': name,
+                                        'external_id': order.external_id})
+                    continue
+                if len(pending) >= self.batch_size:
+                    flush()
+            flush()
+        except BaseException:
+            # Keep what is already numbered and rendered: registered orders are
+            # skipped by the next run. What cannot be registered is voided, so
+            # the numbering shows no silent gap. The watermark stays put.
+            try:
+                flush()
+            except BaseException:
+                logger.exception("Cannot register %d rendered %s invoices", len(pending), name,
+                                 extra={'event': 'marketplace_sync_discard', 'marketplace': name})
+                for record in pending:
+                    discard(record, f"{name} sync interrupted before registration")
+                pending.clear()
+            raise
+
+        # Failed orders are reported rather than holding the watermark back -
+        # re-run with `since` once they are fixed (imported ones are skipped)
+        self._set_watermark(name, until)
+        logger.info("Marketplace sync finished", extra={
+            'event': 'marketplace_sync', 'marketplace': name, 'batch_id': batch_id,
+            'imported': result['imported'], 'skipped': result['skipped'], 'failed': result['failed']
+        })
+        return result
@@ -0,0 +1,200 @@
+"""
+Print runs
+Combines the stored PDFs of many registered invoices into one PDF for postal
+dispatch, so every invoice is printed exactly as it was issued. Pages are
+copied object by object and written out as each invoice is read; only the
+object offsets are kept, so memory stays flat however long the run is.
+Fonts and images are written once and shared by every page that uses the
+same ones, matched by a hash of their content.
+"""
+
+import hashlib
+from collections import deque
+from io import BytesIO
+from pathlib import Path
+from typing import BinaryIO, Callable, Deque, Dict, Iterable, List, Optional, Tuple, Union
+
+from pypdf import PdfReader
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+
+PAGES = 1    # Object number of the combined page tree
+CATALOG = 2  # Object number of the document catalog
+
+
+class MissingInvoiceFile(FileNotFoundError):
+    """The stored PDF of a selected invoice no longer exists"""
+
+
+class _PdfConcatenator:
+    """Appends the pages of PDF files to an output stream, one object at a time"""
+
+    def __init__(self, output: BinaryIO):
+        self._output = output
+        self._position = 0
+        self._offsets: Dict[int, int] = {}
+        self._next_number = CATALOG + 1
+        self._pages: List[int] = []
+        self._shared: Dict[bytes, int] = {}  # Content hash of a font or image -> output object number
+        self._write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, data: bytes):
+        self._output.write(data)
+        self._position += len(data)
+
+    def _reserve(self) -> int:
+        number = self._next_number
+        self._next_number += 1
+        return number
+
+    def _write_object(self, number: int, body: bytes):
+        self._offsets[number] = self._position
+        self._write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+
+    def append(self, path: Path) -> int:
+        """
+        Copy all pages of a PDF (with everything they reference)
+
+        Returns:
+            Number of pages copied
+        """
+        reader = PdfReader(str(path))
+        numbers: Dict[Tuple[int, int], int] = {}  # Source reference -> output object number
+        digests: Dict[Tuple[int, int], bytes] = {}
+        queue: Deque[Tuple[int, IndirectObject]] = deque()
+
+        def digest(obj, hasher, active: set):
+            """Feed an object's content into a hash, following references instead of their numbers"""
+            if isinstance(obj, IndirectObject):
+                key = (obj.idnum, obj.generation)
+                if key in active:  # Reference cycle
+                    hasher.update(b"R")
+                    return
+                if key not in digests:
+                    nested = hashlib.sha256()
+                    digest(obj.get_object(), nested, active | {key})
+                    digests[key] = nested.digest()
+                hasher.update(b"R" + digests[key])
+            elif isinstance(obj, DictionaryObject):
+                hasher.update(b"<<")
+                for key in sorted(obj):
+                    if key != '/Length':
+                        hasher.update(key.encode('utf-8'))
+                        digest(obj[key], hasher, active)
+                hasher.update(b">>")
+                if isinstance(obj, StreamObject):
+                    hasher.update(b"stream%d:" % len(obj._data) + obj._data)
+            elif isinstance(obj, ArrayObject):
+                hasher.update(b"[")
+                for value in obj:
+                    digest(value, hasher, active)
+                hasher.update(b"]")
+            else:
+                buffer = BytesIO()
+                obj.write_to_stream(buffer)
+                hasher.update(buffer.getvalue() + b" ")
+
+        def renumber(reference: IndirectObject) -> int:
+            key = (reference.idnum, reference.generation)
+            if key in numbers:
+                return numbers[key]
+            obj = reference.get_object()
+            shared = None
+            if isinstance(obj, DictionaryObject) and (obj.get('/Type') == '/Font' or obj.get('/Subtype') == '/Image'):
+                hasher = hashlib.sha256()
+                digest(reference, hasher, set())
+                shared = hasher.digest()
+            if shared is not None and shared in self._shared:
+                # Same font or image as an earlier invoice - point to the copy already written
+                numbers[key] = self._shared[shared]
+                return numbers[key]
+            numbers[key] = self._reserve()
+            if shared is not None:
+                self._shared[shared] = numbers[key]
+            queue.append((numbers[key], reference))
+            return numbers[key]
+
+        def serialize(obj, buffer: BytesIO):
+            if isinstance(obj, IndirectObject):
+                buffer.write(b"%d 0 R" % renumber(obj))
+            elif isinstance(obj, DictionaryObject):
+                data = obj._data if isinstance(obj, StreamObject) else None  # Raw (still encoded) bytes
+                page = obj.get('/Type') == '/Page'
+                buffer.write(b"<<")
+                for key, value in obj.items():
+                    # Pages move into the combined page tree; the source tree stays behind
+                    if (page and key == '/Parent') or (data is not None and key == '/Length'):
+                        continue
+                    buffer.write(b"\n")
+                    key.write_to_stream(buffer)
+                    buffer.write(b" ")
+                    serialize(value, buffer)
+                if page:
+                    buffer.write(b"\n/Parent %d 0 R" % PAGES)
+                if data is not None:
+                    buffer.write(b"\n/Length %d\n>>\nstream\n" % len(data) + data + b"\nendstream")
+                else:
+                    buffer.write(b"\n>>")
+            elif isinstance(obj, ArrayObject):
+                buffer.write(b"[")
+                for value in obj:
+                    buffer.write(b" ")
+                    serialize(value, buffer)
+                buffer.write(b" ]")
+            else:
+                obj.write_to_stream(buffer)
+
+        # Inherited attributes (resources, media box) are already copied onto each page
+        pages = [renumber(page.indirect_reference) for page in reader.pages]
+        self._pages.extend(pages)
+        while queue:
+            number, reference = queue.popleft()
+            buffer = BytesIO()
+            serialize(reference.get_object(), buffer)
+            self._write_object(number, buffer.getvalue())
+        return len(pages)
+
+    def close(self):
+        """Write the page tree, catalog and cross-reference table"""
+        kids = b" ".join(b"%d 0 R" % number for number in self._pages)
+        self._write_object(PAGES, b"<< /Type /Pages /Kids [ %s ] /Count %d >>" % (kids, len(self._pages)))
+        self._write_object(CATALOG, b"<< /Type /Catalog /Pages %d 0 R >>" % PAGES)
+
+        xref = self._position
+        size = self._next_number
+        self._write(b"xref\n0 %d\n0000000000 65535 f \n" % size)
+        for number in range(1, size):
+            self._write(b"%010d 00000 n \n" % self._offsets[number])
+        self._write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, CATALOG, xref))
+
+
+def write_print_run(records: Iterable[Dict], output: Union[Path, BinaryIO],
+                    fetch: Callable[[str], Optional[Path]]) -> int:
+    """
+    Concatenate the stored PDFs of invoices into a single PDF
+
+    Args:
+        records: Registry records in print order (streamed, not held in memory)
+        output: Target file path or binary file object
+        fetch: Local path of a stored invoice file, or None (see storage fetch())
+
+    Returns:
+        Number of invoices written
+
+    Raises:
+        MissingInvoiceFile: If an invoice's PDF is gone (the output is incomplete)
+    """
+    if isinstance(output, Path):
+        with open(output, 'wb') as f:
+            return write_print_run(records, f, fetch)
+
+    concatenator = _PdfConcatenator(output)
+    count = 0
+    for record in records:
+        path = fetch(record['filename'])
+        if path is None:
+            raise MissingInvoiceFile(f"PDF of {record['order_id']} not found: {record['filename']}")
+        concatenator.append(path)
+        count += 1
+    concatenator.close()
+    return count
@@ -0,0 +1,191 @@
+"""
+Product catalog
+Products by SKU in a SQLite file shared by all workers, imported in bulk
+from CSV. Each process keeps the whole catalog in memory: a dict for SKU
+lookups while decoding line items, replaced rather than changed on refresh,
+and a prefix index over names and SKUs for autocomplete. Only products
+changed since the last refresh are read.
+"""
+
+import csv
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from invoice_schema import MAX_AMOUNT, Field, Schema, ValidationError, number, string
+from prefix_index import PrefixIndex, normalize, word_keys
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    sku TEXT PRIMARY KEY,
+    product_name TEXT NOT NULL,
+    unit_price REAL NOT NULL,
+    unit_code TEXT NOT NULL,
+    asin TEXT NOT NULL,
+    version INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_products_version ON products (version);
+"""
+
+UPSERT = (
+    "INSERT INTO products (sku, product_name, unit_price, unit_code, asin, version) "
+    "VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (sku) DO UPDATE SET product_name = excluded.product_name, "
+    "unit_price = excluded.unit_price, unit_code = excluded.unit_code, "
+    "asin = excluded.asin, version = excluded.version"
+)
+
+# Same field names and rules as invoice line items, but name and price are required
+PRODUCT_SCHEMA = Schema([
+    Field('sku', string(max_length=100), required=True),
+    Field('product_name', string(), required=True),
+    Field('unit_price', number(minimum=0, maximum=MAX_AMOUNT), required=True),
+    Field('unit_code', string(max_length=3, upper=True), default='C62'),
+    Field('asin', string(max_length=20), default='N/A'),
+])
+
+
+class Product(NamedTuple):
+    """One catalog entry; fills the line item fields an order leaves out"""
+    sku: str
+    product_name: str
+    unit_price: float
+    unit_code: str
+    asin: str
+
+
+class ProductCatalog:
+    """Products kept in SQLite, mirrored in memory by every process"""
+
+    def __init__(self, db_path: Path):
+        """
+        Args:
+            db_path: SQLite file shared by all workers
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._data_version = None
+        self._version = 0
+        self._products: Dict[str, Product] = {}
+        self._index: PrefixIndex[str] = PrefixIndex()  # Name and SKU keys -> SKU
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def import_csv(self, path: Path, columns: Optional[Dict[str, str]] = None) -> int:
+        """
+        Add or update products from a CSV file in one transaction
+
+        Columns are named like the line item fields (sku, product_name,
+        unit_price, unit_code, asin); a SKU seen again replaces the product.
+
+        Args:
+            path: CSV file
+            columns: Renames CSV columns to product fields, e.g. {'Artikel': 'product_name'}
+
+        Returns:
+            Number of rows imported
+
+        Raises:
+            ValidationError: With every invalid row (nothing is imported)
+        """
+        errors: List[Dict[str, str]] = []
+        count = 0
+
+        def rows(version: int) -> Iterator[Tuple]:
+            nonlocal count
+            with open(path, newline='', encoding='utf-8-sig') as f:
+                # Line 1 is the header
+                for line, row in enumerate(csv.DictReader(f), start=2):
+                    row = {(columns or {}).get(key, key): value for key, value in row.items() if key}
+                    before = len(errors)
+                    product = PRODUCT_SCHEMA.decode_into(row, f"line {line}", errors)
+                    if product is not None and len(errors) == before:
+                        count += 1
+                        yield (product['sku'], product['product_name'], product['unit_price'],
+                               product['unit_code'], product['asin'], version)
+
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM products").fetchone()[0]
+            conn.executemany(UPSERT, rows(version))
+            if errors:
+                raise ValidationError(errors)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return count
+
+    def _refresh(self):
+        """Merge products changed by any process since the last call (caller holds the lock)"""
+        if self._conn is None:
+            self._connection()  # Creates the schema
+            self._conn = sqlite3.connect(str(self.db_path), timeout=30.0,
+                                         isolation_level=None, check_same_thread=False)
+        # Changes whenever another connection committed - a cheap check per call
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+
+        rows = self._conn.execute(
+            "SELECT sku, product_name, unit_price, unit_code, asin, version FROM products "
+            "WHERE version > ? ORDER BY version",
+            (self._version,)
+        ).fetchall()
+        if not rows:
+            return
+        # Copy on write: mappings handed out by lookup() never change under their readers
+        products = dict(self._products)
+        added = []
+        for *fields, version in rows:
+            product = Product(*fields)
+            previous = products.get(product.sku)
+            if previous is None:
+                added.append((normalize(product.sku), product.sku))
+            if previous is None or previous.product_name != product.product_name:
+                if previous is not None:
+                    for key in word_keys(previous.product_name):
+                        self._index.remove(key, product.sku)
+                added.extend((key, product.sku) for key in word_keys(product.product_name))
+            products[product.sku] = product
+            self._version = version
+        self._index.add(added)
+        self._products = products
+
+    def lookup(self) -> Dict[str, Product]:
+        """
+        Current products by SKU, for expanding the items of one or many invoices
+
+        Returns:
+            A snapshot that later imports never change (read it, don't modify it)
+        """
+        with self._lock:
+            self._refresh()
+            return self._products
+
+    def search(self, query: str, limit: int = 10) -> List[Dict]:
+        """
+        Products whose name, a later word of it, or SKU starts with `query`
+
+        Returns:
+            Up to `limit` products in key order
+        """
+        with self._lock:
+            self._refresh()
+            skus = self._index.search(normalize(query), limit)
+            return [self._products[sku]._asdict() for sku in skus]
@@ -0,0 +1,141 @@
+"""
+Admission control for expensive endpoints
+Token-bucket rate limiting and a global render concurrency cap,
+both shared across gunicorn worker processes on the same host
+"""
+
+import fcntl
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucketLimiter:
+    """
+    Token bucket per client key, stored in a local SQLite file so that
+    every worker process sees (and drains) the same buckets
+    """
+
+    def __init__(self, db_path: Path, rate: float, burst: float):
+        """
+        Args:
+            db_path: SQLite file shared by all workers
+            rate: Tokens refilled per second (0 or less disables limiting)
+            burst: Bucket capacity (maximum burst size)
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.rate = rate
+        self.burst = burst
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def acquire(self, key: str, cost: float = 1.0) -> Tuple[bool, float]:
+        """
+        Take `cost` tokens from the bucket of `key`
+
+        Returns:
+            (allowed, retry_after) - retry_after is the number of seconds until
+            enough tokens will be available (0 when allowed)
+        """
+        if self.rate <= 0:
+            return True, 0.0
+        cost = min(cost, self.burst)
+        now = time.time()
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    tokens = self.burst
+                else:
+                    tokens = min(self.burst, row[0] + (now - row[1]) * self.rate)
+
+                allowed = tokens >= cost
+                if allowed:
+                    tokens -= cost
+
+                conn.execute(
+                    "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                    (key, tokens, now)
+                )
+
+                # Occasionally drop buckets that have long since refilled
+                if random.random() < 0.01:
+                    conn.execute(
+                        "DELETE FROM buckets WHERE updated < ?",
+                        (now - self.burst / self.rate,)
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            # Never turn a limiter problem into an outage - fail open
+            logger.warning("Rate limiter unavailable, admitting request: %s", e)
+            return True, 0.0
+
+        if allowed:
+            return True, 0.0
+        return False, (cost - tokens) / self.rate
+
+
+class ConcurrencySlots:
+    """
+    Host-wide cap on in-flight work, implemented with one lock file per slot.
+    Locks are released by the kernel if a worker dies, so slots never leak.
+    """
+
+    def __init__(self, lock_dir: Path, slots: int):
+        """
+        Args:
+            lock_dir: Directory holding the slot lock files
+            slots: Maximum number of concurrent holders across all processes
+        """
+        self.lock_dir = Path(lock_dir)
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+        self.slots = max(1, slots)
+
+    @contextmanager
+    def slot(self):
+        """Try to take a free slot without blocking; yields True if one was acquired"""
+        start = random.randrange(self.slots)
+        for i in range(self.slots):
+            path = self.lock_dir / f"slot-{(start + i) % self.slots}.lock"
+            fd = os.open(str(path), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            try:
+                yield True
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+            return
+        yield False
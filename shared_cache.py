@@ -0,0 +1,153 @@
+"""
+Cross-worker shared cache
+A memory-mapped file (put it on tmpfs, e.g. /dev/shm) that every gunicorn
+worker on the host maps, so a file rendered or read by one worker is served
+from memory by all others.
+
+The file is split into equal slots, grouped into small sets by key hash
+(set-associative, like a CPU cache): a key can only live in the slots of
+its set, and inserting into a full set evicts its least recently used
+entry. Readers take no lock - every entry carries a sequence number that
+writers make odd while they change the entry (a seqlock), and a reader
+that sees it change simply treats the lookup as a miss. Writers are
+serialized with flock.
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+MAGIC = b'IGCACHE1'
+# magic, slot count, slot size, ways (slots per set)
+HEADER = struct.Struct('<8sIII')
+HEADER_SIZE = 64
+# Entry header: sequence, key digest, data size, last access (unix time)
+ENTRY = struct.Struct('<Q16sQd')
+ENTRY_SIZE = 48
+SEQ = struct.Struct('<Q')
+STAMP = struct.Struct('<d')
+STAMP_OFFSET = 32
+
+
+class SharedCache:
+    """Bytes by key in a file mapped by all worker processes"""
+
+    def __init__(self, path: Path, size: int, slot_size: int = 256 * 1024, ways: int = 8):
+        """
+        Args:
+            path: Cache file (created, or re-created if its geometry differs)
+            size: Bytes of cached data (rounded down to whole sets)
+            slot_size: Largest value that can be cached
+            ways: Slots per set; more ways get closer to a global LRU but make misses scan more
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.slot_size = slot_size
+        self.ways = ways
+        self.sets = max(1, size // (slot_size * ways))
+        self.slots = self.sets * ways
+        self._data_start = HEADER_SIZE + self.slots * ENTRY_SIZE
+        length = self._data_start + self.slots * slot_size
+        self._lock = threading.Lock()
+
+        expected = HEADER.pack(MAGIC, self.slots, slot_size, ways)
+        while True:
+            self._fd = os.open(str(self.path), os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._fd).st_ino != os.stat(str(self.path)).st_ino:
+                    continue  # Replaced by another process meanwhile
+                if (os.pread(self._fd, HEADER.size, 0) == expected
+                        and os.fstat(self._fd).st_size == length):
+                    self._map = mmap.mmap(self._fd, length)
+                    return
+                # New file or other geometry: swap in an empty (sparse) file, so
+                # workers still mapping the old one keep a valid mapping
+                fd, tmp_name = tempfile.mkstemp(dir=str(self.path.parent), suffix='.tmp')
+                try:
+                    os.ftruncate(fd, length)
+                    os.pwrite(fd, expected, 0)
+                finally:
+                    os.close(fd)
+                os.replace(tmp_name, str(self.path))
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+                if not hasattr(self, '_map'):
+                    os.close(self._fd)
+
+    def _locate(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little') % self.sets * self.ways
+        return digest, first
+
+    def _entry_offset(self, slot: int) -> int:
+        return HEADER_SIZE + slot * ENTRY_SIZE
+
+    def _data_offset(self, slot: int) -> int:
+        return self._data_start + slot * self.slot_size
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Cached value, or None (also while another process is replacing it)"""
+        digest, first = self._locate(key)
+        cache = self._map
+        for slot in range(first, first + self.ways):
+            offset = self._entry_offset(slot)
+            seq, entry_digest, size, _ = ENTRY.unpack_from(cache, offset)
+            if entry_digest != digest or seq & 1 or not size:
+                continue
+            start = self._data_offset(slot)
+            value = cache[start:start + size]
+            if SEQ.unpack_from(cache, offset)[0] != seq:
+                return None  # Replaced while we copied it
+            # Unsynchronized on purpose: a lost update only makes LRU slightly less exact
+            STAMP.pack_into(cache, offset + STAMP_OFFSET, time.time())
+            return value
+        return None
+
+    @contextmanager
+    def _writer(self):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def put(self, key: str, value: bytes) -> bool:
+        """Store a value, evicting the least recently used entry of its set; False if too large"""
+        if len(value) > self.slot_size:
+            return False
+        digest, first = self._locate(key)
+        cache = self._map
+        with self._writer():
+            victim = None
+            oldest = None
+            for slot in range(first, first + self.ways):
+                seq, entry_digest, size, stamp = ENTRY.unpack_from(cache, self._entry_offset(slot))
+                if entry_digest == digest or not size:
+                    victim = slot
+                    break
+                if oldest is None or stamp < oldest:
+                    victim, oldest = slot, stamp
+
+            offset = self._entry_offset(victim)
+            seq = SEQ.unpack_from(cache, offset)[0]
+            seq = seq + 1 if seq % 2 == 0 else seq  # Odd: readers skip the entry
+            SEQ.pack_into(cache, offset, seq)
+            start = self._data_offset(victim)
+            cache[start:start + len(value)] = value
+            ENTRY.pack_into(cache, offset, seq, digest, len(value), time.time())
+            SEQ.pack_into(cache, offset, seq + 1)
+        return True
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
@@ -0,0 +1,132 @@
+"""
+Digital signatures for invoice PDFs
+Signs generated invoices as PAdES baseline (B-B) signatures with a local
+PKCS#12 key. No timestamp authority or revocation lookup is involved, so
+signing works offline. The key and certificate chain are parsed once per
+process and reused for every invoice; each signature is appended as an
+incremental update, so the rendered PDF itself is left as it is.
+"""
+
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+try:
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric.ec import ECDSA
+    from cryptography.hazmat.primitives.asymmetric.padding import PKCS1v15
+    from pyhanko.pdf_utils.incremental_writer import IncrementalPdfFileWriter
+    from pyhanko.sign import signers
+    from pyhanko.sign.fields import SigSeedSubFilter
+except ImportError:  # Optional - only needed with SIGNING_PKCS12
+    signers = None
+
+HASHES = {'sha256': 'SHA256', 'sha384': 'SHA384', 'sha512': 'SHA512'}
+CMS_OVERHEAD = 4096  # bytes besides the certificates: signed attributes, signature (RSA-8192 at most)
+
+
+@dataclass(frozen=True)
+class SigningConfig:
+    """Where the signing key lives and what the signature says (picklable for worker processes)"""
+    pkcs12_path: str
+    passphrase: Optional[str] = None
+    reason: Optional[str] = None
+    location: Optional[str] = None
+    field_name: str = 'InvoiceSignature'
+
+
+if signers is not None:
+    class _LoadedKeySigner(signers.SimpleSigner):
+        """
+        SimpleSigner that decodes its private key once
+
+        SimpleSigner parses and validates the DER key again for every raw
+        signature (twice per PDF, counting the size estimate), which costs
+        far more than the RSA or ECDSA operation itself.
+        """
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._private_key = serialization.load_der_private_key(self.signing_key.dump(), password=None)
+
+        def sign_raw(self, data: bytes, digest_algorithm: str) -> bytes:
+            mechanism = self.get_signature_mechanism_for_digest(digest_algorithm).signature_algo
+            hash_name = HASHES.get(digest_algorithm)
+            if hash_name is not None and mechanism == 'rsassa_pkcs1v15':
+                return self._private_key.sign(data, PKCS1v15(), getattr(hashes, hash_name)())
+            if hash_name is not None and mechanism == 'ecdsa':
+                return self._private_key.sign(data, ECDSA(getattr(hashes, hash_name)()))
+            return super().sign_raw(data, digest_algorithm)
+
+
+class InvoiceSigner:
+    """Signs PDFs in place with a key loaded once"""
+
+    def __init__(self, config: SigningConfig):
+        """
+        Raises:
+            RuntimeError: If pyHanko is not installed
+            ValueError: If the PKCS#12 file cannot be decrypted or holds no key
+        """
+        if signers is None:
+            raise RuntimeError("Install pyHanko to sign invoices")
+        passphrase = config.passphrase.encode('utf-8') if config.passphrase else None
+        data = Path(config.pkcs12_path).read_bytes()
+        try:
+            loaded = signers.SimpleSigner.load_pkcs12_data(data, other_certs=None, passphrase=passphrase)
+        except Exception as e:
+            raise ValueError(f"Cannot load signing key from {config.pkcs12_path}: {e}") from e
+        signer = _LoadedKeySigner(signing_cert=loaded.signing_cert, signing_key=loaded.signing_key,
+                                  cert_registry=loaded.cert_registry)
+        # Room for the CMS container (hex encoded): embedded certificates plus
+        # signed attributes and the signature value. Fixed without a timestamp
+        # or revocation data, so pyHanko's per-document trial signature is skipped.
+        cert_bytes = sum(len(cert.dump()) for cert in [loaded.signing_cert, *loaded.cert_registry])
+        self._bytes_reserved = 2 * (cert_bytes + CMS_OVERHEAD)
+        self._signer = signers.PdfSigner(
+            signers.PdfSignatureMetadata(
+                field_name=config.field_name,
+                md_algorithm='sha256',
+                subfilter=SigSeedSubFilter.PADES,
+                reason=config.reason,
+                location=config.location
+            ),
+            signer=signer
+        )
+
+    def sign(self, path: Path) -> float:
+        """
+        Sign a PDF in place (replaced atomically, readers never see a partial file)
+
+        Returns:
+            Signing time in milliseconds
+        """
+        path = Path(path)
+        started = time.perf_counter()
+        fd, tmp_name = tempfile.mkstemp(dir=str(path.parent), prefix='.', suffix='.signing')
+        try:
+            with open(path, 'rb') as source, os.fdopen(fd, 'wb') as output:
+                self._signer.sign_pdf(IncrementalPdfFileWriter(source), bytes_reserved=self._bytes_reserved,
+                                      output=output)
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        return (time.perf_counter() - started) * 1000
+
+
+# Per process: loaded signers by config and key file version
+_signers: Dict[Tuple[SigningConfig, int], InvoiceSigner] = {}
+
+
+def signer_for(config: SigningConfig) -> InvoiceSigner:
+    """The process-wide signer of a config (reloaded only when the key file changes)"""
+    key = (config, os.stat(config.pkcs12_path).st_mtime_ns)
+    signer = _signers.get(key)
+    if signer is None:
+        _signers.clear()
+        signer = _signers[key] = InvoiceSigner(config)
+    return signer
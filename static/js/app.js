@@ -3,6 +3,10 @@
 let itemCount = 0;
 let currentInvoiceFilename = '';
 
+// Idempotency-Key of the pending submission: a double click or retry of the
+// same form contents returns the same invoice instead of creating another
+let submissionKey = null;
+
 // Persistent Storage Keys
 const STORAGE_KEY = 'invoiceFormData';
 const ITEMS_KEY = 'invoiceItems';
@@ -16,6 +20,7 @@ function saveFormData() {
         buyer_postal: document.getElementById('buyer_postal').value,
         buyer_country: document.getElementById('buyer_country').value,
         buyer_vat_id: document.getElementById('buyer_vat_id').value,
+        buyer_email: document.getElementById('buyer_email').value,
         vat_rate_type: document.getElementById('vat_rate_type').value,
         shipping_total: document.getElementById('shipping_total').value,
         currency: document.getElementById('currency').value,
@@ -55,7 +60,7 @@ function restoreFormData() {
         
         // Restore form fields
         const fields = ['buyer_name', 'buyer_street', 'buyer_city', 'buyer_postal', 'buyer_country', 
-                       'buyer_vat_id', 'vat_rate_type', 'shipping_total', 'currency', 
+                       'buyer_vat_id', 'buyer_email', 'vat_rate_type', 'shipping_total', 'currency', 
                        'shipping_service', 'payment_terms', 'payment_means', 'payment_reference', 'language'];
         
         fields.forEach(field => {
@@ -111,8 +116,8 @@ document.addEventListener('DOMContentLoaded', function() {
         countrySelect.addEventListener('change', updateVATRateDisplay);
         vatTypeSelect.addEventListener('change', updateVATRateDisplay);
         
-        // Initial update if country is pre-selected
-        updateVATRateDisplay();
+        // Initial update if country is pre-selected (once rates are loaded)
+        vatRatesReady.then(updateVATRateDisplay);
     }
     
     // Setup auto-save for all form inputs
@@ -120,6 +125,32 @@ document.addEventListener('DOMContentLoaded', function() {
     if (invoiceForm) {
         invoiceForm.addEventListener('input', saveFormData);
         invoiceForm.addEventListener('change', saveFormData);
+        invoiceForm.addEventListener('input', () => { submissionKey = null; });
+        invoiceForm.addEventListener('input', scheduleQuote);
+        invoiceForm.addEventListener('change', scheduleQuote);
+        scheduleQuote();
+    }
+    
+    // Suggest known customers while typing the name
+    const buyerName = document.getElementById('buyer_name');
+    if (buyerName) {
+        buyerName.addEventListener('input', scheduleCustomerSearch);
+        buyerName.addEventListener('change', applyCustomerSuggestion);
+    }
+    
+    // Suggest catalog products while typing an item name (rows come and go, so listen on the container)
+    const itemsContainer = document.getElementById('itemsContainer');
+    if (itemsContainer) {
+        itemsContainer.addEventListener('input', event => {
+            if (event.target.id.startsWith('product_name_')) {
+                scheduleProductSearch(event.target);
+            }
+        });
+        itemsContainer.addEventListener('change', event => {
+            if (event.target.id.startsWith('product_name_')) {
+                applyProductSuggestion(event.target);
+            }
+        });
     }
 });
 
@@ -163,6 +194,8 @@ function addItem() {
                    id="product_name_${itemCount}" 
                    name="product_name_${itemCount}" 
                    placeholder="Product or service name" 
+                   list="product_suggestions" 
+                   autocomplete="off" 
                    required>
         </div>
         
@@ -230,6 +263,7 @@ function removeItem(itemId) {
         const itemsContainer = document.getElementById('itemsContainer');
         if (itemsContainer.children.length > 1) {
             itemRow.remove();
+            scheduleQuote();
         } else {
             showAlert('You must have at least one item in the invoice', 'error');
         }
@@ -248,6 +282,47 @@ function showAlert(message, type = 'success') {
     }, 5000);
 }
 
+// Collect the invoice form as an API payload
+function collectFormData() {
+    const countryCode = document.getElementById('buyer_country').value;
+    const vatRateType = document.getElementById('vat_rate_type').value;
+    
+    const formData = {
+        buyer_name: document.getElementById('buyer_name').value,
+        buyer_street: document.getElementById('buyer_street').value,
+        buyer_city: document.getElementById('buyer_city').value,
+        buyer_postal: document.getElementById('buyer_postal').value,
+        buyer_country: countryCode,
+        buyer_vat_id: document.getElementById('buyer_vat_id').value,
+        buyer_email: document.getElementById('buyer_email').value,
+        vat_rate_type: vatRateType,
+        shipping_total: parseFloat(document.getElementById('shipping_total').value) || 0,
+        currency: document.getElementById('currency').value,
+        shipping_service: document.getElementById('shipping_service').value,
+        payment_terms: document.getElementById('payment_terms').value,
+        payment_means: document.getElementById('payment_means').value,
+        payment_reference: document.getElementById('payment_reference').value,
+        language: document.getElementById('language').value,
+        items: []
+    };
+    
+    // Collect items
+    const itemRows = document.querySelectorAll('.item-row');
+    itemRows.forEach((row, index) => {
+        const itemId = row.id.split('-')[1];
+        const item = {
+            product_name: document.getElementById(`product_name_${itemId}`).value,
+            sku: document.getElementById(`sku_${itemId}`).value,
+            quantity: parseInt(document.getElementById(`quantity_${itemId}`).value),
+            unit_price: parseFloat(document.getElementById(`unit_price_${itemId}`).value),
+            unit_code: document.getElementById(`unit_code_${itemId}`).value
+        };
+        formData.items.push(item);
+    });
+    
+    return formData;
+}
+
 // Handle form submission
 document.getElementById('invoiceForm').addEventListener('submit', async function(e) {
     e.preventDefault();
@@ -261,40 +336,7 @@ document.getElementById('invoiceForm').addEventListener('submit', async function
         saveFormData();
         
         // Collect form data
-        const countryCode = document.getElementById('buyer_country').value;
-        const vatRateType = document.getElementById('vat_rate_type').value;
-        
-        const formData = {
-            buyer_name: document.getElementById('buyer_name').value,
-            buyer_street: document.getElementById('buyer_street').value,
-            buyer_city: document.getElementById('buyer_city').value,
-            buyer_postal: document.getElementById('buyer_postal').value,
-            buyer_country: countryCode,
-            buyer_vat_id: document.getElementById('buyer_vat_id').value,
-            vat_rate_type: vatRateType,
-            shipping_total: parseFloat(document.getElementById('shipping_total').value) || 0,
-            currency: document.getElementById('currency').value,
-            shipping_service: document.getElementById('shipping_service').value,
-            payment_terms: document.getElementById('payment_terms').value,
-            payment_means: document.getElementById('payment_means').value,
-            payment_reference: document.getElementById('payment_reference').value,
-            language: document.getElementById('language').value,
-            items: []
-        };
-        
-        // Collect items
-        const itemRows = document.querySelectorAll('.item-row');
-        itemRows.forEach((row, index) => {
-            const itemId = row.id.split('-')[1];
-            const item = {
-                product_name: document.getElementById(`product_name_${itemId}`).value,
-                sku: document.getElementById(`sku_${itemId}`).value,
-                quantity: parseInt(document.getElementById(`quantity_${itemId}`).value),
-                unit_price: parseFloat(document.getElementById(`unit_price_${itemId}`).value),
-                unit_code: document.getElementById(`unit_code_${itemId}`).value
-            };
-            formData.items.push(item);
-        });
+        const formData = collectFormData();
         
         // Validate items
         if (formData.items.length === 0) {
@@ -302,10 +344,14 @@ document.getElementById('invoiceForm').addEventListener('submit', async function
         }
         
         // Send to API
+        if (!submissionKey) {
+            submissionKey = crypto.randomUUID();
+        }
         const response = await fetch('/api/generate-invoice', {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'application/json',
+                'Idempotency-Key': submissionKey
             },
             body: JSON.stringify(formData)
         });
@@ -317,14 +363,16 @@ document.getElementById('invoiceForm').addEventListener('submit', async function
         }
         
         // Success! Show download section with preview
+        submissionKey = null;
         currentInvoiceFilename = result.filename;
         document.getElementById('formSection').style.display = 'none';
         document.getElementById('downloadSection').classList.add('show');
         
-        // Load PDF preview
-        const pdfViewer = document.getElementById('pdfViewer');
-        if (pdfViewer) {
-            pdfViewer.src = `/preview/${result.filename}`;
+        // Load first-page thumbnail (the full PDF opens on click)
+        const thumbnail = document.getElementById('invoiceThumbnail');
+        if (thumbnail) {
+            thumbnail.src = `/thumbnail/${result.filename}`;
+            document.getElementById('previewLink').href = `/preview/${result.filename}`;
         }
         
         showAlert('Invoice generated successfully!', 'success');
@@ -364,38 +412,202 @@ function createAnother() {
     window.scrollTo({ top: 0, behavior: 'smooth' });
 }
 
-// Calculate and display total (optional preview feature)
-function calculateTotal() {
-    let subtotal = 0;
-    const itemRows = document.querySelectorAll('.item-row');
+// Live totals: ask the server (no PDF rendering) shortly after the user stops typing
+let quoteTimer = null;
+let quoteController = null;
+
+function scheduleQuote() {
+    clearTimeout(quoteTimer);
+    quoteTimer = setTimeout(updateQuote, 250);
+}
+
+async function updateQuote() {
+    const message = document.getElementById('quote_message');
+    if (!message) {
+        return;
+    }
     
-    itemRows.forEach((row) => {
-        const itemId = row.id.split('-')[1];
-        const quantity = parseFloat(document.getElementById(`quantity_${itemId}`).value) || 0;
-        const unitPrice = parseFloat(document.getElementById(`unit_price_${itemId}`).value) || 0;
-        subtotal += quantity * unitPrice;
-    });
+    const formData = collectFormData();
+    if (!formData.buyer_country || formData.items.length === 0) {
+        message.textContent = 'Select a country and add items to see totals';
+        return;
+    }
     
-    const shipping = parseFloat(document.getElementById('shipping_total').value) || 0;
-    const countryCode = document.getElementById('buyer_country').value;
-    const rateType = document.getElementById('vat_rate_type').value;
+    // Only the latest request matters
+    if (quoteController) {
+        quoteController.abort();
+    }
+    quoteController = new AbortController();
     
-    // Get VAT rate from country
-    let vatRate = 0;
-    if (countryCode) {
-        try {
-            vatRate = getVATRate(countryCode, rateType);
-        } catch (e) {
-            vatRate = 0.19; // Fallback
+    try {
+        const response = await fetch('/api/quote', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify(formData),
+            signal: quoteController.signal
+        });
+        const quote = await response.json();
+        
+        if (!response.ok) {
+            message.textContent = quote.error || 'Totals not available';
+            return;
         }
+        
+        const money = (amount) => `${quote.currency} ${amount.toFixed(2)}`;
+        document.getElementById('quote_net').textContent = money(quote.net_total);
+        document.getElementById('quote_vat_label').textContent = `VAT (${(quote.vat_rate * 100).toFixed(1)}%)`;
+        document.getElementById('quote_vat').textContent = money(quote.vat_amount);
+        document.getElementById('quote_total').textContent = money(quote.grand_total);
+        document.getElementById('quote_due').textContent = quote.due_date;
+        message.textContent = '';
+    } catch (error) {
+        if (error.name !== 'AbortError') {
+            console.error('Error getting totals:', error);
+        }
+    }
+}
+
+// Customer autocomplete: suggestions from /api/customers, picking one fills the address
+let customerTimer = null;
+let customerController = null;
+let customerSuggestions = [];
+
+function scheduleCustomerSearch() {
+    clearTimeout(customerTimer);
+    customerTimer = setTimeout(searchCustomers, 150);
+}
+
+async function searchCustomers() {
+    const list = document.getElementById('customer_suggestions');
+    const query = document.getElementById('buyer_name').value.trim();
+    if (!list || query.length < 2) {
+        return;
+    }
+    
+    // Only the latest request matters
+    if (customerController) {
+        customerController.abort();
     }
+    customerController = new AbortController();
     
-    const total = (subtotal + shipping) * (1 + vatRate);
+    try {
+        const response = await fetch(`/api/customers?q=${encodeURIComponent(query)}`, {
+            signal: customerController.signal
+        });
+        // Customer data needs a signed-in browser - point to the sign-in page instead of failing silently
+        if (response.status === 401 || response.status === 403) {
+            document.getElementById('customer_sign_in').style.display = 'block';
+            return;
+        }
+        if (!response.ok) {
+            return;
+        }
+        customerSuggestions = (await response.json()).customers;
+        
+        list.innerHTML = '';
+        customerSuggestions.forEach(customer => {
+            const option = document.createElement('option');
+            option.value = customer.name;
+            option.label = [customer.postal, customer.city, customer.country].filter(Boolean).join(' ');
+            list.appendChild(option);
+        });
+    } catch (error) {
+        if (error.name !== 'AbortError') {
+            console.error('Error searching customers:', error);
+        }
+    }
+}
+
+function applyCustomerSuggestion() {
+    const name = document.getElementById('buyer_name').value;
+    const customer = customerSuggestions.find(candidate => candidate.name === name);
+    if (!customer) {
+        return;
+    }
     
-    return {
-        subtotal: subtotal.toFixed(2),
-        shipping: shipping.toFixed(2),
-        vat: ((subtotal + shipping) * vatRate).toFixed(2),
-        total: total.toFixed(2)
+    const fields = {
+        buyer_street: customer.street,
+        buyer_city: customer.city,
+        buyer_postal: customer.postal,
+        buyer_country: customer.country,
+        buyer_vat_id: customer.vat_id,
+        buyer_email: customer.email
     };
+    Object.entries(fields).forEach(([field, value]) => {
+        const element = document.getElementById(field);
+        if (element && value) {
+            element.value = value;
+        }
+    });
+    
+    // Country drives the VAT rate; totals and saved data follow the new values
+    updateVATRateDisplay();
+    saveFormData();
+    scheduleQuote();
+}
+
+// Product autocomplete: suggestions from /api/products, picking one fills SKU, price and unit
+let productTimer = null;
+let productController = null;
+let productSuggestions = [];
+
+function scheduleProductSearch(input) {
+    clearTimeout(productTimer);
+    productTimer = setTimeout(() => searchProducts(input.value.trim()), 150);
+}
+
+async function searchProducts(query) {
+    const list = document.getElementById('product_suggestions');
+    if (!list || query.length < 2) {
+        return;
+    }
+    
+    // Only the latest request matters
+    if (productController) {
+        productController.abort();
+    }
+    productController = new AbortController();
+    
+    try {
+        const response = await fetch(`/api/products?q=${encodeURIComponent(query)}`, {
+            signal: productController.signal
+        });
+        // No suggestions if the search fails - items are typed in as before
+        if (!response.ok) {
+            return;
+        }
+        productSuggestions = (await response.json()).products;
+        
+        list.innerHTML = '';
+        productSuggestions.forEach(product => {
+            const option = document.createElement('option');
+            option.value = product.product_name;
+            option.label = `${product.sku} · ${product.unit_price.toFixed(2)}`;
+            list.appendChild(option);
+        });
+    } catch (error) {
+        if (error.name !== 'AbortError') {
+            console.error('Error searching products:', error);
+        }
+    }
+}
+
+function applyProductSuggestion(input) {
+    const product = productSuggestions.find(candidate => candidate.product_name === input.value);
+    if (!product) {
+        return;
+    }
+    
+    const row = input.id.slice('product_name_'.length);
+    document.getElementById(`sku_${row}`).value = product.sku;
+    document.getElementById(`unit_price_${row}`).value = product.unit_price;
+    const unitCode = document.getElementById(`unit_code_${row}`);
+    if ([...unitCode.options].some(option => option.value === product.unit_code)) {
+        unitCode.value = product.unit_code;
+    }
+    
+    saveFormData();
+    scheduleQuote();
 }
@@ -3,10 +3,21 @@
  * Manages company settings configuration
  */
 
+// Company profile being edited (/settings?profile=acme), default profile otherwise
+const profileParam = new URLSearchParams(window.location.search).get('profile');
+const settingsUrl = profileParam
+    ? `/api/company-settings?profile=${encodeURIComponent(profileParam)}`
+    : '/api/company-settings';
+
 // Load existing settings when page loads
 document.addEventListener('DOMContentLoaded', async () => {
     try {
-        const response = await fetch('/api/company-settings');
+        const response = await fetch(settingsUrl);
+        // Settings are only shown to signed-in browsers
+        if (response.status === 401) {
+            window.location.href = `/sign-in?next=${encodeURIComponent(window.location.pathname + window.location.search)}`;
+            return;
+        }
         if (response.ok) {
             const settings = await response.json();
             populateForm(settings);
@@ -41,7 +52,7 @@ document.getElementById('settingsForm').addEventListener('submit', async (e) =>
     });
     
     try {
-        const response = await fetch('/api/company-settings', {
+        const response = await fetch(settingsUrl, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
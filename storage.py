@@ -0,0 +1,224 @@
+"""
+Invoice file storage
+Where generated PDFs live: the local invoice folder, or an S3-compatible
+bucket (AWS S3, MinIO, ...) for durable storage off the host. Only the PDFs
+move; invoice numbers, the registry and the other SQLite data stay local,
+so an S3 deployment is still a single instance. Both backends hand out local file paths, so rendering, thumbnails and
+X-Accel-Redirect keep working on plain files.
+"""
+
+import fcntl
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Set
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.exceptions import ClientError
+except ImportError:  # Optional - only needed for STORAGE_BACKEND=s3
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_MARKER = '.upload'
+UPLOAD_LOCK = '.upload.lock'  # Held by the worker scanning for failed uploads
+TRIM_INTERVAL = 60  # seconds between cache size checks
+RETRY_INTERVAL = 300  # seconds between scans for failed uploads
+
+
+class LocalStorage:
+    """Invoices kept in a local folder"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path_for(self, name: str) -> Path:
+        """Where a new file should be written before commit()"""
+        return self.root / name
+
+    def commit(self, name: str):
+        """Make a file written to path_for(name) durable (nothing to do locally)"""
+
+    def fetch(self, name: str) -> Optional[Path]:
+        """Local path of a stored file, or None if it does not exist"""
+        path = self.root / name
+        return path if path.exists() else None
+
+    def close(self):
+        pass
+
+
+class S3Storage(LocalStorage):
+    """
+    Invoices kept in an S3-compatible bucket
+
+    The local folder acts as write-back and read-through cache: new files are
+    uploaded in the background (multipart for large files) and served from
+    disk meanwhile; files missing locally are downloaded on first access.
+    A marker file (<name>.upload) stays next to each file until its upload
+    succeeded. Every RETRY_INTERVAL one worker (whichever holds the scan
+    lock) re-uploads files whose marker is older than that, which covers
+    failed uploads as well as ones interrupted by a restart.
+    """
+
+    def __init__(self, bucket: str, cache_dir: Path, prefix: str = '', endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None, cache_bytes: int = 512 * 1024 * 1024, upload_workers: int = 4):
+        """
+        Args:
+            bucket: Bucket name
+            cache_dir: Local cache folder (also where new invoices are rendered)
+            prefix: Key prefix inside the bucket
+            endpoint_url: For S3-compatible services such as MinIO
+            region: Bucket region
+            cache_bytes: Size the cache is trimmed to (files awaiting upload are kept)
+            upload_workers: Concurrent background uploads
+        """
+        if boto3 is None:
+            raise RuntimeError("Install boto3 to store invoices in S3")
+        super().__init__(cache_dir)
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.cache_bytes = cache_bytes
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        self.transfer_config = TransferConfig(multipart_threshold=8 * 1024 * 1024,
+                                              multipart_chunksize=8 * 1024 * 1024)
+        self._uploads = ThreadPoolExecutor(max_workers=upload_workers, thread_name_prefix='s3-upload')
+        self._trim_lock = threading.Lock()
+        self._last_trim = 0.0
+        self._queued: Set[str] = set()
+        self._queued_lock = threading.Lock()
+        self._stop = threading.Event()
+        threading.Thread(target=self._retry_loop, name='s3-upload-retry', daemon=True).start()
+
+    def _key(self, name: str) -> str:
+        return self.prefix + name
+
+    def _marker(self, name: str) -> Path:
+        return self.root / (name + UPLOAD_MARKER)
+
+    def _schedule_upload(self, name: str):
+        with self._queued_lock:
+            if name in self._queued:
+                return
+            self._queued.add(name)
+        self._uploads.submit(self._upload, name)
+
+    def _upload(self, name: str):
+        path = self.root / name
+        try:
+            self.client.upload_file(str(path), self.bucket, self._key(name), Config=self.transfer_config)
+        except Exception:
+            # Marker stays, restamped so the next retry is a full interval away
+            logger.exception("Error uploading %s to S3", name, extra={'event': 's3_upload_failed'})
+            self._marker(name).touch()
+            return
+        finally:
+            with self._queued_lock:
+                self._queued.discard(name)
+        self._marker(name).unlink(missing_ok=True)
+
+    def retry_uploads(self, min_age: float = RETRY_INTERVAL) -> int:
+        """
+        Queue the uploads whose marker is older than `min_age` seconds
+
+        Only one worker scans at a time; the others return right away.
+
+        Returns:
+            Number of uploads queued
+        """
+        with open(self.root / UPLOAD_LOCK, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            cutoff = time.time() - min_age
+            count = 0
+            for marker in self.root.glob('*' + UPLOAD_MARKER):
+                name = marker.name[:-len(UPLOAD_MARKER)]
+                try:
+                    # Newer markers belong to uploads still running in some worker
+                    if marker.stat().st_mtime > cutoff:
+                        continue
+                except FileNotFoundError:
+                    continue
+                if not (self.root / name).exists():
+                    marker.unlink(missing_ok=True)
+                    continue
+                self._schedule_upload(name)
+                count += 1
+            return count
+
+    def _retry_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.retry_uploads()
+            except Exception:
+                logger.exception("Error scanning for failed S3 uploads", extra={'event': 's3_retry_failed'})
+            self._stop.wait(RETRY_INTERVAL)
+
+    def commit(self, name: str):
+        """Upload a newly written file in the background"""
+        self._marker(name).touch()
+        self._schedule_upload(name)
+        self._trim()
+
+    def fetch(self, name: str) -> Optional[Path]:
+        path = self.root / name
+        if path.exists():
+            return path
+
+        # Download to a temporary file so concurrent readers never see a partial PDF
+        fd, tmp_name = tempfile.mkstemp(dir=str(self.root), prefix='.', suffix='.download')
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, self._key(name), tmp_name, Config=self.transfer_config)
+            os.replace(tmp_name, path)
+        except ClientError as e:
+            Path(tmp_name).unlink(missing_ok=True)
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                return None
+            raise
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        self._trim()
+        return path
+
+    def _trim(self):
+        """Delete the oldest cached files beyond cache_bytes (never ones awaiting upload)"""
+        if time.monotonic() - self._last_trim < TRIM_INTERVAL or not self._trim_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_trim = time.monotonic()
+            files = []
+            total = 0
+            for entry in os.scandir(self.root):
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                total += stat.st_size
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+            if total <= self.cache_bytes:
+                return
+            files.sort()
+            for _, name, size in files:
+                if total <= self.cache_bytes:
+                    break
+                if name.endswith(UPLOAD_MARKER) or self._marker(name).exists():
+                    continue
+                (self.root / name).unlink(missing_ok=True)
+                total -= size
+        finally:
+            self._trim_lock.release()
+
+    def close(self):
+        """Wait for background uploads to finish"""
+        self._stop.set()
+        self._uploads.shutdown(wait=True)
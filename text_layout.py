@@ -0,0 +1,86 @@
+"""
+Width-aware text layout
+Wraps and shortens text by its rendered width instead of a character
+count. Widths and layouts are memoized per font and size, so the words and
+product names that repeat across invoice lines are measured once per process.
+"""
+
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+ELLIPSIS = "…"
+
+
+@lru_cache(maxsize=65536)
+def text_width(text: str, font: str, size: float) -> float:
+    """Rendered width of `text` in points (cached)"""
+    return stringWidth(text, font, size)
+
+
+def _fit_prefix(text: str, font: str, size: float, max_width: float, suffix: str = '') -> int:
+    """Length of the longest prefix of `text` that fits into max_width together with `suffix`"""
+    budget = max_width - (text_width(suffix, font, size) if suffix else 0.0)
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if stringWidth(text[:mid], font, size) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+@lru_cache(maxsize=65536)
+def ellipsize(text: str, font: str, size: float, max_width: float) -> str:
+    """`text` itself if it fits into max_width, else its longest prefix that fits followed by '…'"""
+    if text_width(text, font, size) <= max_width:
+        return text
+    keep = _fit_prefix(text, font, size, max_width, ELLIPSIS)
+    return text[:keep].rstrip() + ELLIPSIS
+
+
+@lru_cache(maxsize=65536)
+def wrap(text: str, font: str, size: float, max_width: float, max_lines: Optional[int] = None) -> Tuple[str, ...]:
+    """
+    Break `text` into lines no wider than max_width
+
+    Lines break between words; a single word wider than a line is split.
+    With max_lines, the last line is shortened with '…' if text remains.
+
+    Returns:
+        At least one line (possibly empty)
+    """
+    if text_width(text, font, size) <= max_width:
+        return (text,)
+
+    space = text_width(' ', font, size)
+    lines: List[str] = []
+    line: List[str] = []
+    line_width = 0.0
+    for word in text.split():
+        width = text_width(word, font, size)
+        if line and line_width + space + width <= max_width:
+            line.append(word)
+            line_width += space + width
+            continue
+        if line:
+            lines.append(' '.join(line))
+        # Words longer than a whole line are split wherever they must
+        while width > max_width:
+            keep = max(1, _fit_prefix(word, font, size, max_width))
+            lines.append(word[:keep])
+            word = word[keep:]
+            width = text_width(word, font, size)
+        line = [word]
+        line_width = width
+        if max_lines is not None and len(lines) > max_lines:
+            break  # The rest is cut off anyway
+    else:
+        lines.append(' '.join(line))
+
+    if max_lines is not None and len(lines) > max_lines:
+        rest = ' '.join(lines[max_lines - 1:])
+        lines = lines[:max_lines - 1] + [ellipsize(rest, font, size, max_width)]
+    return tuple(lines)
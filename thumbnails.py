@@ -0,0 +1,108 @@
+"""
+First-page thumbnails of invoice PDFs
+Rasterizes page 1 once with PDFium (pypdfium2), falling back to poppler's
+pdftoppm, and caches the image next to the PDF
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+try:
+    import pypdfium2
+except ImportError:  # Optional - pdftoppm is used instead
+    pypdfium2 = None
+
+
+THUMBNAIL_WIDTH = 600  # pixels
+
+# PDFium is not thread-safe: every call into it, including closing its objects, holds this lock
+_PDFIUM_LOCK = threading.Lock()
+
+# Output formats: suffix and PIL save options
+FORMATS = {
+    'webp': ('.thumb.webp', {'format': 'WEBP', 'quality': 80, 'method': 4}),
+    'png': ('.thumb.png', {'format': 'PNG', 'optimize': True}),
+}
+
+
+class ThumbnailUnavailable(RuntimeError):
+    """No PDF rasterizer is installed"""
+
+
+def thumbnail_path(pdf_path: Path, fmt: str) -> Path:
+    """Cache location of a PDF's thumbnail"""
+    suffix, _ = FORMATS[fmt]
+    return pdf_path.with_name(pdf_path.stem + suffix)
+
+
+def _rasterize(pdf_path: Path, width: int) -> Image.Image:
+    """Render page 1 of a PDF at the given pixel width"""
+    if pypdfium2 is not None:
+        with _PDFIUM_LOCK:
+            pdf = pypdfium2.PdfDocument(str(pdf_path))
+            try:
+                page = pdf[0]
+                bitmap = page.render(scale=width / page.get_width())
+                try:
+                    # convert() copies, so the image no longer points into PDFium's buffer
+                    return bitmap.to_pil().convert('RGB')
+                finally:
+                    bitmap.close()
+                    page.close()
+            finally:
+                pdf.close()
+
+    pdftoppm = shutil.which('pdftoppm')
+    if pdftoppm is None:
+        raise ThumbnailUnavailable("Install pypdfium2 or poppler-utils to render thumbnails")
+    result = subprocess.run(
+        [pdftoppm, '-png', '-singlefile', '-f', '1', '-l', '1', '-scale-to-x', str(width),
+         '-scale-to-y', '-1', str(pdf_path), '-'],
+        capture_output=True, check=True, timeout=30
+    )
+    return Image.open(BytesIO(result.stdout)).convert('RGB')
+
+
+def get_thumbnail(pdf_path: Path, fmt: str = 'png', cache_dir: Path = None) -> Path:
+    """
+    Path of the cached first-page thumbnail, rendering it if missing or stale
+
+    Args:
+        pdf_path: Source PDF
+        fmt: 'png' or 'webp'
+        cache_dir: Where to cache (defaults to the PDF's directory)
+
+    Raises:
+        ThumbnailUnavailable: If no rasterizer is installed
+    """
+    target = thumbnail_path(pdf_path, fmt)
+    if cache_dir is not None:
+        target = Path(cache_dir) / target.name
+
+    try:
+        if target.stat().st_mtime_ns >= pdf_path.stat().st_mtime_ns:
+            return target
+    except FileNotFoundError:
+        pass
+
+    image = _rasterize(pdf_path, THUMBNAIL_WIDTH)
+    _, options = FORMATS[fmt]
+
+    # Write to a temporary file and rename, so concurrent readers never see a partial image
+    target.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=str(target.parent), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            image.save(f, **options)
+        os.replace(tmp_name, target)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+    return target
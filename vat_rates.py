@@ -0,0 +1,145 @@
+"""
+Effective-dated VAT rate table
+Loads versioned rates from vat_rates.json and answers lookups for any date
+via a per-country bisect index. The file is re-read when it changes on disk,
+so rate updates apply without restarting workers.
+"""
+
+import json
+import logging
+import threading
+import time
+from bisect import bisect_right
+from datetime import date, datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownCountryError(ValueError):
+    """Raised when no VAT rates are known for a country code"""
+
+
+class _CountryRates:
+    """Rate periods of one country, sorted by effective date"""
+
+    __slots__ = ('name', 'starts', 'periods')
+
+    def __init__(self, name: str, starts: List[date], periods: List[Dict[str, float]]):
+        self.name = name
+        self.starts = starts
+        self.periods = periods
+
+    def at(self, on_date: date) -> Dict[str, float]:
+        idx = bisect_right(self.starts, on_date) - 1
+        if idx < 0:
+            # Before the first recorded change - the oldest known rates apply
+            idx = 0
+        return self.periods[idx]
+
+
+def _parse_table(raw: Dict) -> Tuple[str, Dict[str, _CountryRates]]:
+    """Validate the JSON document and build the lookup index"""
+    index = {}
+    for code, country in raw['countries'].items():
+        periods = []
+        for period in country['rates']:
+            start = date.fromisoformat(period['from']) if period.get('from') else date.min
+            periods.append((start, {
+                'standard': float(period['standard']),
+                'reduced': float(period['reduced'])
+            }))
+        if not periods:
+            raise ValueError(f"No rates defined for {code}")
+        periods.sort(key=lambda p: p[0])
+        index[code.upper()] = _CountryRates(
+            country['name'],
+            [start for start, _ in periods],
+            [rates for _, rates in periods]
+        )
+    return str(raw.get('version', '')), index
+
+
+class VatRateTable:
+    """Versioned VAT rates with O(log n) lookups by country and date"""
+
+    def __init__(self, path: Path, check_interval: float = 5.0):
+        """
+        Args:
+            path: JSON rate file
+            check_interval: Minimum seconds between checks for a changed file
+        """
+        self.path = Path(path)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self.version = ''
+        self._index: Dict[str, _CountryRates] = {}
+        self._load()
+
+    def _load(self):
+        mtime = self.path.stat().st_mtime_ns
+        with open(self.path, 'r', encoding='utf-8') as f:
+            version, index = _parse_table(json.load(f))
+        # Swap in one assignment so concurrent readers never see a partial table
+        self.version, self._index, self._mtime = version, index, mtime
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            try:
+                if self.path.stat().st_mtime_ns != self._mtime:
+                    self._load()
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                # Keep serving the last good table
+                logger.error("Error reloading VAT rates from %s: %s", self.path, e)
+
+    def rate(self, country_code: str, rate_type: str = 'standard',
+             on_date: Optional[Union[date, datetime]] = None) -> float:
+        """
+        Get the VAT rate that applied in a country on a given date
+
+        Args:
+            country_code: Two-letter country code (e.g., 'AT', 'DE')
+            rate_type: 'standard' or 'reduced'
+            on_date: Date of supply (defaults to today)
+
+        Returns:
+            VAT rate as decimal (e.g., 0.19 for 19%)
+
+        Raises:
+            UnknownCountryError: If the country is not in the table
+        """
+        self._maybe_reload()
+        country = self._index.get((country_code or '').upper())
+        if country is None:
+            raise UnknownCountryError(f"VAT rate not found for country: {country_code}")
+
+        if on_date is None:
+            on_date = date.today()
+        elif isinstance(on_date, datetime):
+            on_date = on_date.date()
+
+        rates = country.at(on_date)
+        return rates['reduced' if rate_type == 'reduced' else 'standard']
+
+    def snapshot(self, on_date: Optional[date] = None) -> Dict[str, Dict]:
+        """Rates of every country valid on a date, in the shape used by vat-rates.js"""
+        self._maybe_reload()
+        on_date = on_date or date.today()
+        result = {}
+        for code, country in self._index.items():
+            rates = country.at(on_date)
+            result[code] = {
+                'name': country.name,
+                'standard': rates['standard'],
+                'reduced': rates['reduced']
+            }
+        return result
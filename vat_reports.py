@@ -0,0 +1,169 @@
+"""
+VAT / OSS summary reports
+Maintains per-(company profile, quarter, country, currency, rate)
+net/VAT/gross rollups incrementally as invoices are registered, so reports
+never re-read invoices. Each company profile is its own legal entity with
+its own One-Stop-Shop return.
+"""
+
+import math
+import sqlite3
+from datetime import date
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from invoice_registry import InvoiceRegistry, InvoiceRecord
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS vat_rollups (
+    company_profile TEXT NOT NULL,
+    period TEXT NOT NULL,
+    country TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    rate_bp INTEGER NOT NULL,
+    invoice_count INTEGER NOT NULL,
+    net_cents INTEGER NOT NULL,
+    vat_cents INTEGER NOT NULL,
+    gross_cents INTEGER NOT NULL,
+    PRIMARY KEY (company_profile, period, country, currency, rate_bp)
+)
+"""
+
+UPSERT = (
+    "INSERT INTO vat_rollups (company_profile, period, country, currency, rate_bp, invoice_count, "
+    "net_cents, vat_cents, gross_cents) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (company_profile, period, country, currency, rate_bp) DO UPDATE SET "
+    "invoice_count = invoice_count + excluded.invoice_count, "
+    "net_cents = net_cents + excluded.net_cents, "
+    "vat_cents = vat_cents + excluded.vat_cents, "
+    "gross_cents = gross_cents + excluded.gross_cents"
+)
+
+RollupKey = Tuple[str, str, str, str, int]
+
+
+def quarter_of(day: date) -> str:
+    """Reporting period of a date, e.g. 2026-Q3"""
+    return f"{day.year}-Q{(day.month - 1) // 3 + 1}"
+
+
+def to_cents(amount: float) -> int:
+    """Round a money amount to whole cents (half up)"""
+    return int(math.floor(amount * 100 + 0.5))
+
+
+def _accumulate(totals: Dict[RollupKey, List[int]], key: RollupKey,
+                net: float, vat: float, gross: float):
+    entry = totals.get(key)
+    if entry is None:
+        entry = totals[key] = [0, 0, 0, 0]
+    entry[0] += 1
+    entry[1] += to_cents(net)
+    entry[2] += to_cents(vat)
+    entry[3] += to_cents(gross)
+
+
+def _write(conn: sqlite3.Connection, totals: Dict[RollupKey, List[int]]):
+    conn.executemany(UPSERT, [key + tuple(values) for key, values in totals.items()])
+
+
+def _recompute(conn: sqlite3.Connection, profile_column: str = 'company_profile') -> int:
+    """Write the rollups of every stored invoice (into an empty table); returns the invoice count"""
+    totals: Dict[RollupKey, List[int]] = {}
+    count = 0
+    cursor = conn.execute(
+        f"SELECT {profile_column}, invoice_date, buyer_country, currency, vat_rate, "
+        "net_total, vat_amount, grand_total FROM invoices"
+    )
+    for profile, invoice_date, country, currency, vat_rate, net, vat, gross in cursor:
+        key = (profile, quarter_of(date.fromisoformat(invoice_date)), country, currency, round(vat_rate * 10000))
+        _accumulate(totals, key, net, vat, gross)
+        count += 1
+    _write(conn, totals)
+    return count
+
+
+def _migrate(db_path: Path):
+    """Rollups from before they were kept per company profile are recomputed once"""
+    if not Path(db_path).exists():
+        return
+    conn = sqlite3.connect(str(db_path), timeout=30.0, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(vat_rollups)")}
+            if columns and 'company_profile' not in columns:
+                conn.execute("DROP TABLE vat_rollups")
+                conn.execute(SCHEMA)
+                # Registries older than company profiles invoiced only the default one
+                invoice_columns = {row[1] for row in conn.execute("PRAGMA table_info(invoices)")}
+                _recompute(conn, 'company_profile' if 'company_profile' in invoice_columns else "'default'")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+
+class VatReports:
+    """Rollups kept in the registry database and updated in its transactions"""
+
+    def __init__(self, registry: InvoiceRegistry):
+        """
+        Args:
+            registry: Invoice registry to attach to (before its first use)
+        """
+        self.registry = registry
+        _migrate(registry.db_path)
+        registry.add_listener(self._on_commit, schema=SCHEMA)
+
+    def _on_commit(self, conn: sqlite3.Connection, records: List[InvoiceRecord]):
+        totals: Dict[RollupKey, List[int]] = {}
+        for record in records:
+            invoice = record.invoice
+            key = (
+                record.company_profile,
+                quarter_of(record.invoice_date),
+                (invoice.buyer_country or '').upper(),
+                invoice.currency,
+                round(invoice.vat_rate * 10000)
+            )
+            _accumulate(totals, key, invoice.item_subtotal, invoice.vat_amount, invoice.grand_total)
+        _write(conn, totals)
+
+    def report(self, company_profile: str, period: str) -> List[Dict]:
+        """Rollup rows of one company profile and period (e.g. '2026-Q3'), ordered by country and rate"""
+        rows = self.registry.connection().execute(
+            "SELECT country, currency, rate_bp, invoice_count, net_cents, vat_cents, gross_cents "
+            "FROM vat_rollups WHERE company_profile = ? AND period = ? ORDER BY country, currency, rate_bp",
+            (company_profile, period)
+        ).fetchall()
+        return [{
+            'country': country,
+            'currency': currency,
+            'vat_rate': rate_bp / 10000,
+            'invoice_count': count,
+            'net_total': net / 100,
+            'vat_amount': vat / 100,
+            'grand_total': gross / 100
+        } for country, currency, rate_bp, count, net, vat, gross in rows]
+
+    def rebuild(self) -> int:
+        """
+        Recompute all rollups from the stored invoices in one streaming pass
+
+        Returns:
+            Number of invoices processed
+        """
+        conn = self.registry.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM vat_rollups")
+            count = _recompute(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return count